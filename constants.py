@@ -71,6 +71,7 @@ DOWNSCALED_TEST_IMAGES_PATHS_LIST = [
 PATCHES_DIR_PATH = DATA_DIR_ROOT / "patches/256x256"
 PREDICTIONS_DIR_PATH = DATA_DIR_ROOT / "predictions"
 REPORTS_ROOT_DIR_PATH = DATA_DIR_ROOT / "reports"
+BATCH_SIZE_CACHE_FILE_PATH = DATA_DIR_ROOT / "batch_sizes.json"
 IMAGE_PATCH_PATH = DATA_DIR_ROOT / "patches/256x256/1/1/image/1_patch_1.jpg"
 IMAGE_PATH = DATA_DIR_ROOT / "images/_DSC0246/_DSC0246.jpg"
 MASK_PATH = (
@@ -137,14 +138,28 @@ MASK_FALSE_VALUE = 0
 
 PATCH_SIZE = 256
 BATCH_SIZE = 8  # 32 is a frequently used value
+AUTOTUNE_BATCH_SIZE = (
+    False  # probe the fastest batch size fitting in memory, once per machine
+)
+BATCH_SIZE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64]
+BATCH_SIZE_MEMORY_FRACTION = (
+    0.5  # share of the physical memory a tuned batch size may use
+)
 N_CLASSES = 9
 VALIDATION_PROPORTION = 0.2
 TEST_PROPORTION = 0.1
 PATCH_OVERLAP = 40  # 20 not enough, 40 great
+INFERENCE_PATCH_SIZE = PATCH_SIZE  # up to the image size, bigger means less model calls
+JIT_COMPILE_INFERENCE = False  # compile the inference function with XLA
+OVERLAP_BLENDING = "crop"  # "gaussian" or "cosine" average the overlapping predictions
+PREDICTIONS_MEMORY_BUDGET_MB = None  # in MB, to predict by bands of patches rows
 PATCH_COVERAGE_PERCENT_LIMIT = 75
 ENCODER_KERNEL_SIZE = 3
 LINEARIZER_KERNEL_SIZE = 3
 N_CPUS = 4
+MODELS_CACHE_SIZE = 2  # number of loaded models kept in memory for the predictions
+EVALUATION_N_WORKERS = 2  # predictions processes of the test split evaluation
+TILE_CACHE_SIZE_MB = 256  # memory allowed for the predictions kept by a tile cache
 TARGET_HEIGHT = 2176
 TARGET_WIDTH = 3264
 PADDING_TYPE = "same"
@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from pathlib import Path
 
@@ -7,6 +8,7 @@ from utils.image_utils import (
     get_mask_class,
     decode_image,
 )
+from utils.time_utils import traced
 
 
 def turn_mask_into_categorical_tensor(mask_path: Path) -> tf.Tensor:
@@ -86,6 +88,37 @@ def stack_image_masks(
     return stacked_tensor
 
 
+@traced("decode_labels")
+def stack_image_masks_array(image_path: Path, masks_dir_path: Path) -> np.ndarray:
+    """
+    Same labels as stack_image_masks(), in a uint8 array : each mask is decoded once,
+    and the pixels covered by several masks are set to background in one vectorized pass.
+    As in stack_image_masks(), the background masks neither label nor overlap the other masks.
+
+    :param image_path: The source image on which to compute the stacked labels mask.
+    :param masks_dir_path: The masks source directory path.
+    :return: A 2D uint8 array of the image classes.
+    """
+    image_masks_paths = get_image_masks_paths(
+        image_path=image_path, masks_dir_path=masks_dir_path
+    )
+    assert image_masks_paths, f"Image {image_path.name} has no mask in {masks_dir_path}"
+    stacked_array = None
+    for mask_path in image_masks_paths:
+        class_mask = np.asarray(decode_image(mask_path))[:, :, 0] == MASK_TRUE_VALUE
+        if stacked_array is None:
+            stacked_array = np.zeros(class_mask.shape, dtype=np.uint8)
+            masks_count = np.zeros(class_mask.shape, dtype=np.int32)
+        class_number = MAPPING_CLASS_NUMBER[get_mask_class(mask_path)]
+        if class_number == MAPPING_CLASS_NUMBER["background"]:
+            continue
+        stacked_array[class_mask] = class_number
+        masks_count += class_mask
+    # setting the pixels of several masks to background class
+    stacked_array[masks_count > 1] = MAPPING_CLASS_NUMBER["background"]
+    return stacked_array
+
+
 def stack_image_patch_masks(
     image_patch_masks_paths: [Path],
     mapping_class_number: {str: int},
@@ -1,4 +1,5 @@
 import time
+import numpy as np
 import tensorflow as tf
 from pathlib import Path
 from loguru import logger
@@ -12,6 +13,7 @@ from utils.image_utils import (
     get_image_tensor_shape,
     save_tensor_to_jpg,
 )
+from utils.time_utils import traced
 
 
 def extract_image_patches(
@@ -165,97 +167,186 @@ def save_all_images_and_labels_patches(
     )
 
 
-def extract_patches(
+def get_patches_grid_shape(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> (int, int):
+    """
+    Get the number of main patches rows and columns by which an image is cut.
+
+    :param image_height: Height of the image.
+    :param image_width: Width of the image.
+    :param patch_size: Size of the patch.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: The number of vertical and horizontal main patches.
+    """
+    window_stride = (
+        patch_size - patch_overlap
+    )  # number of pixels by which we shift the window at each step of predictions
+    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
+    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
+    return n_vertical_patches, n_horizontal_patches
+
+
+def get_patches_origins(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> np.ndarray:
+    """
+    Get the top-left corner of every patch cut from an image.
+
+    The patches form a grid of (n_vertical_patches + 1) rows and (n_horizontal_patches + 1) columns,
+    listed in row-major order : the last column holds the right side patches, the last row holds
+    the down side patches, and the last patch is the down-right corner.
+
+    :param image_height: Height of the image.
+    :param image_width: Width of the image.
+    :param patch_size: Size of the patch.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: An array of shape (n_patches, 2) with the (row, column) origin of each patch.
+    """
+    assert (
+        patch_size <= image_height and patch_size <= image_width
+    ), f"Patch size {patch_size} is bigger than the image size {image_height}x{image_width}."
+    window_stride = patch_size - patch_overlap
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    rows_origins = np.append(
+        np.arange(n_vertical_patches) * window_stride, image_height - patch_size
+    )
+    columns_origins = np.append(
+        np.arange(n_horizontal_patches) * window_stride, image_width - patch_size
+    )
+    patches_origins = np.stack(
+        np.meshgrid(rows_origins, columns_origins, indexing="ij"), axis=-1
+    ).reshape(-1, 2)
+    return patches_origins
+
+
+def get_patches_view(image_array: np.ndarray, patch_size: int) -> np.ndarray:
+    """
+    Get a zero-copy view of all the patches of size patch_size contained in the image.
+
+    :param image_array: An image array of shape (height, width, channels).
+    :param patch_size: Size of the patch.
+    :return: A read-only view of shape (height - patch_size + 1, width - patch_size + 1, patch_size, patch_size, channels),
+    where view[row, column] is the patch whose top-left corner is (row, column).
+    """
+    return np.lib.stride_tricks.sliding_window_view(
+        x=image_array, window_shape=(patch_size, patch_size), axis=(0, 1)
+    ).transpose(0, 1, 3, 4, 2)
+
+
+@traced("extract_patches")
+def extract_patches_array(
     image_tensor: tf.Tensor,
     patch_size: int,
     patch_overlap: int,
     with_four_channels: bool = False,
-) -> [tf.Tensor]:
+) -> (np.ndarray, np.ndarray):
     """
-    Split an image into smaller patches.
+    Split an image into overlapping patches, in one vectorized pass.
     Padding is by default implemented as "VALID", meaning that only patches which are fully
     contained in the input image are included.
 
-    :param image_tensor: Path of the image we want to cut into patches.
+    The patches are gathered from a strided view of the decoded image,
+    so that the only allocation is the output array itself.
+
+    :param image_tensor: The image tensor we want to cut into patches.
     :param patch_size: Size of the patch.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param with_four_channels: Set it to True if the image is a PNG. Default to False for JPEG.
-    :return: A list of patches of the original image.
+    :return: An array of shape (n_patches, patch_size, patch_size, 3) and the (n_patches, 2) array of their origins,
+    in the order given by get_patches_origins().
     """
-    image_tensor = tf.expand_dims(image_tensor, 0)
+    image_array = np.asarray(image_tensor)
     # if the image is a png, drop the brightness channel
     if with_four_channels:
-        image_tensor = image_tensor[:, :, :, :3]
+        image_array = image_array[:, :, :3]
 
-    image_height, image_width, channels_number = get_image_tensor_shape(
-        image_tensor=image_tensor
+    image_height, image_width = image_array.shape[:2]
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
     )
-    window_stride = (
-        patch_size - patch_overlap
-    )  # number of pixels by which we shift the window at each step of predictions
+    patches_view = get_patches_view(image_array=image_array, patch_size=patch_size)
+    patches = patches_view[patches_origins[:, 0], patches_origins[:, 1]]
 
-    main_patches = list()
-    right_side_patches = list()
-    row_idx = 0
-    while row_idx + patch_size <= image_height:
-        column_idx = 0
-        while column_idx + patch_size <= image_width:
-            patch = image_tensor[
-                :,
-                row_idx : row_idx
-                + patch_size,  # max bound  index is row_idx + patch_size - 1
-                column_idx : column_idx
-                + patch_size,  # max bound index is column_idx + patch_size - 1
-                :,
-            ]
-            main_patches.append(patch[0])
-            column_idx += window_stride
-
-        # extract right side patches
-        down_right_side_patch = image_tensor[
-            :, row_idx : row_idx + patch_size, image_width - patch_size : image_width, :
-        ]
-        right_side_patches.append(down_right_side_patch[0])
-
-        row_idx += window_stride
-
-    # extract down side patches
-    down_side_patches = list()
-    column_idx = 0
-    while column_idx + patch_size <= image_width:
-        down_side_patch = image_tensor[
-            :,
-            image_height - patch_size : image_height,
-            column_idx : column_idx + patch_size,
-            :,
-        ]
-        down_side_patches.append(down_side_patch[0])
-        column_idx += window_stride
-
-    # down-right corner
-    down_right_side_patch = image_tensor[
-        :,
-        image_height - patch_size : image_height,
-        image_width - patch_size : image_width,
-        :,
-    ]
-    right_side_patches.append(down_right_side_patch[0])
+    return patches, patches_origins
 
-    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
-    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
-    assert n_vertical_patches * n_horizontal_patches == len(
-        main_patches
-    ), f"The number of main patches is not the same : original image of size {image_height}x{image_width} should have {n_horizontal_patches * n_vertical_patches} but we have {len(main_patches)} "
-    assert (n_vertical_patches + 1) == len(
-        right_side_patches
-    ), f"The number of right side patches is not the same : is {len(right_side_patches)}, should be {n_vertical_patches + 1}"
-    assert n_horizontal_patches == len(
-        down_side_patches
-    ), f"The number of right side patches is not the same : is {len(down_side_patches)}, should be {n_horizontal_patches}"
 
+def split_patches_grid(
+    patches: np.ndarray, n_vertical_patches: int, n_horizontal_patches: int
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Split the patches listed in the get_patches_origins() order into main, right side and down side patches.
+
+    :param patches: An array of shape (n_patches, ...).
+    :param n_vertical_patches: Number of main patches rows.
+    :param n_horizontal_patches: Number of main patches columns.
+    :return: The main patches (row-major), the right side patches (the down-right corner being the last one)
+    and the down side patches.
+    """
+    patches_grid = patches.reshape(
+        (n_vertical_patches + 1, n_horizontal_patches + 1) + patches.shape[1:]
+    )
+    main_patches = patches_grid[:n_vertical_patches, :n_horizontal_patches].reshape(
+        (n_vertical_patches * n_horizontal_patches,) + patches.shape[1:]
+    )
+    right_side_patches = patches_grid[:, n_horizontal_patches]
+    down_side_patches = patches_grid[n_vertical_patches, :n_horizontal_patches]
     return main_patches, right_side_patches, down_side_patches
 
 
+def extract_patches(
+    image_tensor: tf.Tensor,
+    patch_size: int,
+    patch_overlap: int,
+    with_four_channels: bool = False,
+) -> [tf.Tensor]:
+    """
+    Split an image into smaller patches.
+    Padding is by default implemented as "VALID", meaning that only patches which are fully
+    contained in the input image are included.
+
+    :param image_tensor: Path of the image we want to cut into patches.
+    :param patch_size: Size of the patch.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param with_four_channels: Set it to True if the image is a PNG. Default to False for JPEG.
+    :return: Lists of main, right side and down side patches of the original image.
+    """
+    patches, patches_origins = extract_patches_array(
+        image_tensor=image_tensor,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+        with_four_channels=with_four_channels,
+    )
+    image_height, image_width, channels_number = get_image_tensor_shape(
+        image_tensor=image_tensor
+    )
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    main_patches, right_side_patches, down_side_patches = split_patches_grid(
+        patches=patches,
+        n_vertical_patches=n_vertical_patches,
+        n_horizontal_patches=n_horizontal_patches,
+    )
+
+    return (
+        [tf.constant(patch) for patch in main_patches],
+        [tf.constant(patch) for patch in right_side_patches],
+        [tf.constant(patch) for patch in down_side_patches],
+    )
+
+
 # ------
 # DEBUG
 # save_all_images_and_labels_patches(IMAGES_DIR_PATH, MASKS_DIR_PATH, PATCHES_DIR_PATH, PATCH_SIZE)
@@ -0,0 +1,253 @@
+import json
+import os
+import socket
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+from loguru import logger
+from pathlib import Path
+
+from deep_learning.unet import build_small_unet
+from utils.time_utils import get_formatted_time
+from constants import (
+    BATCH_SIZE_CANDIDATES,
+    BATCH_SIZE_CACHE_FILE_PATH,
+    BATCH_SIZE_MEMORY_FRACTION,
+)
+
+# A bigger batch size is only chosen if it is faster by more than this ratio
+BATCH_SIZE_THROUGHPUT_TOLERANCE = 0.05
+# Number of timed steps per probed batch size, after a first untimed one
+N_PROBE_STEPS = 3
+
+
+class RssSampler:
+    """Sample the resident memory of the process in a background thread, to get its peak over a block of code."""
+
+    def __init__(self, sampling_period: float = 0.01):
+        self.sampling_period = sampling_period
+        self.peak_rss = get_rss_bytes()
+        self.stop_event = threading.Event()
+        self.sampler_thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        while not self.stop_event.wait(self.sampling_period):
+            self.peak_rss = max(self.peak_rss, get_rss_bytes())
+
+    def __enter__(self):
+        if self.peak_rss is not None:
+            self.sampler_thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.peak_rss is not None:
+            self.stop_event.set()
+            self.sampler_thread.join()
+            self.peak_rss = max(self.peak_rss, get_rss_bytes())
+
+
+def get_rss_bytes() -> int:
+    """Get the resident memory of the process, read from /proc. None on the systems without /proc."""
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def get_physical_memory_bytes() -> int:
+    """Get the physical memory of the machine, None if the system does not tell it."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_tuned_batch_size(
+    n_classes: int,
+    patch_size: int,
+    encoder_kernel_size: int,
+    default_batch_size: int,
+    training: bool = False,
+    optimizer: tf.keras.optimizers.Optimizer = None,
+    loss_function: tf.keras.losses.Loss = None,
+    candidate_batch_sizes: [int] = BATCH_SIZE_CANDIDATES,
+    cache_file_path: Path = BATCH_SIZE_CACHE_FILE_PATH,
+) -> int:
+    """
+    Get the batch size with the best throughput on this machine, among the ones whose peak memory fits in BATCH_SIZE_MEMORY_FRACTION of the physical memory.
+    The batch sizes are probed on an untrained model once per (host, model, patch size, inference or training),
+    and the chosen one is kept in a json file : the next calls only read it.
+
+    :param n_classes: Number of classes to map, background excluded.
+    :param patch_size: Size of the patches fed to the model.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param default_batch_size: Batch size used if none of the candidates could be probed.
+    :param training: Whether to probe training steps, or else inference steps.
+    :param optimizer: The optimizer of the training, copied for the probes. Only used for training.
+    :param loss_function: The loss function of the training. Only used for training.
+    :param candidate_batch_sizes: The batch sizes to probe, in increasing order.
+    :param cache_file_path: The json file keeping the chosen batch sizes.
+    :return: The chosen batch size.
+    """
+    cache_key = "|".join(
+        [
+            socket.gethostname(),
+            f"small_unet_{n_classes}_classes_kernel_{encoder_kernel_size}",
+            f"patch_{patch_size}",
+            "training" if training else "inference",
+        ]
+    )
+    batch_sizes_cache = load_batch_sizes_cache(cache_file_path=cache_file_path)
+    if cache_key in batch_sizes_cache:
+        batch_size = batch_sizes_cache[cache_key]["batch_size"]
+        logger.info(f"\nTuned batch size {batch_size} found for {cache_key}.")
+        return batch_size
+
+    logger.info(f"\nTuning the batch size for {cache_key}...")
+    probes = probe_batch_sizes(
+        n_classes=n_classes,
+        patch_size=patch_size,
+        encoder_kernel_size=encoder_kernel_size,
+        training=training,
+        optimizer=optimizer,
+        loss_function=loss_function,
+        candidate_batch_sizes=candidate_batch_sizes,
+    )
+    if not probes:
+        logger.warning(
+            f"\nNo batch size could be probed, the default batch size {default_batch_size} is used."
+        )
+        return default_batch_size
+    chosen_probe = select_batch_size(probes=probes)
+
+    batch_sizes_cache[cache_key] = {**chosen_probe, "date": get_formatted_time()}
+    save_batch_sizes_cache(
+        batch_sizes_cache=batch_sizes_cache, cache_file_path=cache_file_path
+    )
+    logger.info(
+        f"\nBatch size {chosen_probe['batch_size']} chosen for {cache_key} : "
+        f"{chosen_probe['throughput']:.1f} patches/s, peak memory {chosen_probe['peak_rss_mb']} MB."
+    )
+    return chosen_probe["batch_size"]
+
+
+def probe_batch_sizes(
+    n_classes: int,
+    patch_size: int,
+    encoder_kernel_size: int,
+    training: bool,
+    optimizer: tf.keras.optimizers.Optimizer,
+    loss_function: tf.keras.losses.Loss,
+    candidate_batch_sizes: [int],
+) -> [dict]:
+    """
+    Measure the throughput and the peak memory of each candidate batch size, in increasing order.
+    The probes stop at the first batch size which does not fit in memory.
+
+    :return: A list of {"batch_size", "throughput" in patches per second, "peak_rss_mb"} dictionaries, one per fitting batch size.
+    """
+    physical_memory = get_physical_memory_bytes()
+    memory_budget = (
+        None
+        if physical_memory is None
+        else physical_memory * BATCH_SIZE_MEMORY_FRACTION
+    )
+    # the graph is batch-agnostic : the same model runs every candidate
+    model = build_small_unet(
+        n_classes=n_classes,
+        input_shape=patch_size,
+        batch_size=None,
+        encoder_kernel_size=encoder_kernel_size,
+    )
+    if training:
+        assert (
+            optimizer is not None and loss_function is not None
+        ), "The optimizer and the loss function are needed to probe training steps."
+        # a copy, so that the optimizer of the training has no state left by the probes
+        model.compile(
+            optimizer=optimizer.__class__.from_config(optimizer.get_config()),
+            loss=loss_function,
+        )
+        step_function = model.train_on_batch
+    else:
+        step_function = tf.function(lambda patches: model(patches, training=False))
+
+    probes = list()
+    random_generator = np.random.default_rng(0)
+    for batch_size in candidate_batch_sizes:
+        patches = random_generator.integers(
+            0, 256, size=(batch_size, patch_size, patch_size, 3)
+        ).astype(np.float32)
+        labels = np.eye(n_classes + 1, dtype=np.float32)[
+            random_generator.integers(
+                0, n_classes + 1, size=(batch_size, patch_size, patch_size)
+            )
+        ]
+        step_args = (patches, labels) if training else (patches,)
+        try:
+            with RssSampler() as rss_sampler:
+                # the first step traces the function for this batch shape
+                step_function(*step_args)
+                start_time = time.perf_counter()
+                for _ in range(N_PROBE_STEPS):
+                    step_function(*step_args)
+                step_time = (time.perf_counter() - start_time) / N_PROBE_STEPS
+        except tf.errors.ResourceExhaustedError:
+            logger.info(f"\nBatch size {batch_size} : out of memory.")
+            break
+        peak_rss = rss_sampler.peak_rss
+        logger.info(
+            f"\nBatch size {batch_size} : {batch_size / step_time:.1f} patches/s"
+            + ("" if peak_rss is None else f", peak memory {peak_rss // 2 ** 20} MB")
+            + "."
+        )
+        if (
+            memory_budget is not None
+            and peak_rss is not None
+            and peak_rss > memory_budget
+        ):
+            logger.info(
+                f"\nBatch size {batch_size} exceeds the memory budget of {memory_budget // 2 ** 20:.0f} MB."
+            )
+            break
+        probes.append(
+            {
+                "batch_size": batch_size,
+                "throughput": batch_size / step_time,
+                "peak_rss_mb": None if peak_rss is None else int(peak_rss // 2**20),
+            }
+        )
+    return probes
+
+
+def select_batch_size(probes: [dict]) -> dict:
+    """Choose the smallest batch size whose throughput is within BATCH_SIZE_THROUGHPUT_TOLERANCE of the best one."""
+    best_throughput = max(probe["throughput"] for probe in probes)
+    return min(
+        (
+            probe
+            for probe in probes
+            if probe["throughput"]
+            >= (1 - BATCH_SIZE_THROUGHPUT_TOLERANCE) * best_throughput
+        ),
+        key=lambda probe: probe["batch_size"],
+    )
+
+
+def load_batch_sizes_cache(cache_file_path: Path) -> dict:
+    if not Path(cache_file_path).exists():
+        return dict()
+    with open(cache_file_path) as cache_file:
+        return json.load(cache_file)
+
+
+def save_batch_sizes_cache(batch_sizes_cache: dict, cache_file_path: Path) -> None:
+    """Write the json file through a temporary file, so that a concurrent reader never sees a partial file."""
+    cache_file_path = Path(cache_file_path)
+    cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file_path = cache_file_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary_file_path, "w") as temporary_file:
+        json.dump(batch_sizes_cache, temporary_file, indent=2)
+    os.replace(temporary_file_path, cache_file_path)
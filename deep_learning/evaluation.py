@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from pathlib import Path
+
+from dataset_builder.masks_encoder import stack_image_masks_array
+from deep_learning.predictions_pipeline import make_predictions_pipelined
+from deep_learning.predictions_pool import make_predictions_multiprocess
+from utils.time_utils import (
+    get_formatted_time,
+    start_trace,
+    traced,
+    TRACE_FILE_NAME,
+)
+from utils.image_utils import get_image_name_without_extension
+from constants import MAPPING_CLASS_NUMBER
+
+
+def build_evaluation_report(
+    test_images_paths_list: [Path],
+    masks_dir_path: Path,
+    report_dir_path: Path,
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    n_workers: int = 1,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+) -> pd.DataFrame:
+    """
+    Evaluate the model of a report on the labelled test images, and save its confusion matrix and its per-class metrics.
+    The images are predicted one after the other, by n_workers processes or else by the predictions pipeline,
+    while their labels are decoded by a background thread. A single confusion matrix is updated image after image,
+    so that neither the predictions nor the labels of the whole split are held in memory.
+
+    :param test_images_paths_list: The held-out images, whose masks are in masks_dir_path.
+    :param masks_dir_path: The masks source directory path.
+    :param report_dir_path: The report of the model to evaluate. The evaluation is written in its "4_evaluation" folder.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the predictions.
+    :param correlation_filter: The filter to use for correlation.
+    :param n_workers: Number of predictions processes. With 1, the images are predicted in this process by the predictions pipeline.
+    :param overlap_blending: How the overlapping patches are merged, either "crop", "gaussian" or "cosine".
+    :param inference_patch_size: Size of the patches the images are cut into for the predictions, if different from patch_size.
+    :return: The per-class metrics, also saved as a csv file.
+    """
+    assert test_images_paths_list, "No test images to evaluate the model on."
+    evaluation_report_root_path = (
+        report_dir_path / "4_evaluation" / get_formatted_time()
+    )
+    evaluation_report_root_path.mkdir(parents=True)
+
+    predictions_params = {
+        "target_images_paths_list": test_images_paths_list,
+        "checkpoint_dir_path": report_dir_path / "2_model_report",
+        "patch_size": patch_size,
+        "patch_overlap": patch_overlap,
+        "n_classes": n_classes,
+        "batch_size": batch_size,
+        "encoder_kernel_size": encoder_kernel_size,
+        "correlate_predictions_bool": correlate_predictions_bool,
+        "correlation_filter": correlation_filter,
+        "overlap_blending": overlap_blending,
+        "inference_patch_size": inference_patch_size,
+    }
+    if n_workers == 1:
+        images_predictions = make_predictions_pipelined(**predictions_params)
+    else:
+        images_predictions = make_predictions_multiprocess(
+            n_workers=n_workers, **predictions_params
+        )
+
+    # the spans of every stage, in the predictions and in the labels threads, are saved next to the evaluation
+    with start_trace() as tracer:
+        confusion_matrix = np.zeros((n_classes + 1, n_classes + 1), dtype=np.int64)
+        with ThreadPoolExecutor(max_workers=1) as labels_reader:
+            # the labels of the next image are decoded while the current one is predicted
+            labels_futures = [
+                labels_reader.submit(
+                    stack_image_masks_array,
+                    image_path=test_images_paths_list[0],
+                    masks_dir_path=masks_dir_path,
+                )
+            ]
+            for image_idx, (test_image_path, predictions) in enumerate(
+                images_predictions
+            ):
+                if image_idx + 1 < len(test_images_paths_list):
+                    labels_futures.append(
+                        labels_reader.submit(
+                            stack_image_masks_array,
+                            image_path=test_images_paths_list[image_idx + 1],
+                            masks_dir_path=masks_dir_path,
+                        )
+                    )
+                labels_array = labels_futures[image_idx].result()
+                labels_futures[image_idx] = None
+                predictions_array = np.asarray(predictions)
+                assert labels_array.shape == (
+                    predictions_array.shape[0] + patch_overlap,
+                    predictions_array.shape[1] + patch_overlap,
+                ), f"Labels of shape {labels_array.shape} do not match the predictions of shape {predictions_array.shape} with a patch overlap of {patch_overlap}."
+                half_overlap = patch_overlap // 2
+                confusion_matrix += get_confusion_matrix_array(
+                    labels_array=labels_array[
+                        half_overlap : half_overlap + predictions_array.shape[0],
+                        half_overlap : half_overlap + predictions_array.shape[1],
+                    ],
+                    predictions_array=predictions_array,
+                    n_classes=n_classes,
+                )
+                logger.info(
+                    f"\nImage {get_image_name_without_extension(test_image_path)} evaluated ({image_idx + 1}/{len(test_images_paths_list)})."
+                )
+    tracer.save(output_path=evaluation_report_root_path / TRACE_FILE_NAME)
+    tracer.log_stages_durations()
+
+    # the pixels labelled as background are not evaluated, like in get_confusion_matrix()
+    classes_names = list(MAPPING_CLASS_NUMBER)[1 : n_classes + 1]
+    pd.DataFrame(
+        confusion_matrix[1:, 1:], index=classes_names, columns=classes_names
+    ).to_csv(evaluation_report_root_path / "confusion_matrix.csv")
+    classes_metrics = get_classes_metrics(
+        confusion_matrix=confusion_matrix[1:, 1:], classes_names=classes_names
+    )
+    classes_metrics.to_csv(
+        evaluation_report_root_path / "classes_metrics.csv", index=False
+    )
+    logger.info(
+        f"\nMean IoU on {len(test_images_paths_list)} images : {classes_metrics['iou'].iloc[-1]:.4f}."
+        f"\nEvaluation report successfully saved at : {evaluation_report_root_path}"
+    )
+    return classes_metrics
+
+
+@traced("confusion_matrix")
+def get_confusion_matrix_array(
+    labels_array: np.ndarray, predictions_array: np.ndarray, n_classes: int
+) -> np.ndarray:
+    """
+    Count the pixels of each (label, prediction) pair in one np.bincount pass.
+    Up to 15 classes, the pairs indices are computed in uint8.
+
+    :param labels_array: The classes of the pixels.
+    :param predictions_array: The predicted classes of the pixels, of the same shape.
+    :param n_classes: Number of classes, background excluded.
+    :return: The int64 confusion matrix of shape (n_classes + 1, n_classes + 1), labels in rows, background included.
+    """
+    pairs_dtype = np.uint8 if (n_classes + 1) ** 2 <= 256 else np.int64
+    pairs_indices = (
+        labels_array.astype(pairs_dtype).ravel() * pairs_dtype(n_classes + 1)
+        + predictions_array.astype(pairs_dtype).ravel()
+    )
+    return np.bincount(pairs_indices, minlength=(n_classes + 1) ** 2).reshape(
+        (n_classes + 1, n_classes + 1)
+    )
+
+
+def get_classes_metrics(
+    confusion_matrix: np.ndarray, classes_names: [str]
+) -> pd.DataFrame:
+    """
+    Compute the IoU, precision and recall of each class from a confusion matrix, and their means over the classes present in the labels.
+
+    :param confusion_matrix: The confusion matrix, labels in rows and predictions in columns.
+    :param classes_names: The names of the classes, in the confusion matrix order.
+    :return: A dataframe with a row per class, and a last "mean" row.
+    """
+    true_positives = np.diag(confusion_matrix).astype(np.float64)
+    labels_counts = confusion_matrix.sum(axis=1)
+    predictions_counts = confusion_matrix.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        classes_metrics = pd.DataFrame(
+            {
+                "class": classes_names,
+                "support": labels_counts,
+                "iou": true_positives
+                / (labels_counts + predictions_counts - true_positives),
+                "precision": true_positives / predictions_counts,
+                "recall": true_positives / labels_counts,
+            }
+        )
+    present_classes = classes_metrics[classes_metrics["support"] > 0]
+    mean_row = {
+        "class": "mean",
+        "support": int(labels_counts.sum()),
+        "iou": present_classes["iou"].mean(),
+        "precision": present_classes["precision"].mean(),
+        "recall": present_classes["recall"].mean(),
+    }
+    return pd.concat([classes_metrics, pd.DataFrame([mean_row])], ignore_index=True)
@@ -0,0 +1,275 @@
+import time
+import weakref
+import numpy as np
+import tensorflow as tf
+from loguru import logger
+from pathlib import Path
+from typing import Callable
+
+# Inference models already traced for a Keras model, by correlation filter and compilation
+INFERENCE_MODELS_CACHE = weakref.WeakKeyDictionary()
+# Quantized models already loaded in an interpreter, by model path and correlation filter
+QUANTIZED_MODELS_CACHE = dict()
+
+
+class InferenceModel(tf.Module):
+    """
+    Inference-only wrapper of a trained model, whose traced function takes uint8 patches and returns uint8 classes.
+    The optional correlation, the background exclusion and the argmax are done in the graph,
+    so that only the classes, and not the float32 probabilities of every class, are sent back to the host.
+    The function has a fixed input signature, so that it is traced once, and can be compiled with XLA.
+    """
+
+    def __init__(
+        self,
+        model: tf.keras.Model,
+        correlation_filter: np.ndarray = None,
+        jit_compile: bool = False,
+    ):
+        """
+        :param model: The trained model, returning n_classes + 1 probabilities per pixel.
+        :param correlation_filter: The filter used to correlate the probabilities before the argmax, None for no correlation.
+        :param jit_compile: Whether or not to compile the function with XLA, which fuses the convolution, batch normalization and activation layers.
+        """
+        super().__init__(name="inference_model")
+        self.model = model
+        self.n_channels = model.output_shape[-1]
+        # the fixed size model also has a fixed batch size : the smaller batches are padded
+        self.batch_size, input_height, input_width = model.input_shape[:3]
+        self.input_shape = (input_height, input_width)
+        self.correlation_kernel = None
+        if correlation_filter is not None:
+            self.correlation_kernel = get_correlation_kernel(
+                correlation_filter=correlation_filter, n_channels=self.n_channels
+            )
+        self.classes_function = get_compiled_function(
+            function=self.get_classes,
+            input_signature=[
+                tf.TensorSpec(
+                    shape=[self.batch_size, input_height, input_width, 3],
+                    dtype=tf.uint8,
+                )
+            ],
+            jit_compile=jit_compile,
+        )
+        self.tracing_time = None
+        # running totals rather than every latency, the cached model living as long as the process
+        self.steady_state_calls = 0
+        self.steady_state_total_latency = 0.0
+
+    def predict_classes(self, patches: np.ndarray) -> tf.Tensor:
+        """
+        :param patches: A batch of uint8 patches, of shape (batch_size, height, width, 3).
+        :return: The uint8 classes of the patches pixels, of shape (batch_size, height, width), background excluded.
+        """
+        patches = np.asarray(patches)
+        n_patches = len(patches)
+        if self.batch_size is not None and n_patches < self.batch_size:
+            patches = np.concatenate(
+                [
+                    patches,
+                    np.zeros(
+                        (self.batch_size - n_patches,) + tuple(patches.shape[1:]),
+                        dtype=np.uint8,
+                    ),
+                ]
+            )
+        start_time = time.perf_counter()
+        classes = self.classes_function(patches)[:n_patches]
+        # the first call also traces, and compiles, the function
+        if self.tracing_time is None:
+            self.tracing_time = time.perf_counter() - start_time
+        else:
+            self.steady_state_calls += 1
+            self.steady_state_total_latency += time.perf_counter() - start_time
+        return classes
+
+    def get_classes(self, patches: tf.Tensor) -> tf.Tensor:
+        probabilities = self.model(tf.cast(patches, tf.float32), training=False)
+        if self.correlation_kernel is not None:
+            probabilities = correlate_probabilities(
+                probabilities=probabilities, correlation_kernel=self.correlation_kernel
+            )
+        # Remove background predictions so it takes the max on the non background classes
+        # Note : the argmax function shift the classes numbers of -1, that is why we add one just after
+        classes = (
+            tf.argmax(probabilities[:, :, :, 1:], axis=3, output_type=tf.int32) + 1
+        )
+        return tf.cast(classes, tf.uint8)
+
+    def warmup(self, patch_size: int = None) -> float:
+        """
+        Trace, and compile, the function on a blank batch, so that the predictions only pay the steady state latency.
+
+        :param patch_size: Size of the patches, only needed for the shape-agnostic model.
+        :return: The tracing time, in seconds.
+        """
+        input_height, input_width = self.input_shape
+        self.predict_classes(
+            np.zeros(
+                (
+                    self.batch_size or 1,
+                    input_height or patch_size,
+                    input_width or patch_size,
+                    3,
+                ),
+                dtype=np.uint8,
+            )
+        )
+        logger.info(f"\nInference function traced in {self.tracing_time:.2f}s.")
+        return self.tracing_time
+
+    def get_latency_report(self) -> dict:
+        """Get the tracing time apart from the steady state latency per batch, in seconds."""
+        return {
+            "tracing_time": self.tracing_time,
+            "steady_state_calls": self.steady_state_calls,
+            "steady_state_mean_latency": self.steady_state_total_latency
+            / self.steady_state_calls
+            if self.steady_state_calls
+            else None,
+        }
+
+
+def get_compiled_function(
+    function: Callable, input_signature: list, jit_compile: bool
+) -> Callable:
+    """Trace a function with tf.function, and compile it with XLA if jit_compile is True."""
+    try:
+        return tf.function(
+            function, input_signature=input_signature, jit_compile=jit_compile
+        )
+    except TypeError:
+        # before TensorFlow 2.5, jit_compile was named experimental_compile
+        return tf.function(
+            function, input_signature=input_signature, experimental_compile=jit_compile
+        )
+
+
+def get_correlation_kernel(
+    correlation_filter: np.ndarray, n_channels: int
+) -> tf.Tensor:
+    """Turn the correlation filter into a depthwise convolution kernel making the same local weighted average on every class."""
+    normalized_filter = correlation_filter / np.sum(correlation_filter)
+    return tf.constant(
+        np.tile(normalized_filter[:, :, np.newaxis, np.newaxis], (1, 1, n_channels, 1)),
+        dtype=tf.float32,
+    )
+
+
+def correlate_probabilities(
+    probabilities: tf.Tensor, correlation_kernel: tf.Tensor
+) -> tf.Tensor:
+    """Same correlation as correlate_predictions() from the predictions.py module : the borders are extended by reflection."""
+    kernel_height, kernel_width = correlation_kernel.shape[:2]
+    padded_probabilities = tf.pad(
+        tensor=probabilities,
+        paddings=[
+            [0, 0],
+            [kernel_height // 2, kernel_height - 1 - kernel_height // 2],
+            [kernel_width // 2, kernel_width - 1 - kernel_width // 2],
+            [0, 0],
+        ],
+        mode="SYMMETRIC",
+    )
+    return tf.nn.depthwise_conv2d(
+        input=padded_probabilities,
+        filter=correlation_kernel,
+        strides=[1, 1, 1, 1],
+        padding="VALID",
+    )
+
+
+def get_inference_model(
+    model: tf.keras.Model,
+    correlation_filter: np.ndarray = None,
+    jit_compile: bool = False,
+) -> InferenceModel:
+    """Get the inference model of a Keras model, traced once and reused for as long as the Keras model exists."""
+    inference_key = (
+        None
+        if correlation_filter is None
+        else (correlation_filter.shape, correlation_filter.tobytes()),
+        jit_compile,
+    )
+    inference_models = INFERENCE_MODELS_CACHE.setdefault(model, dict())
+    if inference_key not in inference_models:
+        inference_models[inference_key] = InferenceModel(
+            model=model, correlation_filter=correlation_filter, jit_compile=jit_compile
+        )
+    return inference_models[inference_key]
+
+
+class QuantizedInferenceModel:
+    """
+    Run an int8 quantized model, as exported by the quantization.py module, with the TensorFlow Lite interpreter.
+    It has the same predict_classes() interface as the InferenceModel class.
+    """
+
+    def __init__(
+        self,
+        quantized_model_path: Path,
+        correlation_filter: np.ndarray = None,
+        n_threads: int = None,
+    ):
+        """
+        :param quantized_model_path: Path of the .tflite model written by export_quantized_model().
+        :param correlation_filter: The filter used to correlate the probabilities before the argmax, None for no correlation.
+        :param n_threads: Number of threads of the interpreter, None to let it decide.
+        """
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(quantized_model_path), num_threads=n_threads
+        )
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.correlation_kernel = None
+        if correlation_filter is not None:
+            self.correlation_kernel = get_correlation_kernel(
+                correlation_filter=correlation_filter,
+                n_channels=self.interpreter.get_output_details()[0]["shape"][-1],
+            )
+
+    def predict_probabilities(self, patches: np.ndarray) -> np.ndarray:
+        """The interpreter takes one patch at a time : the model is exported with a batch size of 1."""
+        probabilities = list()
+        for patch in patches:
+            self.interpreter.set_tensor(
+                self.input_index, patch[np.newaxis].astype(np.float32)
+            )
+            self.interpreter.invoke()
+            probabilities.append(self.interpreter.get_tensor(self.output_index)[0])
+        return np.stack(probabilities)
+
+    def predict_classes(self, patches: np.ndarray) -> np.ndarray:
+        """
+        :param patches: A batch of uint8 patches, of shape (batch_size, patch_size, patch_size, 3).
+        :return: The uint8 classes of the patches pixels, of shape (batch_size, patch_size, patch_size), background excluded.
+        """
+        probabilities = self.predict_probabilities(patches=np.asarray(patches))
+        if self.correlation_kernel is not None:
+            probabilities = correlate_probabilities(
+                probabilities=probabilities, correlation_kernel=self.correlation_kernel
+            ).numpy()
+        # Remove background predictions so it takes the max on the non background classes
+        return (np.argmax(probabilities[:, :, :, 1:], axis=3) + 1).astype(np.uint8)
+
+
+def load_quantized_model(
+    quantized_model_path: Path, correlation_filter: np.ndarray = None
+) -> QuantizedInferenceModel:
+    """Load a quantized model in an interpreter, once per process."""
+    cache_key = (
+        str(quantized_model_path),
+        Path(quantized_model_path).stat().st_mtime_ns,
+        None
+        if correlation_filter is None
+        else (correlation_filter.shape, correlation_filter.tobytes()),
+    )
+    if cache_key not in QUANTIZED_MODELS_CACHE:
+        logger.info(f"\nLoading the quantized model {quantized_model_path}...")
+        QUANTIZED_MODELS_CACHE[cache_key] = QuantizedInferenceModel(
+            quantized_model_path=quantized_model_path,
+            correlation_filter=correlation_filter,
+        )
+    return QUANTIZED_MODELS_CACHE[cache_key]
@@ -0,0 +1,73 @@
+import gc
+import tensorflow as tf
+from collections import OrderedDict
+from loguru import logger
+from pathlib import Path
+from typing import Callable
+
+from constants import MODELS_CACHE_SIZE
+
+# Loaded models, from the least to the most recently used
+LOADED_MODELS_CACHE = OrderedDict()
+
+
+def get_model_cache_key(checkpoint_dir_path: Path, **architecture_params) -> tuple:
+    """
+    Identify a loaded model by its checkpoint and its architecture.
+    The latest checkpoint modification time is part of the key, so that a model trained again in the same directory is reloaded.
+
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param architecture_params: The parameters the model graph is built with.
+    :return: A hashable key.
+    """
+    filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
+    if filepath is None:
+        raise ValueError(f"No checkpoint found in {checkpoint_dir_path}")
+    checkpoint_mtime = Path(f"{filepath}.index").stat().st_mtime_ns
+    return (
+        str(Path(checkpoint_dir_path).resolve()),
+        filepath,
+        checkpoint_mtime,
+    ) + tuple(sorted(architecture_params.items()))
+
+
+def get_cached_model(
+    cache_key: tuple, load_model_function: Callable[[], tf.keras.Model]
+) -> tf.keras.Model:
+    """
+    Get a model from the cache, or load it with load_model_function and keep it in the cache.
+    The least recently used models are evicted beyond MODELS_CACHE_SIZE models.
+
+    :param cache_key: The key given by get_model_cache_key().
+    :param load_model_function: Function building the model and loading its weights.
+    :return: The loaded model.
+    """
+    if cache_key in LOADED_MODELS_CACHE:
+        LOADED_MODELS_CACHE.move_to_end(cache_key)
+        logger.info("\nModel found in the loaded models cache.")
+        return LOADED_MODELS_CACHE[cache_key]
+
+    model = load_model_function()
+    LOADED_MODELS_CACHE[cache_key] = model
+    while len(LOADED_MODELS_CACHE) > MODELS_CACHE_SIZE:
+        LOADED_MODELS_CACHE.popitem(last=False)
+    return model
+
+
+def evict_cached_models(checkpoint_dir_path: Path = None) -> int:
+    """
+    Remove models from the cache to release their memory.
+
+    :param checkpoint_dir_path: Only evict the models loaded from this directory. Evict all the models if None.
+    :return: The number of evicted models.
+    """
+    if checkpoint_dir_path is None:
+        evicted_keys = list(LOADED_MODELS_CACHE)
+    else:
+        resolved_path = str(Path(checkpoint_dir_path).resolve())
+        evicted_keys = [key for key in LOADED_MODELS_CACHE if key[0] == resolved_path]
+    for key in evicted_keys:
+        del LOADED_MODELS_CACHE[key]
+    gc.collect()
+    logger.info(f"\n{len(evicted_keys)} models evicted from the loaded models cache.")
+    return len(evicted_keys)
@@ -1,75 +1,90 @@
 import scipy
+import tempfile
 import numpy as np
 import tensorflow as tf
 from loguru import logger
 from pathlib import Path
 
-from dataset_builder.patches_generator import extract_patches
+from dataset_builder.patches_generator import (
+    extract_patches_array,
+    get_patches_grid_shape,
+    get_patches_origins,
+    get_patches_view,
+)
 from dataset_builder.masks_encoder import stack_image_masks
-from image_processing.cropping import crop_patch_tensor
+from image_processing.downscaling import downscale_image
+from image_processing.integral_images import get_integral_image, get_boxes_sums
+from image_processing.stitching import (
+    stitch_patches,
+    get_patches_interior_bounds,
+    paste_patches_interiors,
+    blend_patches,
+    get_blending_window,
+)
 from utils.image_utils import (
     decode_image,
     get_image_name_without_extension,
     get_image_tensor_shape,
     get_file_name_with_extension,
 )
-from deep_learning.unet import build_small_unet
+from utils.time_utils import traced
+from deep_learning.unet import (
+    build_small_unet,
+    build_small_unet_arbitrary_input,
+    build_padded_model,
+    SMALL_UNET_INPUT_SIZE_MULTIPLE,
+)
+from deep_learning.inference_model import (
+    get_inference_model,
+    load_quantized_model,
+    QuantizedInferenceModel,
+)
+from deep_learning.model_cache import get_cached_model, get_model_cache_key
+from deep_learning.batch_size_tuning import get_tuned_batch_size
+from deep_learning.tile_cache import TilePredictionCache, get_model_fingerprint
 from constants import MAPPING_CLASS_NUMBER
 
 
+@traced("build_dataset")
 def build_predictions_dataset(
-    target_image_tensor: tf.Tensor, patch_size: int, patch_overlap: int
-) -> (tf.data.Dataset, tf.data.Dataset, tf.data.Dataset):
+    target_image_tensor: tf.Tensor,
+    patch_size: int,
+    patch_overlap: int,
+    batch_size: int,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+) -> (tf.data.Dataset, np.ndarray):
     """
-    Build a dataset of patches to make predictions on each one of them.
+    Build a single dataset of patches to make predictions on each one of them.
+    The main, right side and down side patches are merged in one stream of batches,
+    so that the model is only called once per image.
 
     :param target_image_tensor: Image to make predictions on.
     :param patch_size: Size of the patch.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
-    :return: A Dataset object with tensors of size (1, patch_size, patch_size, 3). Its length corresponds of the number of patches generated.
+    :param batch_size: Number of patches per batch fed to the model.
+    :param prefetch_buffer_size: Number of batches prepared in advance while the model is predicting.
+    :return: A Dataset object with tensors of size (batch_size, patch_size, patch_size, 3),
+    and the (n_patches, 2) array of the patches origins, in the order of the dataset.
     """
     logger.info("\nSlice the image into patches...")
-    (
-        main_patches_tensors_list,
-        right_side_patches_tensors_list,
-        down_side_patches_tensors_list,
-    ) = extract_patches(
+    patches, patches_origins = extract_patches_array(
         image_tensor=target_image_tensor,
         patch_size=patch_size,
         patch_overlap=patch_overlap,
     )
-    prediction_dataset = tf.data.Dataset.from_tensor_slices(main_patches_tensors_list)
-    prediction_dataset = prediction_dataset.batch(batch_size=1, drop_remainder=True)
-
-    right_side_prediction_dataset = tf.data.Dataset.from_tensor_slices(
-        right_side_patches_tensors_list
-    )
-    right_side_prediction_dataset = right_side_prediction_dataset.batch(
-        batch_size=1, drop_remainder=True
-    )
 
-    down_side_prediction_dataset = tf.data.Dataset.from_tensor_slices(
-        down_side_patches_tensors_list
-    )
-    down_side_prediction_dataset = down_side_prediction_dataset.batch(
-        batch_size=1, drop_remainder=True
-    )
+    prediction_dataset = tf.data.Dataset.from_tensor_slices(patches)
+    # the remainder is kept : every patch is needed to rebuild the image
+    prediction_dataset = prediction_dataset.batch(
+        batch_size=batch_size, drop_remainder=False
+    ).prefetch(buffer_size=prefetch_buffer_size)
 
-    logger.info(f"\n{len(prediction_dataset)} patches created successfully.")
-    logger.info(
-        f"\n{len(right_side_prediction_dataset)} right side patches created successfully."
-    )
-    logger.info(
-        f"\n{len(down_side_prediction_dataset)} down side patches created successfully."
-    )
+    logger.info(f"\n{len(patches)} patches created successfully.")
 
-    return (
-        prediction_dataset,
-        right_side_prediction_dataset,
-        down_side_prediction_dataset,
-    )
+    return prediction_dataset, patches_origins
 
 
+@traced("make_predictions")
 def make_predictions(
     target_image_path: Path,
     checkpoint_dir_path: Path,
@@ -81,6 +96,19 @@ def make_predictions(
     correlate_predictions_bool: bool,
     correlation_filter: np.ndarray,
     misclassification_size: int = 5,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+    quantized_model_path: Path = None,
+    jit_compile: bool = False,
+    coarse_downscale_factor: int = None,
+    uncertainty_threshold: float = 0.5,
+    tile_cache: TilePredictionCache = None,
+    uniform_variance_threshold: float = None,
+    uniform_color_tolerance: float = 10.0,
+    evaluate_fast_path: bool = False,
+    autotune_batch_size: bool = False,
+    memory_budget_mb: int = None,
 ) -> tf.Tensor:
     """
     Make predictions on the target image specified with its path.
@@ -91,10 +119,32 @@ def make_predictions(
     :param patch_size: Size of the patches on which the model was trained. This is also the size of the predictions patches.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param n_classes: Number of classes to map, background excluded.
-    :param batch_size: Batch size that was used for the model which is loaded.
+    :param batch_size: Batch size that was used for the model which is loaded. Also the number of patches predicted per model step.
     :param correlate_predictions_bool: Whether or not to apply correlation on the predictions, i.e. make a local weighted mean on each class probability.
     :param correlation_filter: The filter to use for correlation.
     :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+    :param overlap_blending: How the overlapping patches are merged. "crop" keeps the interior of each patch only,
+      "gaussian" or "cosine" make a weighted average of the patches probabilities, which allows a smaller patch overlap.
+    :param inference_patch_size: Size of the patches the image is cut into for the predictions, if different from patch_size.
+      The trained weights are then loaded in the shape-agnostic model. Bigger patches mean less model calls and less overlap recomputed.
+    :param quantized_model_path: Path of an int8 quantized model exported by the quantization.py module, to use instead of the checkpoint.
+      Only the "crop" overlap blending and patches of size patch_size are supported.
+    :param jit_compile: Whether or not to compile the inference function with XLA, in "crop" overlap blending.
+    :param coarse_downscale_factor: If set, the image is first predicted downscaled by this factor,
+      and only the patches with uncertain coarse predictions are predicted at full resolution. See make_predictions_coarse_to_fine().
+      Only the "crop" overlap blending is supported.
+    :param uncertainty_threshold: In coarse-to-fine mode, the coarse predictions whose max probability is below it are uncertain.
+    :param tile_cache: A cache of the patches predictions, so that the patches already predicted by the same model are not predicted again.
+    :param uniform_variance_threshold: If set, the patches whose pixels variance is below it may skip the model, in "crop" overlap blending.
+      See patches_predict_with_fast_path().
+    :param uniform_color_tolerance: Maximum distance between the mean colors of two uniform patches for one to reuse the class of the other.
+    :param evaluate_fast_path: Whether or not to also predict the patches which skipped the model, to report the accuracy of the fast path.
+    :param autotune_batch_size: Whether or not to replace batch_size by the batch size tuned for this machine, see get_tuned_batch_size().
+      The quantized model keeps batch_size, its interpreter runs one patch at a time.
+    :param memory_budget_mb: If set, the image is predicted by bands of patches rows fitting in this memory, in MB,
+      for the full resolution images. See make_predictions_streaming(). Only the "crop" overlap blending,
+      on patches of size patch_size and with the checkpoint model, is supported.
 
     :return: A 2D categorical tensor of size (width, height), width and height being the cropped size of the target image tensor
     """
@@ -102,83 +152,570 @@ def make_predictions(
     assert (
         patch_overlap % 2 == 0
     ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+    if overlap_blending not in ["crop", "gaussian", "cosine"]:
+        raise ValueError(
+            f"Overlap blending {overlap_blending} is unknown : expected crop, gaussian or cosine."
+        )
 
-    image_tensor = decode_image(file_path=target_image_path)
+    if inference_patch_size is None:
+        inference_patch_size = patch_size
+    if quantized_model_path is not None and (
+        overlap_blending != "crop" or inference_patch_size != patch_size
+    ):
+        raise ValueError(
+            "The quantized model only supports the crop overlap blending, on patches of size patch_size."
+        )
+    if autotune_batch_size and quantized_model_path is None:
+        batch_size = get_tuned_batch_size(
+            n_classes=n_classes,
+            patch_size=inference_patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+            default_batch_size=batch_size,
+        )
 
-    # Cut the image into patches of size patch_size
-    # & format the image patches to feed the model.predict function
-    (
-        main_patches_dataset,
-        right_side_patches_dataset,
-        down_side_patches_dataset,
-    ) = build_predictions_dataset(
-        target_image_tensor=image_tensor,
-        patch_size=patch_size,
-        patch_overlap=patch_overlap,
-    )
+    if coarse_downscale_factor is not None:
+        if overlap_blending != "crop":
+            raise ValueError(
+                "The coarse-to-fine predictions only support the crop overlap blending."
+            )
+        return make_predictions_coarse_to_fine(
+            target_image_path=target_image_path,
+            checkpoint_dir_path=checkpoint_dir_path,
+            patch_size=patch_size,
+            patch_overlap=patch_overlap,
+            n_classes=n_classes,
+            batch_size=batch_size,
+            encoder_kernel_size=encoder_kernel_size,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            downscale_factor=coarse_downscale_factor,
+            uncertainty_threshold=uncertainty_threshold,
+            prefetch_buffer_size=prefetch_buffer_size,
+            inference_patch_size=inference_patch_size,
+            quantized_model_path=quantized_model_path,
+            jit_compile=jit_compile,
+            tile_cache=tile_cache,
+        )
+
+    if memory_budget_mb is not None:
+        if (
+            overlap_blending != "crop"
+            or inference_patch_size != patch_size
+            or quantized_model_path is not None
+        ):
+            raise ValueError(
+                "The streaming predictions only support the crop overlap blending, on patches of size patch_size, with the checkpoint model."
+            )
+        with tempfile.TemporaryDirectory() as temporary_dir_path:
+            class_map = make_predictions_streaming(
+                target_image_path=target_image_path,
+                checkpoint_dir_path=checkpoint_dir_path,
+                output_path=Path(temporary_dir_path) / "predictions.npy",
+                patch_size=patch_size,
+                patch_overlap=patch_overlap,
+                n_classes=n_classes,
+                batch_size=batch_size,
+                encoder_kernel_size=encoder_kernel_size,
+                memory_budget_mb=memory_budget_mb,
+                correlate_predictions_bool=correlate_predictions_bool,
+                correlation_filter=correlation_filter,
+                prefetch_buffer_size=prefetch_buffer_size,
+            )
+            # same dtype as the crop predictions, copied before the memory-mapped file is removed
+            final_predictions_tensor = tf.constant(class_map.astype(np.int32))
+            del class_map
+        return final_predictions_tensor
+
+    image_tensor = decode_image(file_path=target_image_path)
 
     # Build the model
     # & apply saved weights to the built model
-    model = load_saved_model(
+    model = load_predictions_model(
         checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        input_shape=patch_size,
-        batch_size=batch_size,
+        patch_size=patch_size,
+        inference_patch_size=inference_patch_size,
         encoder_kernel_size=encoder_kernel_size,
+        quantized_model_path=quantized_model_path,
+        correlation_filter=correlation_filter if correlate_predictions_bool else None,
     )
+    model_fingerprint = None
+    if tile_cache is not None:
+        model_fingerprint = get_predictions_fingerprint(
+            checkpoint_dir_path=checkpoint_dir_path,
+            quantized_model_path=quantized_model_path,
+            inference_patch_size=inference_patch_size,
+            correlation_filter=correlation_filter
+            if correlate_predictions_bool
+            else None,
+            with_probabilities=overlap_blending != "crop",
+        )
 
-    # Make predictions on the patches
-    # output : array of shape (n_patches, patch_size, patch_size, n_classes)
-    main_patch_classes_list = patches_predict(
-        predictions_dataset=main_patches_dataset,
-        model=model,
-        n_classes=n_classes,
-        correlate_predictions_bool=correlate_predictions_bool,
-        correlation_filter=correlation_filter,
+    if overlap_blending == "crop" and uniform_variance_threshold is not None:
+        # output : array of shape (n_patches, patch_size, patch_size)
+        patches_classes = patches_predict_with_fast_path(
+            image_array=np.asarray(image_tensor),
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            batch_size=batch_size,
+            model=model,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            variance_threshold=uniform_variance_threshold,
+            color_tolerance=uniform_color_tolerance,
+            evaluate=evaluate_fast_path,
+            prefetch_buffer_size=prefetch_buffer_size,
+            jit_compile=jit_compile,
+            tile_cache=tile_cache,
+            model_fingerprint=model_fingerprint,
+        )
+
+        final_predictions_tensor = rebuild_predictions_with_overlap(
+            target_image_path=target_image_path,
+            patches_classes=patches_classes,
+            image_tensor=image_tensor,
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            misclassification_size=misclassification_size,
+        )
+    elif overlap_blending == "crop":
+        # Cut the image into patches of size inference_patch_size
+        # & format the image patches to feed the model.predict function
+        predictions_dataset, patches_origins = build_predictions_dataset(
+            target_image_tensor=image_tensor,
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            batch_size=batch_size,
+            prefetch_buffer_size=prefetch_buffer_size,
+        )
+
+        # Make predictions on all the patches at once
+        # output : array of shape (n_patches, patch_size, patch_size)
+        patches_classes = patches_predict(
+            predictions_dataset=predictions_dataset,
+            model=model,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            jit_compile=jit_compile,
+            tile_cache=tile_cache,
+            model_fingerprint=model_fingerprint,
+        )
+
+        # Rebuild the image with the predictions patches
+        # output tensor of size (intput_width_size - 2 * patch_overlap, input_height_size - 2 * patch_overlap)
+        final_predictions_tensor = rebuild_predictions_with_overlap(
+            target_image_path=target_image_path,
+            patches_classes=patches_classes,
+            image_tensor=image_tensor,
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            misclassification_size=misclassification_size,
+        )
+    else:
+        predictions_dataset, patches_origins = build_predictions_dataset(
+            target_image_tensor=image_tensor,
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            batch_size=batch_size,
+            prefetch_buffer_size=prefetch_buffer_size,
+        )
+
+        # output : array of shape (n_patches, patch_size, patch_size, n_classes + 1)
+        patches_probabilities = patches_predict_probabilities(
+            predictions_dataset=predictions_dataset,
+            model=model,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            tile_cache=tile_cache,
+            model_fingerprint=model_fingerprint,
+        )
+
+        final_predictions_tensor = rebuild_predictions_with_blending(
+            target_image_path=target_image_path,
+            patches_probabilities=patches_probabilities,
+            patches_origins=patches_origins,
+            image_tensor=image_tensor,
+            patch_overlap=patch_overlap,
+            window_type=overlap_blending,
+        )
+
+    logger.info(
+        f"\nPredictions on {get_image_name_without_extension(target_image_path)} have been done."
     )
-    right_side_patch_classes_list = patches_predict(
-        predictions_dataset=right_side_patches_dataset,
-        model=model,
+
+    return final_predictions_tensor
+
+
+def load_predictions_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    inference_patch_size: int,
+    encoder_kernel_size: int,
+    quantized_model_path: Path = None,
+    correlation_filter: np.ndarray = None,
+):
+    """Load the model make_predictions() runs on patches of size inference_patch_size : the quantized, fixed size or shape-agnostic one."""
+    if quantized_model_path is not None:
+        return load_quantized_model(
+            quantized_model_path=quantized_model_path,
+            correlation_filter=correlation_filter,
+        )
+    if inference_patch_size == patch_size:
+        return load_saved_model(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            input_shape=patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+    return load_saved_model_arbitrary_input(
+        checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        correlate_predictions_bool=correlate_predictions_bool,
-        correlation_filter=correlation_filter,
+        encoder_kernel_size=encoder_kernel_size,
+    )
+
+
+def get_predictions_fingerprint(
+    checkpoint_dir_path: Path,
+    quantized_model_path: Path,
+    inference_patch_size: int,
+    correlation_filter: np.ndarray,
+    with_probabilities: bool,
+) -> str:
+    """Identify the patches predictions of make_predictions() in a tile cache : by model, patches size, correlation and output."""
+    return get_model_fingerprint(
+        checkpoint_dir_path=checkpoint_dir_path,
+        quantized_model_path=quantized_model_path,
+        inference_patch_size=inference_patch_size,
+        # the probabilities are cached before their correlation
+        correlation_filter=None
+        if correlation_filter is None or with_probabilities
+        else (correlation_filter.shape, correlation_filter.tobytes()),
+        with_probabilities=with_probabilities,
+    )
+
+
+def make_predictions_coarse_to_fine(
+    target_image_path: Path,
+    checkpoint_dir_path: Path,
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    downscale_factor: int = 4,
+    uncertainty_threshold: float = 0.5,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    inference_patch_size: int = None,
+    quantized_model_path: Path = None,
+    jit_compile: bool = False,
+    tile_cache: TilePredictionCache = None,
+) -> tf.Tensor:
+    """
+    Make predictions on a downscaled copy of the target image first, then on the full resolution patches where the coarse predictions are uncertain only.
+    A coarse pixel is uncertain when its max probability is below uncertainty_threshold, or when its class differs from one of its 4 neighbors.
+    The full resolution patches whose interior has no uncertain pixel keep the upscaled coarse classes.
+
+    :param target_image_path: Image to make predictions on.
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded. Also the number of patches predicted per model step.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the full resolution predictions.
+    :param correlation_filter: The filter to use for correlation.
+    :param downscale_factor: Factor the image height and width are divided by for the coarse predictions.
+    :param uncertainty_threshold: The coarse predictions whose max probability is below it are uncertain.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+    :param inference_patch_size: Size of the full resolution patches, if different from patch_size.
+    :param quantized_model_path: Path of an int8 quantized model to use for the full resolution patches instead of the checkpoint.
+    :param jit_compile: Whether or not to compile the full resolution inference function with XLA.
+    :param tile_cache: A cache of the full resolution patches predictions.
+
+    :return: A 2D categorical tensor of size (width, height), width and height being the cropped size of the target image tensor
+    """
+    assert (
+        patch_overlap % 2 == 0
+    ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+    if inference_patch_size is None:
+        inference_patch_size = patch_size
+
+    image_array = np.asarray(decode_image(file_path=target_image_path))
+    image_height, image_width = image_array.shape[:2]
+    half_overlap = patch_overlap // 2
+
+    # Coarse predictions on the whole downscaled image at once
+    # probabilities : array of shape (ceil(image_height / downscale_factor), ceil(image_width / downscale_factor), n_classes + 1)
+    downscaled_tensor = downscale_image(
+        image_path=target_image_path,
+        downscale_factors=(downscale_factor, downscale_factor, 1),
     )
-    down_side_patch_classes_list = patches_predict(
-        predictions_dataset=down_side_patches_dataset,
-        model=model,
+    coarse_model = load_saved_model_arbitrary_input(
+        checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        correlate_predictions_bool=correlate_predictions_bool,
-        correlation_filter=correlation_filter,
-    )
-
-    # Rebuild the image with the predictions patches
-    # output tensor of size (intput_width_size - 2 * patch_overlap, input_height_size - 2 * patch_overlap)
-    final_predictions_tensor = rebuild_predictions_with_overlap(
-        target_image_path=target_image_path,
-        main_patch_classes_list=main_patch_classes_list,
-        right_side_patch_classes_list=right_side_patch_classes_list,
-        down_side_patch_classes_list=down_side_patch_classes_list,
-        image_tensor=image_tensor,
-        patch_size=patch_size,
+        encoder_kernel_size=encoder_kernel_size,
+    )
+    coarse_probabilities = coarse_model.predict(
+        tf.expand_dims(input=downscaled_tensor, axis=0)
+    )[0]
+    # Remove background predictions so it takes the max on the non background classes
+    coarse_classes = np.argmax(coarse_probabilities[:, :, 1:], axis=2) + 1
+    coarse_uncertain = (
+        np.max(coarse_probabilities[:, :, 1:], axis=2) < uncertainty_threshold
+    )
+    # the pixels on a class boundary are uncertain too
+    vertical_disagreement = coarse_classes[1:] != coarse_classes[:-1]
+    horizontal_disagreement = coarse_classes[:, 1:] != coarse_classes[:, :-1]
+    coarse_uncertain[1:] |= vertical_disagreement
+    coarse_uncertain[:-1] |= vertical_disagreement
+    coarse_uncertain[:, 1:] |= horizontal_disagreement
+    coarse_uncertain[:, :-1] |= horizontal_disagreement
+
+    # Upscale the coarse maps to the rebuilt image, cropped by patch_overlap / 2 on each side
+    def upscale(coarse_array: np.ndarray) -> np.ndarray:
+        return np.repeat(
+            np.repeat(coarse_array, downscale_factor, axis=0), downscale_factor, axis=1
+        )[
+            half_overlap : image_height - half_overlap,
+            half_overlap : image_width - half_overlap,
+        ]
+
+    predictions_array = upscale(coarse_classes.astype(np.int32))
+    uncertain_array = upscale(coarse_uncertain)
+
+    # Select the full resolution patches with at least one uncertain pixel in their interior
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=inference_patch_size,
         patch_overlap=patch_overlap,
-        misclassification_size=misclassification_size,
     )
+    patches_interior_bounds = get_patches_interior_bounds(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=inference_patch_size,
+        patch_overlap=patch_overlap,
+    )
+    refined_patches = (
+        get_boxes_sums(
+            integral_image=get_integral_image(image_array=uncertain_array),
+            boxes_bounds=patches_interior_bounds,
+        )
+        > 0
+    )
+    logger.info(
+        f"\n{np.sum(refined_patches)} of {len(refined_patches)} patches to predict at full resolution : "
+        f"{100 * np.mean(~refined_patches):.1f}% skipped."
+    )
+
+    if np.any(refined_patches):
+        model = load_predictions_model(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            patch_size=patch_size,
+            inference_patch_size=inference_patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+            quantized_model_path=quantized_model_path,
+            correlation_filter=correlation_filter
+            if correlate_predictions_bool
+            else None,
+        )
+        refined_origins = patches_origins[refined_patches]
+        patches_view = get_patches_view(
+            image_array=image_array, patch_size=inference_patch_size
+        )
+        refined_dataset = (
+            tf.data.Dataset.from_tensor_slices(
+                patches_view[refined_origins[:, 0], refined_origins[:, 1]]
+            )
+            .batch(batch_size=batch_size, drop_remainder=False)
+            .prefetch(buffer_size=prefetch_buffer_size)
+        )
+        paste_patches_interiors(
+            output=predictions_array,
+            patches=patches_predict(
+                predictions_dataset=refined_dataset,
+                model=model,
+                n_classes=n_classes,
+                correlate_predictions_bool=correlate_predictions_bool,
+                correlation_filter=correlation_filter,
+                jit_compile=jit_compile,
+                tile_cache=tile_cache,
+                model_fingerprint=None
+                if tile_cache is None
+                else get_predictions_fingerprint(
+                    checkpoint_dir_path=checkpoint_dir_path,
+                    quantized_model_path=quantized_model_path,
+                    inference_patch_size=inference_patch_size,
+                    correlation_filter=correlation_filter
+                    if correlate_predictions_bool
+                    else None,
+                    with_probabilities=False,
+                ),
+            ),
+            patches_origins=refined_origins,
+            patches_interior_bounds=patches_interior_bounds[refined_patches],
+            patch_overlap=patch_overlap,
+        )
 
     logger.info(
         f"\nPredictions on {get_image_name_without_extension(target_image_path)} have been done."
     )
 
-    return final_predictions_tensor
+    return tf.constant(predictions_array)
 
 
-def patches_predict(
+def make_predictions_streaming(
+    target_image_path: Path,
+    checkpoint_dir_path: Path,
+    output_path: Path,
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    memory_budget_mb: int = 256,
+    correlate_predictions_bool: bool = False,
+    correlation_filter: np.ndarray = None,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+) -> np.memmap:
+    """
+    Make predictions on the target image one band of patches rows at a time, and write each finished band in a memory-mapped class map.
+    Unlike make_predictions(), the patches and their predictions are never held in memory for the whole image,
+    which keeps the memory usage bounded for the full resolution images.
+
+    :param target_image_path: Image to make predictions on.
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param output_path: Path of the .npy file the class map is written in.
+    :param patch_size: Size of the patches on which the model was trained. This is also the size of the predictions patches.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded. Also the number of patches predicted per model step.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param memory_budget_mb: Memory allowed for the patches of a band and their predictions, in MB. It sets the number of patches rows per band.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the predictions, i.e. make a local weighted mean on each class probability.
+    :param correlation_filter: The filter to use for correlation.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+
+    :return: The uint8 class map of size (height - patch_overlap, width - patch_overlap), memory-mapped on output_path.
+    """
+    assert (
+        patch_overlap % 2 == 0
+    ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+    assert n_classes < 256, f"{n_classes} classes do not fit in a uint8 class map."
+
+    image_array = np.asarray(decode_image(file_path=target_image_path))
+    image_height, image_width = image_array.shape[:2]
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    patches_interior_bounds = get_patches_interior_bounds(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    patches_view = get_patches_view(image_array=image_array, patch_size=patch_size)
+
+    # a patch costs its uint8 pixels, its float32 probabilities and its int32 classes
+    patch_bytes = patch_size * patch_size * (3 + 4 * (n_classes + 1) + 4)
+    patches_row_bytes = (n_horizontal_patches + 1) * patch_bytes
+    rows_per_band = max(1, memory_budget_mb * 2**20 // patches_row_bytes)
+    n_patches_rows = n_vertical_patches + 1
+    n_patches_per_row = n_horizontal_patches + 1
+    logger.info(
+        f"\nPredictions on {n_patches_rows} rows of {n_patches_per_row} patches, by bands of {rows_per_band} rows."
+    )
+
+    model = load_saved_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        input_shape=patch_size,
+        encoder_kernel_size=encoder_kernel_size,
+    )
+
+    output = np.lib.format.open_memmap(
+        filename=str(output_path),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(image_height - patch_overlap, image_width - patch_overlap),
+    )
+    for band_start_row in range(0, n_patches_rows, rows_per_band):
+        band_slice = slice(
+            band_start_row * n_patches_per_row,
+            min(band_start_row + rows_per_band, n_patches_rows) * n_patches_per_row,
+        )
+        band_origins = patches_origins[band_slice]
+        band_patches = patches_view[band_origins[:, 0], band_origins[:, 1]]
+        band_dataset = (
+            tf.data.Dataset.from_tensor_slices(band_patches)
+            .batch(batch_size=batch_size, drop_remainder=False)
+            .prefetch(buffer_size=prefetch_buffer_size)
+        )
+        band_classes = patches_predict(
+            predictions_dataset=band_dataset,
+            model=model,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+        )
+        paste_patches_interiors(
+            output=output,
+            patches=band_classes,
+            patches_origins=band_origins,
+            patches_interior_bounds=patches_interior_bounds[band_slice],
+            patch_overlap=patch_overlap,
+        )
+        # the finished rows are written to disk, so that their pages can be released
+        output.flush()
+
+    logger.info(
+        f"\nPredictions on {get_image_name_without_extension(target_image_path)} have been written at : {output_path}"
+    )
+
+    return output
+
+
+@traced("predict")
+def patches_predict_probabilities(
     predictions_dataset: tf.data.Dataset,
     model: tf.keras.Model,
     n_classes: int,
     correlate_predictions_bool: bool,
     correlation_filter: np.ndarray,
-) -> [tf.Tensor]:
-    predictions: np.ndarray = model.predict(x=predictions_dataset, verbose=1)
+    tile_cache: TilePredictionCache = None,
+    model_fingerprint: str = None,
+) -> np.ndarray:
+    if tile_cache is None:
+        predictions: np.ndarray = model.predict(x=predictions_dataset, verbose=1)
+    else:
+        # the correlation is applied after the cache : the cached probabilities are the model raw outputs
+        predictions = np.concatenate(
+            [
+                tile_cache.predict(
+                    patches=np.asarray(patches_batch),
+                    predict_function=model.predict_on_batch,
+                    model_fingerprint=model_fingerprint,
+                )
+                for patches_batch in predictions_dataset
+            ]
+        )
+        tile_cache.log_statistics()
 
     if correlate_predictions_bool:
         predictions = correlate_predictions(
@@ -186,76 +723,330 @@ def patches_predict(
             correlation_filter=correlation_filter,
             n_classes=n_classes,
         )
+    # Probabilities array is of size (n_patches, patch_size, patch_size, n_classes + 1)
 
-    # Remove background predictions so it takes the max on the non background classes
-    # Note : the argmax function shift the classes numbers of -1, that is why we add one just after
-    patch_classes_list = list(np.argmax(predictions[:, :, :, 1:], axis=3))
-    patch_classes_list = [
-        tf.constant(
-            np.add(patch_classes, np.ones(patch_classes.shape, dtype=np.int32)),
-            dtype=tf.int32,
-        )
-        for patch_classes in patch_classes_list
-    ]
-    # Tensors classes list is of size n_patches of tensor with size (patch_size, patch_size)
+    return np.asarray(predictions)
+
+
+@traced("predict")
+def patches_predict(
+    predictions_dataset: tf.data.Dataset,
+    model: tf.keras.Model,
+    n_classes: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    jit_compile: bool = False,
+    tile_cache: TilePredictionCache = None,
+    model_fingerprint: str = None,
+) -> np.ndarray:
+    if isinstance(model, QuantizedInferenceModel):
+        # the correlation of a quantized model is set when it is loaded
+        inference_model = model
+    else:
+        inference_model = get_inference_model(
+            model=model,
+            correlation_filter=correlation_filter
+            if correlate_predictions_bool
+            else None,
+            jit_compile=jit_compile,
+        )
+        if inference_model.tracing_time is None:
+            inference_model.warmup(patch_size=predictions_dataset.element_spec.shape[1])
+    # Only the uint8 classes are sent back from the model, one batch at a time
+    if tile_cache is None:
+        patches_classes = np.concatenate(
+            [
+                np.asarray(inference_model.predict_classes(patches_batch))
+                for patches_batch in predictions_dataset
+            ]
+        )
+    else:
+        patches_classes = np.concatenate(
+            [
+                tile_cache.predict(
+                    patches=np.asarray(patches_batch),
+                    predict_function=inference_model.predict_classes,
+                    model_fingerprint=model_fingerprint,
+                )
+                for patches_batch in predictions_dataset
+            ]
+        )
+        tile_cache.log_statistics()
+    # Classes array is of size (n_patches, patch_size, patch_size)
+    if not isinstance(model, QuantizedInferenceModel) and (
+        inference_model.steady_state_calls
+    ):
+        latency_report = inference_model.get_latency_report()
+        logger.info(
+            f"\nInference latency : {latency_report['steady_state_mean_latency']:.3f}s per batch on {latency_report['steady_state_calls']} batches, "
+            f"after a tracing of {latency_report['tracing_time']:.2f}s."
+        )
+
+    return patches_classes
 
-    return patch_classes_list
 
+def get_uniform_patches_sources(
+    image_array: np.ndarray,
+    patches_origins: np.ndarray,
+    n_patches_per_row: int,
+    patch_size: int,
+    variance_threshold: float,
+    color_tolerance: float,
+) -> np.ndarray:
+    """
+    Find the uniform patches which can reuse the class of a neighbor patch instead of being predicted.
+    The mean color and the variance of every patch are computed at once with integral images.
+    A patch is uniform if the sum of its channels variances is below variance_threshold,
+    and it reuses the class of its left, or else upper, neighbor if this one is uniform too, with a close mean color.
+    The first patch of a uniform area is predicted, and the class is passed along the rest of it.
+
+    :param image_array: The image array of shape (height, width, 3).
+    :param patches_origins: The (n_patches, 2) origins of the patches, as given by get_patches_origins().
+    :param n_patches_per_row: Number of patches in a row of the patches grid.
+    :param patch_size: Size of the patches.
+    :param variance_threshold: The patches whose variance is below it are uniform.
+    :param color_tolerance: Maximum euclidean distance between the mean colors of two neighbor uniform patches.
+    :return: An array of shape (n_patches,) with, for each patch, the index of the patch whose class it reuses, or -1 if it is predicted.
+      A patch always reuses the class of a patch which comes before it.
+    """
+    patches_bounds = np.stack(
+        [
+            patches_origins[:, 0],
+            patches_origins[:, 0] + patch_size,
+            patches_origins[:, 1],
+            patches_origins[:, 1] + patch_size,
+        ],
+        axis=1,
+    )
+    n_pixels = patch_size * patch_size
+    image_array = image_array[:, :, :3].astype(np.float64)
+    patches_means = (
+        np.stack(
+            [
+                get_boxes_sums(
+                    integral_image=get_integral_image(
+                        image_array=image_array[:, :, channel]
+                    ),
+                    boxes_bounds=patches_bounds,
+                )
+                for channel in range(3)
+            ],
+            axis=1,
+        )
+        / n_pixels
+    )
+    patches_squares_means = (
+        get_boxes_sums(
+            integral_image=get_integral_image(
+                image_array=np.sum(image_array**2, axis=2)
+            ),
+            boxes_bounds=patches_bounds,
+        )
+        / n_pixels
+    )
+    patches_variances = patches_squares_means - np.sum(patches_means**2, axis=1)
+    uniform_patches = patches_variances < variance_threshold
+
+    patches_sources = np.full(len(patches_origins), -1)
+    for patch_idx in np.flatnonzero(uniform_patches):
+        row_idx, column_idx = divmod(patch_idx, n_patches_per_row)
+        neighbors_indices = []
+        if column_idx > 0:
+            neighbors_indices.append(patch_idx - 1)
+        if row_idx > 0:
+            neighbors_indices.append(patch_idx - n_patches_per_row)
+        for neighbor_idx in neighbors_indices:
+            if uniform_patches[neighbor_idx] and (
+                np.linalg.norm(patches_means[patch_idx] - patches_means[neighbor_idx])
+                < color_tolerance
+            ):
+                patches_sources[patch_idx] = neighbor_idx
+                break
+    return patches_sources
+
+
+def patches_predict_with_fast_path(
+    image_array: np.ndarray,
+    patch_size: int,
+    patch_overlap: int,
+    batch_size: int,
+    model: tf.keras.Model,
+    n_classes: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    variance_threshold: float,
+    color_tolerance: float = 10.0,
+    evaluate: bool = False,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    jit_compile: bool = False,
+    tile_cache: TilePredictionCache = None,
+    model_fingerprint: str = None,
+) -> np.ndarray:
+    """
+    Same as patches_predict() on all the patches of an image, but the uniform patches, like clear sky or flat walls, skip the model :
+    they get the most frequent class of a similar neighbor patch. See get_uniform_patches_sources().
 
+    :param image_array: The image array of shape (height, width, 3).
+    :param patch_size: Size of the patches.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param batch_size: Number of patches per batch fed to the model.
+    :param model: The model to predict the other patches with.
+    :param n_classes: Number of classes to map, background excluded.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the predictions.
+    :param correlation_filter: The filter to use for correlation.
+    :param variance_threshold: The patches whose variance is below it are uniform.
+    :param color_tolerance: Maximum euclidean distance between the mean colors of two neighbor uniform patches.
+    :param evaluate: Whether or not to also predict the skipped patches with the model, to report the pixels agreement.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+    :param jit_compile: Whether or not to compile the inference function with XLA.
+    :param tile_cache: A cache of the patches predictions.
+    :param model_fingerprint: Identifies the model in the tile cache.
+    :return: The classes array of shape (n_patches, patch_size, patch_size), in the get_patches_origins() order.
+    """
+    image_height, image_width = image_array.shape[:2]
+    n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )[1]
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    patches_sources = get_uniform_patches_sources(
+        image_array=image_array,
+        patches_origins=patches_origins,
+        n_patches_per_row=n_horizontal_patches + 1,
+        patch_size=patch_size,
+        variance_threshold=variance_threshold,
+        color_tolerance=color_tolerance,
+    )
+    skipped_patches = patches_sources >= 0
+    patches_view = get_patches_view(image_array=image_array, patch_size=patch_size)
+
+    def predict_patches(patches_indices: np.ndarray) -> np.ndarray:
+        patches_dataset = (
+            tf.data.Dataset.from_tensor_slices(
+                patches_view[
+                    patches_origins[patches_indices, 0],
+                    patches_origins[patches_indices, 1],
+                ]
+            )
+            .batch(batch_size=batch_size, drop_remainder=False)
+            .prefetch(buffer_size=prefetch_buffer_size)
+        )
+        return patches_predict(
+            predictions_dataset=patches_dataset,
+            model=model,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            jit_compile=jit_compile,
+            tile_cache=tile_cache,
+            model_fingerprint=model_fingerprint,
+        )
+
+    patches_classes = np.empty(
+        (len(patches_origins), patch_size, patch_size), dtype=np.uint8
+    )
+    patches_classes[~skipped_patches] = predict_patches(
+        patches_indices=np.flatnonzero(~skipped_patches)
+    )
+    # the sources come first : their classes are known when they are reused
+    for patch_idx in np.flatnonzero(skipped_patches):
+        patches_classes[patch_idx] = np.argmax(
+            np.bincount(
+                patches_classes[patches_sources[patch_idx]].ravel(),
+                minlength=n_classes + 1,
+            )
+        )
+    logger.debug(
+        f"\nPatches which skipped the model, by origin : {patches_origins[skipped_patches].tolist()}"
+    )
+    logger.info(
+        f"\n{np.sum(skipped_patches)} of {len(patches_origins)} uniform patches skipped the model : "
+        f"{100 * np.mean(skipped_patches):.1f}% skip rate."
+    )
+
+    if evaluate and np.any(skipped_patches):
+        model_classes = predict_patches(patches_indices=np.flatnonzero(skipped_patches))
+        logger.info(
+            f"\nFast path pixels agreement with the model on the skipped patches : "
+            f"{100 * np.mean(model_classes == patches_classes[skipped_patches]):.2f}%."
+        )
+
+    return patches_classes
+
+
+@traced("correlate")
 def correlate_predictions(
     predictions_array: np.ndarray, correlation_filter: np.ndarray, n_classes: int
-) -> tf.Tensor:
+) -> np.ndarray:
     """Smooth the predictions by applying a gaussian filter to the predictions probabilities.
-    It computes a local weighted average on each class probabilities."""
+    It computes a local weighted average on each class probabilities, on all the patches and classes at once.
+    When the filter is separable, i.e. the outer product of two 1D filters like a gaussian kernel, it is applied as two 1D passes."""
     assert (
         predictions_array.shape[-1] == n_classes + 1
     ), f"Predictions tensor has shape {predictions_array.shape} (last axis dim {predictions_array.shape[-1]}), last axis should have dim {n_classes + 1}"
 
-    n_patches = predictions_array.shape[0]
-    correlated_patches_predictions_list = list()
-    for patch_tensor_idx in range(n_patches):
-        correlated_classes_means_list = list()
-        for class_idx in range(n_classes + 1):
-            # compute a local weighted average
-            correlated_class_means = (
-                scipy.ndimage.correlate(
-                    input=predictions_array[patch_tensor_idx, :, :, class_idx],
-                    weights=correlation_filter,
-                )
-                / int(tf.reduce_sum(correlation_filter))
-            )
-            # remark : no need to normalize the weighted probabilities because only an argmax is done after
-            correlated_classes_means_list.append(correlated_class_means)
-        patch_correlated_predictions = tf.stack(
-            values=correlated_classes_means_list, axis=-1
+    # remark : normalizing only changes the scale of the weighted probabilities, an argmax is done after anyway
+    normalized_filter = correlation_filter / np.sum(correlation_filter)
+    separable_filters = get_separable_filters(filter_2d=normalized_filter)
+    if separable_filters is not None:
+        rows_filter, columns_filter = separable_filters
+        correlated_predictions = scipy.ndimage.correlate1d(
+            input=predictions_array, weights=rows_filter, axis=1
+        )
+        correlated_predictions = scipy.ndimage.correlate1d(
+            input=correlated_predictions, weights=columns_filter, axis=2
+        )
+    else:
+        # the filter spans the height and width axes only : the patches and the classes are not mixed
+        correlated_predictions = scipy.ndimage.correlate(
+            input=predictions_array,
+            weights=normalized_filter[np.newaxis, :, :, np.newaxis],
         )
-        correlated_patches_predictions_list.append(patch_correlated_predictions)
-    correlated_predictions = tf.stack(
-        values=correlated_patches_predictions_list, axis=0
-    )
     return correlated_predictions
 
 
+def get_separable_filters(filter_2d: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Decompose a 2D filter as the outer product of a column filter and a row filter, if possible.
+
+    :param filter_2d: A 2D filter.
+    :return: The 1D filters to apply along the height then the width axis, or None if the filter is not separable.
+    """
+    left_singular_vectors, singular_values, right_singular_vectors = np.linalg.svd(
+        filter_2d
+    )
+    if np.any(singular_values[1:] > 1e-6 * singular_values[0]):
+        return None
+    scale = np.sqrt(singular_values[0])
+    return (
+        left_singular_vectors[:, 0] * scale,
+        right_singular_vectors[0, :] * scale,
+    )
+
+
 def make_predictions_oneshot(
     target_image_path: Path,
     checkpoint_dir_path: Path,
     patch_overlap: int,
     n_classes: int,
-    patch_size: int,
-    batch_size: int,
     encoder_kernel_size: int,
 ) -> tf.Tensor:
-    """,
-    Make predictions on the target image specified with its path.
+    """
+    Make predictions on the whole target image at once, with the shape-agnostic model.
+    No patches are needed : this is possible on the downscaled images, as long as they fit in memory.
 
-    :param encoder_kernel_size: Size of the kernel encoder.
     :param target_image_path: Image to make predictions on.
     :param checkpoint_dir_path: Path of the already trained model.
-    :param patch_size: Size of the patches on which the model was trained. This is also the size of the predictions patches.
-    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param patch_overlap: Number of pixels cropped on the image borders, to get the same output size as make_predictions().
     :param n_classes: Number of classes to map, background excluded.
-    :param batch_size: Batch size that was used for the model which is loaded.
-    :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
+    :param encoder_kernel_size: Size of the kernel encoder.
 
     :return: A 2D categorical tensor of size (width, height), width and height being the cropped size of the target image tensor
     """
@@ -265,23 +1056,41 @@ def make_predictions_oneshot(
     ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
 
     image_tensor = decode_image(file_path=target_image_path)
-    image_tensor = tf.expand_dims(input=image_tensor, axis=0)
+    image_height, image_width, channels_number = get_image_tensor_shape(
+        image_tensor=image_tensor
+    )
 
     # Build the model
     # & apply saved weights to the built model
-    model = load_saved_model(
+    model = load_saved_model_arbitrary_input(
         checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        input_shape=patch_size,
-        batch_size=batch_size,
         encoder_kernel_size=encoder_kernel_size,
     )
 
-    # Make predictions on the patches
-    # predicitons : array of shape (n_patches, patch_size, patch_size, n_classes)
-    predictions = model.predict(image_tensor, verbose=1)
+    # predictions : array of shape (1, image_height, image_width, n_classes + 1)
+    predictions = model.predict(tf.expand_dims(input=image_tensor, axis=0), verbose=1)
 
-    return predictions
+    # Remove background predictions so it takes the max on the non background classes
+    half_overlap = patch_overlap // 2
+    predictions_array = (
+        np.argmax(
+            predictions[
+                0,
+                half_overlap : image_height - half_overlap,
+                half_overlap : image_width - half_overlap,
+                1:,
+            ],
+            axis=2,
+        ).astype(np.int32)
+        + 1
+    )
+
+    logger.info(
+        f"\nPredictions on {get_image_name_without_extension(target_image_path)} have been done."
+    )
+
+    return tf.constant(predictions_array)
 
 
 def get_confusion_matrix(
@@ -347,47 +1156,146 @@ def load_saved_model(
     checkpoint_dir_path: Path,
     n_classes: int,
     input_shape: int,
-    batch_size: int,
     encoder_kernel_size: int,
+    batch_size: int = None,
+    use_cache: bool = True,
 ):
-    logger.info("\nLoading the model...")
-    # model = build_small_unet(n_classes, patch_size, batch_size, encoder_kernel_size)
-    model = build_small_unet(
+    """
+    Build the model and apply the saved weights to it.
+    The loaded models are kept in a process-wide cache, so that the predictions on several images only load the model once.
+    The batch size is not part of the weights : by default the graph accepts batches of any size,
+    so that the same loaded model runs whichever batch size is used. A fixed batch size is only needed for the quantized export.
+    """
+
+    def load_model() -> tf.keras.Model:
+        logger.info("\nLoading the model...")
+        # model = build_small_unet(n_classes, patch_size, batch_size, encoder_kernel_size)
+        model = build_small_unet(
+            n_classes=n_classes,
+            input_shape=input_shape,
+            batch_size=batch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+        filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
+        model.load_weights(filepath=filepath)
+        # the warnings logs due to load_weights are here because we don't train (compile/fit) after : they disappear if we do
+        logger.info("\nModel loaded successfully.")
+        return model
+
+    if not use_cache:
+        return load_model()
+    return get_cached_model(
+        cache_key=get_model_cache_key(
+            checkpoint_dir_path=checkpoint_dir_path,
+            architecture="small_unet",
+            n_classes=n_classes,
+            input_shape=input_shape,
+            batch_size=batch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        ),
+        load_model_function=load_model,
+    )
+
+
+def load_saved_model_arbitrary_input(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    encoder_kernel_size: int,
+    use_cache: bool = True,
+) -> tf.keras.Model:
+    """
+    Load the trained weights in the shape-agnostic version of the model.
+    The returned model accepts batches of any size of images of any height and width :
+    they are padded to a multiple of 8 internally, and the predictions are cropped back to the images size.
+    """
+
+    def load_model() -> tf.keras.Model:
+        logger.info("\nLoading the model for arbitrary input sizes...")
+        model = build_small_unet_arbitrary_input(
+            n_classes=n_classes,
+            batch_size=None,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+        # both models have the same layers with weights, the fixed size one only adds weightless cropping layers
+        filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
+        model.load_weights(filepath=filepath)
+        model = build_padded_model(
+            model=model, input_size_multiple=SMALL_UNET_INPUT_SIZE_MULTIPLE
+        )
+        logger.info("\nModel loaded successfully.")
+        return model
+
+    if not use_cache:
+        return load_model()
+    return get_cached_model(
+        cache_key=get_model_cache_key(
+            checkpoint_dir_path=checkpoint_dir_path,
+            architecture="small_unet_arbitrary_input",
+            n_classes=n_classes,
+            encoder_kernel_size=encoder_kernel_size,
+        ),
+        load_model_function=load_model,
+    )
+
+
+def warm_up_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    inference_patch_size: int = None,
+    overlap_blending: str = "crop",
+    correlation_filter: np.ndarray = None,
+) -> None:
+    """
+    Load the model make_predictions() runs in the cache, and run it once on a blank batch of patches of size inference_patch_size,
+    so that the first predictions pay neither the model loading nor the predict function tracing.
+    In "crop" overlap blending, this is the inference function of the model, with the correlation filter if any.
+    """
+    if inference_patch_size is None:
+        inference_patch_size = patch_size
+    model = load_predictions_model(
+        checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        input_shape=input_shape,
-        batch_size=batch_size,
+        patch_size=patch_size,
+        inference_patch_size=inference_patch_size,
         encoder_kernel_size=encoder_kernel_size,
     )
-    filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
-    model.load_weights(filepath=filepath)
-    # the warnings logs due to load_weights are here because we don't train (compile/fit) after : they disappear if we do
-    logger.info("\nModel loaded successfully.")
-    return model
+    if overlap_blending == "crop":
+        get_inference_model(model=model, correlation_filter=correlation_filter).warmup(
+            patch_size=inference_patch_size
+        )
+    else:
+        model.predict(
+            x=np.zeros(
+                (batch_size, inference_patch_size, inference_patch_size, 3),
+                dtype=np.float32,
+            )
+        )
+    logger.info("\nModel warmed up.")
 
 
+@traced("stitch")
 def rebuild_predictions_with_overlap(
     target_image_path: Path,
-    main_patch_classes_list: [tf.Tensor],
-    right_side_patch_classes_list: [tf.Tensor],
-    down_side_patch_classes_list: [tf.Tensor],
+    patches_classes: np.ndarray,
     image_tensor: tf.Tensor,
     patch_size: int,
     patch_overlap: int,
     misclassification_size: int = 5,
 ) -> tf.Tensor:
     """
-    Restructure the patches that were generated with the extract_patches_with_overlap() function.
-    Warning : This function is strongly coupled with the function extract_patches() from the patches_generator.py module
-
-    :param target_image_path:
-    :param down_side_patch_classes_list:
-    :param main_patch_classes_list: List with size n_patches of tensor with size (patch_size, patch_size)
-    :param right_side_patch_classes_list:
-    :param image_tensor:
+    Restructure the patches that were generated with the extract_patches_array() function.
+    Warning : This function is strongly coupled with the function extract_patches_array() from the patches_generator.py module
+
+    :param target_image_path: Path of the image the patches were cut from.
+    :param patches_classes: Array of shape (n_patches, patch_size, patch_size), in the order of the patches origins.
+    :param image_tensor: The image the patches were cut from.
     :param patch_size: Size of the patches.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
-    :return: The rebuilt image tensor with dimension : [width, height, 1].
+    :return: The rebuilt image tensor with dimension : [width, height].
     """
     assert (
         patch_overlap % 2 == 0
@@ -396,128 +1304,22 @@ def rebuild_predictions_with_overlap(
         misclassification_size <= patch_overlap / 2
     ), f"Please increase the patch overlap (currently {patch_overlap}) to at least 2 times the misclassification size (currently {misclassification_size})."
 
-    # Turns the patches in the list to a size of (patch_size, patch_size, 1)
-    main_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in main_patch_classes_list
-    ]
-
-    right_side_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in right_side_patch_classes_list
-    ]
-
-    down_side_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in down_side_patch_classes_list
-    ]
-
-    # Counting the number of main patches by which the image has been cut
     image_height, image_width, channels_number = get_image_tensor_shape(
         image_tensor=image_tensor
     )
 
-    window_stride = (
-        patch_size - patch_overlap
-    )  # number of pixels by which we shift the window at each step of predictions
-    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
-    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
-
     logger.info(
         f"\nRebuilding predictions patches for image {get_file_name_with_extension(target_image_path)}..."
     )
-    for row_number in range(n_vertical_patches):
-        for column_number in range(n_horizontal_patches):
-            # Rebuild the line
-            patch_number = row_number * n_horizontal_patches + column_number
-            patch_tensor = main_patch_classes_list[patch_number]
-
-            # cropping the patch by taking into account the overlap with which it was built
-            cropped_patch_tensor = crop_patch_tensor(
-                patch_tensor=patch_tensor, patch_overlap=patch_overlap
-            )
-            if column_number == 0:
-                line_rebuilt_tensor = cropped_patch_tensor
-            else:
-                line_rebuilt_tensor = tf.concat(
-                    [line_rebuilt_tensor, cropped_patch_tensor], axis=1
-                )
-
-        # first add the right side patches to extend the right side
-        right_side_patch_tensor = right_side_patch_classes_list[row_number]
-        cropped_right_side_patch_tensor = crop_patch_tensor(
-            patch_tensor=right_side_patch_tensor, patch_overlap=patch_overlap
-        )
-        left_bound_limit_idx = (
-            n_horizontal_patches * window_stride + int(patch_overlap / 2)
-        ) - (image_width - patch_size + int(patch_overlap / 2))
-        resized_cropped_right_side_patch_tensor = cropped_right_side_patch_tensor[
-            :, left_bound_limit_idx:
-        ]
-        line_rebuilt_tensor = tf.concat(
-            [line_rebuilt_tensor, resized_cropped_right_side_patch_tensor], axis=1
-        )
-
-        if row_number == 0:
-            rebuilt_tensor = line_rebuilt_tensor
-        else:
-            rebuilt_tensor = tf.concat([rebuilt_tensor, line_rebuilt_tensor], axis=0)
-
-    # finally add the down side patches to extend the image bottom
-    for column_number in range(n_horizontal_patches):
-        down_side_patch_tensor = down_side_patch_classes_list[column_number]
-
-        # cropping the patch by taking into account the overlap with which it was built
-        cropped_down_side_patch_tensor = crop_patch_tensor(
-            patch_tensor=down_side_patch_tensor, patch_overlap=patch_overlap
-        )
-        up_bound_limit_idx = (
-            n_vertical_patches * window_stride + int(patch_overlap / 2)
-        ) - (image_height - patch_size + int(patch_overlap / 2))
-        resized_cropped_down_side_patch_tensor = cropped_down_side_patch_tensor[
-            up_bound_limit_idx:, :
-        ]
+    rebuilt_array = stitch_patches(
+        patches=patches_classes,
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
 
-        if column_number == 0:
-            line_rebuilt_tensor = resized_cropped_down_side_patch_tensor
-        else:
-            line_rebuilt_tensor = tf.concat(
-                [line_rebuilt_tensor, resized_cropped_down_side_patch_tensor], axis=1
-            )
-    # add the right-down corner patch
-    down_right_side_patch_tensor = right_side_patch_classes_list[n_vertical_patches]
-    cropped_down_right_side_patch_tensor = crop_patch_tensor(
-        patch_tensor=down_right_side_patch_tensor, patch_overlap=patch_overlap
-    )
-    left_bound_limit_idx = (
-        n_horizontal_patches * window_stride + int(patch_overlap / 2)
-    ) - (image_width - patch_size + int(patch_overlap / 2))
-    up_bound_limit_idx = (
-        n_vertical_patches * window_stride + int(patch_overlap / 2)
-    ) - (image_height - patch_size + int(patch_overlap / 2))
-    resized_cropped_down_right_side_patch_tensor = cropped_down_right_side_patch_tensor[
-        up_bound_limit_idx:, left_bound_limit_idx:
-    ]
-    line_rebuilt_tensor = tf.concat(
-        [line_rebuilt_tensor, resized_cropped_down_right_side_patch_tensor], axis=1
-    )
-
-    rebuilt_tensor = tf.concat([rebuilt_tensor, line_rebuilt_tensor], axis=0)
-
-    # Check that the final size is consistent
-    (
-        rebuilt_tensor_height,
-        rebuilt_tensor_width,
-        rebuilt_channels_number,
-    ) = get_image_tensor_shape(image_tensor=rebuilt_tensor)
-    assert rebuilt_tensor_height == (
-        int(image_height - 2 * (patch_overlap / 2))
-    ), f"Number of rows is not consistent : got {rebuilt_tensor_height}, expected {int(image_height - 2 * (patch_overlap / 2))}"
-    assert rebuilt_tensor_width == (
-        int(image_width - 2 * (patch_overlap / 2))
-    ), f"Number of columns is not consistent : got {rebuilt_tensor_width}, expected {int(image_width - 2 * (patch_overlap / 2))}"
-
-    rebuilt_tensor = tf.squeeze(input=rebuilt_tensor)
+    rebuilt_tensor = tf.constant(rebuilt_array.astype(np.int32))
     logger.info(
         f"\nImage predictions have been successfully built with size {rebuilt_tensor.shape} (original image size : {image_tensor.shape})."
     )
@@ -546,3 +1348,60 @@ def rebuild_predictions_with_overlap(
 #     n_classes=N_CLASSES,
 #     patch_overlap=PATCH_OVERLAP,
 # )
+
+
+@traced("stitch")
+def rebuild_predictions_with_blending(
+    target_image_path: Path,
+    patches_probabilities: np.ndarray,
+    patches_origins: np.ndarray,
+    image_tensor: tf.Tensor,
+    patch_overlap: int,
+    window_type: str,
+) -> tf.Tensor:
+    """
+    Merge the patches probabilities with a weighted average on their overlaps, then take the most probable class.
+
+    :param target_image_path: Path of the image the patches were cut from.
+    :param patches_probabilities: Array of shape (n_patches, patch_size, patch_size, n_classes + 1).
+    :param patches_origins: The (n_patches, 2) origins of the patches.
+    :param image_tensor: The image the patches were cut from.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param window_type: The blending window, either "gaussian" or "cosine".
+    :return: The rebuilt image tensor with dimension : [width, height],
+      cropped by patch_overlap / 2 on each side like rebuild_predictions_with_overlap().
+    """
+    assert (
+        patch_overlap % 2 == 0
+    ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+
+    image_height, image_width, channels_number = get_image_tensor_shape(
+        image_tensor=image_tensor
+    )
+
+    logger.info(
+        f"\nBlending predictions patches for image {get_file_name_with_extension(target_image_path)} with a {window_type} window..."
+    )
+    blended_probabilities = blend_patches(
+        patches=patches_probabilities,
+        patches_origins=patches_origins,
+        image_height=image_height,
+        image_width=image_width,
+        window=get_blending_window(
+            patch_size=patches_probabilities.shape[1], window_type=window_type
+        ),
+    )
+    half_overlap = patch_overlap // 2
+    blended_probabilities = blended_probabilities[
+        half_overlap : image_height - half_overlap,
+        half_overlap : image_width - half_overlap,
+    ]
+
+    # Remove background predictions so it takes the max on the non background classes
+    rebuilt_tensor = tf.constant(
+        np.argmax(blended_probabilities[:, :, 1:], axis=2).astype(np.int32) + 1
+    )
+    logger.info(
+        f"\nImage predictions have been successfully built with size {rebuilt_tensor.shape} (original image size : {image_tensor.shape})."
+    )
+    return rebuilt_tensor
@@ -0,0 +1,378 @@
+import queue
+import threading
+import numpy as np
+import tensorflow as tf
+from loguru import logger
+from pathlib import Path
+from typing import Iterator
+
+from dataset_builder.patches_generator import extract_patches_array
+from deep_learning.inference_model import get_inference_model
+from deep_learning.tile_cache import TilePredictionCache
+from deep_learning.predictions import (
+    make_predictions,
+    load_saved_model,
+    load_saved_model_arbitrary_input,
+    correlate_predictions,
+    rebuild_predictions_with_overlap,
+    rebuild_predictions_with_blending,
+)
+from utils.image_utils import decode_image, get_image_name_without_extension
+from utils.time_utils import traced
+
+# Time the producer thread waits for a free place in the queue before checking whether the consumer stopped, in seconds
+QUEUE_PUT_TIMEOUT = 0.1
+
+
+def make_predictions_pipelined(
+    target_images_paths_list: [Path],
+    checkpoint_dir_path: Path,
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    misclassification_size: int = 5,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+    queue_size: int = 2,
+    jit_compile: bool = False,
+    quantized_model_path: Path = None,
+    coarse_downscale_factor: int = None,
+    tile_cache: TilePredictionCache = None,
+    uniform_variance_threshold: float = None,
+    memory_budget_mb: int = None,
+) -> Iterator[tuple]:
+    """
+    Make predictions on several images, with the same result as make_predictions() on each one of them.
+    The next images are decoded and cut into patches by a background thread while the model is predicting,
+    and the patches of consecutive images are packed together so that every batch but the last one is full.
+    With a quantized model, coarse-to-fine predictions, a tile cache, the uniform patches fast path or a memory budget,
+    the images are predicted one after the other by make_predictions() instead, without packing their patches.
+
+    :param target_images_paths_list: Images to make predictions on.
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded. Also the number of patches predicted per model step.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the predictions, i.e. make a local weighted mean on each class probability.
+    :param correlation_filter: The filter to use for correlation.
+    :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
+    :param overlap_blending: How the overlapping patches are merged, either "crop", "gaussian" or "cosine".
+    :param inference_patch_size: Size of the patches the images are cut into for the predictions, if different from patch_size.
+    :param queue_size: Number of images decoded and cut in advance.
+    :param jit_compile: Whether or not to compile the inference function with XLA, in "crop" overlap blending.
+    :param quantized_model_path: Path of an int8 quantized model to use instead of the checkpoint, see make_predictions().
+    :param coarse_downscale_factor: If set, the images are predicted coarse-to-fine, see make_predictions().
+    :param tile_cache: A cache of the patches predictions, see make_predictions().
+    :param uniform_variance_threshold: If set, the uniform patches may skip the model, see make_predictions().
+    :param memory_budget_mb: If set, the images are predicted by bands of patches rows fitting in this memory, see make_predictions().
+    :return: An iterator of (image path, 2D categorical predictions tensor), in the order of target_images_paths_list.
+    """
+    assert (
+        patch_overlap % 2 == 0
+    ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+    if overlap_blending not in ["crop", "gaussian", "cosine"]:
+        raise ValueError(
+            f"Overlap blending {overlap_blending} is unknown : expected crop, gaussian or cosine."
+        )
+    if inference_patch_size is None:
+        inference_patch_size = patch_size
+
+    if any(
+        option is not None
+        for option in [
+            quantized_model_path,
+            coarse_downscale_factor,
+            tile_cache,
+            uniform_variance_threshold,
+            memory_budget_mb,
+        ]
+    ):
+        for target_image_path in target_images_paths_list:
+            yield target_image_path, make_predictions(
+                target_image_path=target_image_path,
+                checkpoint_dir_path=checkpoint_dir_path,
+                patch_size=patch_size,
+                patch_overlap=patch_overlap,
+                n_classes=n_classes,
+                batch_size=batch_size,
+                encoder_kernel_size=encoder_kernel_size,
+                correlate_predictions_bool=correlate_predictions_bool,
+                correlation_filter=correlation_filter,
+                misclassification_size=misclassification_size,
+                overlap_blending=overlap_blending,
+                inference_patch_size=inference_patch_size,
+                quantized_model_path=quantized_model_path,
+                jit_compile=jit_compile,
+                coarse_downscale_factor=coarse_downscale_factor,
+                tile_cache=tile_cache,
+                uniform_variance_threshold=uniform_variance_threshold,
+                memory_budget_mb=memory_budget_mb,
+            )
+        return
+
+    if inference_patch_size == patch_size:
+        model = load_saved_model(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            input_shape=patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+    else:
+        model = load_saved_model_arbitrary_input(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+
+    images_queue = queue.Queue(maxsize=queue_size)
+    # set when the consumer stops, even early, so that the producer does not stay blocked on a full queue
+    stop_event = threading.Event()
+    producer_thread = threading.Thread(
+        target=put_images_patches,
+        name="images_producer",
+        kwargs={
+            "target_images_paths_list": target_images_paths_list,
+            "images_queue": images_queue,
+            "patch_size": inference_patch_size,
+            "patch_overlap": patch_overlap,
+            "stop_event": stop_event,
+        },
+        daemon=True,
+    )
+    producer_thread.start()
+    try:
+        yield from iterate_packed_predictions(
+            images_queue=images_queue,
+            model=model,
+            batch_size=batch_size,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            misclassification_size=misclassification_size,
+            overlap_blending=overlap_blending,
+            inference_patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            jit_compile=jit_compile,
+        )
+    finally:
+        stop_event.set()
+
+
+def iterate_packed_predictions(
+    images_queue: queue.Queue,
+    model: tf.keras.Model,
+    batch_size: int,
+    n_classes: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    misclassification_size: int,
+    overlap_blending: str,
+    inference_patch_size: int,
+    patch_overlap: int,
+    jit_compile: bool,
+) -> Iterator[tuple]:
+    """Predict the patches of the queued images in full batches, and yield each image as soon as all its patches are predicted."""
+    # images whose patches are not all predicted yet, in the order of target_images_paths_list
+    # each one is [image path, image tensor, patches origins, number of patches, predicted patches chunks]
+    pending_images = list()
+    batch_chunks = list()
+    batch_owners = list()
+    n_batch_patches = 0
+    for target_image_path, image_tensor, patches, patches_origins in iterate_queue(
+        images_queue=images_queue
+    ):
+        pending_image = [
+            target_image_path,
+            image_tensor,
+            patches_origins,
+            len(patches),
+            [],
+        ]
+        pending_images.append(pending_image)
+        chunk_start = 0
+        while chunk_start < len(patches):
+            chunk_end = min(chunk_start + batch_size - n_batch_patches, len(patches))
+            batch_chunks.append(patches[chunk_start:chunk_end])
+            batch_owners.append(pending_image)
+            n_batch_patches += chunk_end - chunk_start
+            chunk_start = chunk_end
+
+            if n_batch_patches == batch_size:
+                predict_packed_batch(
+                    model=model,
+                    batch_chunks=batch_chunks,
+                    batch_owners=batch_owners,
+                    n_classes=n_classes,
+                    correlate_predictions_bool=correlate_predictions_bool,
+                    correlation_filter=correlation_filter,
+                    keep_probabilities=overlap_blending != "crop",
+                    jit_compile=jit_compile,
+                )
+                batch_chunks, batch_owners, n_batch_patches = list(), list(), 0
+                # the first images are finished as soon as their last patch is predicted
+                while pending_images and is_image_predicted(pending_images[0]):
+                    yield rebuild_pending_image(
+                        pending_image=pending_images.pop(0),
+                        patch_size=inference_patch_size,
+                        patch_overlap=patch_overlap,
+                        misclassification_size=misclassification_size,
+                        overlap_blending=overlap_blending,
+                    )
+
+    if batch_chunks:
+        predict_packed_batch(
+            model=model,
+            batch_chunks=batch_chunks,
+            batch_owners=batch_owners,
+            n_classes=n_classes,
+            correlate_predictions_bool=correlate_predictions_bool,
+            correlation_filter=correlation_filter,
+            keep_probabilities=overlap_blending != "crop",
+            jit_compile=jit_compile,
+        )
+    for pending_image in pending_images:
+        yield rebuild_pending_image(
+            pending_image=pending_image,
+            patch_size=inference_patch_size,
+            patch_overlap=patch_overlap,
+            misclassification_size=misclassification_size,
+            overlap_blending=overlap_blending,
+        )
+
+
+def put_images_patches(
+    target_images_paths_list: [Path],
+    images_queue: queue.Queue,
+    patch_size: int,
+    patch_overlap: int,
+    stop_event: threading.Event,
+) -> None:
+    """
+    Decode and cut the images into patches, and put them in the queue. None is put at the end, or the raised exception if any.
+    Stops as soon as stop_event is set, e.g. when the consumer raised or was closed before the last image.
+    """
+    try:
+        for target_image_path in target_images_paths_list:
+            if stop_event.is_set():
+                return
+            image_tensor = decode_image(file_path=target_image_path)
+            patches, patches_origins = extract_patches_array(
+                image_tensor=image_tensor,
+                patch_size=patch_size,
+                patch_overlap=patch_overlap,
+            )
+            if not put_until_stopped(
+                images_queue=images_queue,
+                item=(target_image_path, image_tensor, patches, patches_origins),
+                stop_event=stop_event,
+            ):
+                return
+        put_until_stopped(images_queue=images_queue, item=None, stop_event=stop_event)
+    except Exception as exception:
+        put_until_stopped(
+            images_queue=images_queue, item=exception, stop_event=stop_event
+        )
+
+
+def put_until_stopped(
+    images_queue: queue.Queue, item, stop_event: threading.Event
+) -> bool:
+    """Put the item in the queue, unless stop_event is set while waiting for a free place. Return whether it was put."""
+    while not stop_event.is_set():
+        try:
+            images_queue.put(item, timeout=QUEUE_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def iterate_queue(images_queue: queue.Queue) -> Iterator[tuple]:
+    """Get the queue items until None, and raise the exceptions put in the queue."""
+    while True:
+        item = images_queue.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+@traced("predict")
+def predict_packed_batch(
+    model: tf.keras.Model,
+    batch_chunks: [np.ndarray],
+    batch_owners: [list],
+    n_classes: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    keep_probabilities: bool,
+    jit_compile: bool = False,
+) -> None:
+    """Predict a batch made of patches chunks from several images, and give each image back the predictions of its chunk."""
+    if keep_probabilities:
+        predictions = np.asarray(model.predict_on_batch(np.concatenate(batch_chunks)))
+        if correlate_predictions_bool:
+            predictions = correlate_predictions(
+                predictions_array=predictions,
+                correlation_filter=correlation_filter,
+                n_classes=n_classes,
+            )
+    else:
+        inference_model = get_inference_model(
+            model=model,
+            correlation_filter=correlation_filter
+            if correlate_predictions_bool
+            else None,
+            jit_compile=jit_compile,
+        )
+        predictions = inference_model.predict_classes(
+            np.concatenate(batch_chunks)
+        ).numpy()
+
+    chunk_start = 0
+    for chunk, pending_image in zip(batch_chunks, batch_owners):
+        pending_image[4].append(predictions[chunk_start : chunk_start + len(chunk)])
+        chunk_start += len(chunk)
+
+
+def is_image_predicted(pending_image: list) -> bool:
+    return sum(len(chunk) for chunk in pending_image[4]) == pending_image[3]
+
+
+def rebuild_pending_image(
+    pending_image: list,
+    patch_size: int,
+    patch_overlap: int,
+    misclassification_size: int,
+    overlap_blending: str,
+) -> (Path, tf.Tensor):
+    target_image_path, image_tensor, patches_origins, n_patches, chunks = pending_image
+    if overlap_blending == "crop":
+        predictions_tensor = rebuild_predictions_with_overlap(
+            target_image_path=target_image_path,
+            patches_classes=np.concatenate(chunks),
+            image_tensor=image_tensor,
+            patch_size=patch_size,
+            patch_overlap=patch_overlap,
+            misclassification_size=misclassification_size,
+        )
+    else:
+        predictions_tensor = rebuild_predictions_with_blending(
+            target_image_path=target_image_path,
+            patches_probabilities=np.concatenate(chunks),
+            patches_origins=patches_origins,
+            image_tensor=image_tensor,
+            patch_overlap=patch_overlap,
+            window_type=overlap_blending,
+        )
+    logger.info(
+        f"\nPredictions on {get_image_name_without_extension(target_image_path)} have been done."
+    )
+    return target_image_path, predictions_tensor
@@ -0,0 +1,172 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from loguru import logger
+from pathlib import Path
+from typing import Iterator
+
+from deep_learning.predictions import make_predictions, warm_up_model
+from constants import N_CPUS
+
+
+def make_predictions_multiprocess(
+    target_images_paths_list: [Path],
+    checkpoint_dir_path: Path,
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    correlate_predictions_bool: bool,
+    correlation_filter: np.ndarray,
+    n_workers: int = 2,
+    n_cpus: int = N_CPUS,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+) -> Iterator[tuple]:
+    """
+    Make predictions on many images with a pool of processes, each of them running make_predictions() on one image at a time.
+    Each worker loads the model once, and TensorFlow uses n_cpus // n_workers threads in each worker so that the workers do not compete for the cores.
+    The threads numbers are passed to the workers through os.environ, which is changed in the parent process while the pool starts :
+    it must not run alongside other threads starting TensorFlow or reading these variables, e.g. another pool.
+
+    :param target_images_paths_list: Images to make predictions on.
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param correlate_predictions_bool: Whether or not to apply correlation on the predictions.
+    :param correlation_filter: The filter to use for correlation.
+    :param n_workers: Number of worker processes.
+    :param n_cpus: Number of cores shared by the workers.
+    :param overlap_blending: How the overlapping patches are merged, either "crop", "gaussian" or "cosine".
+    :param inference_patch_size: Size of the patches the images are cut into for the predictions, if different from patch_size.
+    :return: An iterator of (image path, 2D categorical predictions array), in the order of target_images_paths_list.
+      The predictions are yielded as soon as they are available.
+    """
+    # TensorFlow reads its threads numbers from the environment when it starts in a worker,
+    # which happens as soon as the worker imports the project constants
+    workers_environment = {
+        "TF_NUM_INTRAOP_THREADS": str(max(1, n_cpus // n_workers)),
+        "TF_NUM_INTEROP_THREADS": "1",
+    }
+    previous_environment = {key: os.environ.get(key) for key in workers_environment}
+    os.environ.update(workers_environment)
+    try:
+        # spawn rather than fork : the TensorFlow runtime of the parent process can not be shared with its children
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_predictions_worker,
+            initargs=(
+                checkpoint_dir_path,
+                n_classes,
+                patch_size,
+                batch_size,
+                encoder_kernel_size,
+                inference_patch_size,
+                overlap_blending,
+                correlation_filter if correlate_predictions_bool else None,
+            ),
+        ) as executor:
+            predict_image = partial(
+                make_predictions_array,
+                checkpoint_dir_path=checkpoint_dir_path,
+                patch_size=patch_size,
+                patch_overlap=patch_overlap,
+                n_classes=n_classes,
+                batch_size=batch_size,
+                encoder_kernel_size=encoder_kernel_size,
+                correlate_predictions_bool=correlate_predictions_bool,
+                correlation_filter=correlation_filter,
+                overlap_blending=overlap_blending,
+                inference_patch_size=inference_patch_size,
+            )
+            # the workers are all started by the first submissions of map
+            predictions_arrays = executor.map(predict_image, target_images_paths_list)
+            restore_environment(previous_environment=previous_environment)
+            previous_environment = dict()
+            for target_image_path, predictions_array in zip(
+                target_images_paths_list, predictions_arrays
+            ):
+                yield target_image_path, predictions_array
+    finally:
+        restore_environment(previous_environment=previous_environment)
+
+
+def restore_environment(previous_environment: {str: str}) -> None:
+    """Set back environment variables to their previous values, None meaning that they were not set."""
+    for key, value in previous_environment.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def init_predictions_worker(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    inference_patch_size: int,
+    overlap_blending: str,
+    correlation_filter: np.ndarray,
+) -> None:
+    """Load the model in the cache of the worker process, and trace the function its predictions run."""
+    logger.info(
+        f"\nWorker {os.getpid()} uses {os.environ.get('TF_NUM_INTRAOP_THREADS')} TensorFlow threads."
+    )
+    warm_up_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        patch_size=patch_size,
+        batch_size=batch_size,
+        encoder_kernel_size=encoder_kernel_size,
+        inference_patch_size=inference_patch_size,
+        overlap_blending=overlap_blending,
+        correlation_filter=correlation_filter,
+    )
+
+
+def make_predictions_array(target_image_path: Path, **kwargs) -> np.ndarray:
+    """Run make_predictions() in a worker, and return a numpy array since tensors can not be sent back to the parent process."""
+    return np.asarray(make_predictions(target_image_path=target_image_path, **kwargs))
+
+
+def benchmark_workers_scaling(
+    target_images_paths_list: [Path],
+    workers_numbers: [int],
+    **kwargs,
+) -> {int: float}:
+    """
+    Measure the predictions throughput for several numbers of workers.
+
+    :param target_images_paths_list: Images to make predictions on.
+    :param workers_numbers: The numbers of worker processes to try.
+    :param kwargs: The other arguments of make_predictions_multiprocess().
+    :return: The number of images predicted per second, for each number of workers.
+      The pool start-up and the models loading are included.
+    """
+    throughputs = dict()
+    for n_workers in workers_numbers:
+        start_time = time.perf_counter()
+        for _ in make_predictions_multiprocess(
+            target_images_paths_list=target_images_paths_list,
+            n_workers=n_workers,
+            **kwargs,
+        ):
+            pass
+        throughputs[n_workers] = len(target_images_paths_list) / (
+            time.perf_counter() - start_time
+        )
+        logger.info(
+            f"\n{n_workers} workers : {throughputs[n_workers]:.2f} images/s, "
+            f"speed-up x{throughputs[n_workers] / throughputs[workers_numbers[0]]:.2f}"
+        )
+    return throughputs
@@ -0,0 +1,157 @@
+import time
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from loguru import logger
+from pathlib import Path
+from typing import Iterator
+
+from utils.image_utils import decode_image, get_image_patches_paths_with_limit
+from deep_learning.inference_model import get_inference_model, load_quantized_model
+from deep_learning.predictions import load_saved_model
+from constants import MAPPING_CLASS_NUMBER
+
+
+def export_quantized_model(
+    checkpoint_dir_path: Path,
+    output_path: Path,
+    patches_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    encoder_kernel_size: int,
+    n_calibration_patches: int = 100,
+) -> Path:
+    """
+    Quantize the weights and the activations of a trained model to int8, and save it as a TensorFlow Lite model.
+    The activations ranges are calibrated on a random sample of the training patches.
+
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param output_path: Path of the .tflite file to write.
+    :param patches_dir_path: The training patches directory, usually PATCHES_DIR_PATH.
+    :param n_classes: Number of classes to map, background excluded.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param n_calibration_patches: Number of patches used for the calibration.
+    :return: The path of the quantized model.
+    """
+    model = load_saved_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        input_shape=patch_size,
+        batch_size=1,
+        encoder_kernel_size=encoder_kernel_size,
+        use_cache=False,
+    )
+    calibration_patches_paths = get_image_patches_paths_with_limit(
+        patches_dir=patches_dir_path, n_patches_limit=n_calibration_patches
+    )
+
+    def get_calibration_samples() -> Iterator[list]:
+        for patch_path in calibration_patches_paths:
+            patch = decode_image(file_path=patch_path)[:, :, :3]
+            yield [tf.cast(patch[tf.newaxis], tf.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = get_calibration_samples
+    # the inputs and outputs stay in float32, like the ones of the model
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    logger.info(
+        f"\nQuantizing the model, calibrated on {len(calibration_patches_paths)} patches..."
+    )
+    output_path.write_bytes(converter.convert())
+    logger.info(f"\nQuantized model successfully saved at : {output_path}")
+    return output_path
+
+
+def build_quantization_report(
+    checkpoint_dir_path: Path,
+    quantized_model_path: Path,
+    patches_dir_path: Path,
+    report_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    n_patches: int = 50,
+) -> pd.DataFrame:
+    """
+    Compare the quantized model with the float model, on a random sample of patches.
+    The per-class agreement is the proportion of the pixels of a class for the float model which get the same class with the quantized model.
+
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param quantized_model_path: Path of the quantized model.
+    :param patches_dir_path: The patches directory, usually PATCHES_DIR_PATH.
+    :param report_dir_path: The directory the report is written in.
+    :param n_classes: Number of classes to map, background excluded.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param batch_size: Batch size that was used for the model which is loaded.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param n_patches: Number of patches the models are compared on.
+    :return: The report, also saved as a csv file in report_dir_path.
+    """
+    patches_paths = get_image_patches_paths_with_limit(
+        patches_dir=patches_dir_path, n_patches_limit=n_patches
+    )
+    patches = np.stack(
+        [np.asarray(decode_image(file_path=path))[:, :, :3] for path in patches_paths]
+    )
+
+    float_model = get_inference_model(
+        model=load_saved_model(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            input_shape=patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+    )
+    quantized_model = load_quantized_model(quantized_model_path=quantized_model_path)
+
+    models_classes = dict()
+    models_latencies = dict()
+    for model_name, model in [("float", float_model), ("int8", quantized_model)]:
+        # the first batch pays the tracing or the interpreter set-up
+        model.predict_classes(patches[:batch_size])
+        start_time = time.perf_counter()
+        models_classes[model_name] = np.concatenate(
+            [
+                np.asarray(model.predict_classes(patches[idx : idx + batch_size]))
+                for idx in range(0, len(patches), batch_size)
+            ]
+        )
+        models_latencies[model_name] = (time.perf_counter() - start_time) / len(patches)
+
+    report_rows = list()
+    for class_name, class_number in MAPPING_CLASS_NUMBER.items():
+        float_class_mask = models_classes["float"] == class_number
+        report_rows.append(
+            {
+                "class": class_name,
+                "float_pixels": int(np.sum(float_class_mask)),
+                "agreement": np.mean(
+                    models_classes["int8"][float_class_mask] == class_number
+                )
+                if np.any(float_class_mask)
+                else np.nan,
+            }
+        )
+    report_rows.append(
+        {
+            "class": "all",
+            "float_pixels": models_classes["float"].size,
+            "agreement": np.mean(models_classes["float"] == models_classes["int8"]),
+        }
+    )
+    quantization_report = pd.DataFrame(report_rows)
+    quantization_report["float_latency_ms_per_patch"] = 1000 * models_latencies["float"]
+    quantization_report["int8_latency_ms_per_patch"] = 1000 * models_latencies["int8"]
+
+    output_path = report_dir_path / "quantization_report.csv"
+    quantization_report.to_csv(output_path, index=False)
+    logger.info(
+        f"\nLatency per patch : {1000 * models_latencies['float']:.1f} ms (float) vs {1000 * models_latencies['int8']:.1f} ms (int8), "
+        f"pixels agreement : {100 * report_rows[-1]['agreement']:.2f}%."
+        f"\nQuantization report successfully saved at : {output_path}"
+    )
+    return quantization_report
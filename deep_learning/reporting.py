@@ -1,34 +1,43 @@
+import io
 import matplotlib
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-import matplotlib.pyplot as plt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
 from pathlib import Path
 from typing import List
 from loguru import logger
 from tensorflow import keras
 
-from utils.time_utils import get_formatted_time
+from utils.time_utils import (
+    get_formatted_time,
+    start_trace,
+    trace_span,
+    traced,
+    TRACE_FILE_NAME,
+)
 from utils.image_utils import (
     decode_image,
     get_image_name_without_extension,
     get_image_tensor_shape,
+    save_binary_masks,
+    save_png_image,
+    write_file_bytes,
 )
-from utils.plotting_utils import (
-    save_patch_composition_plot,
-    map_categorical_mask_to_3_color_channels_tensor,
-    turn_2d_tensor_to_3d_tensor,
-)
-from deep_learning.predictions import (
-    make_predictions,
-)
+from utils.plotting_utils import save_patch_composition_plot
+from utils.colorization import colorize_class_map, overlay_class_map
+from deep_learning.predictions_pipeline import make_predictions_pipelined
+from deep_learning.tile_cache import TilePredictionCache
 from constants import (
     PALETTE_HEXA,
     MAPPING_CLASS_NUMBER,
-    MASK_TRUE_VALUE,
-    MASK_FALSE_VALUE,
 )
 
+# Number of predicted images waiting for the writer thread before the predictions wait for it
+PENDING_REPORTS_LIMIT = 2
+
 
 def build_training_run_report(
     report_dir_path: Path,
@@ -202,58 +211,120 @@ def build_predict_run_report(
     light_report_bool: bool,
     correlate_predictions_bool: bool,
     correlation_filter: np.ndarray,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+    jit_compile: bool = False,
+    quantized_model_path: Path = None,
+    coarse_downscale_factor: int = None,
+    tile_cache: TilePredictionCache = None,
+    uniform_variance_threshold: float = None,
+    memory_budget_mb: int = None,
 ) -> None:
+    """
+    Predict the test images with the model of a report, and save their plots in a new "3_predictions" folder of the report.
+    The predictions options are the ones of make_predictions_pipelined().
+    """
     predictions_report_root_path = (
         report_dir_path / "3_predictions" / get_formatted_time()
     )
     predictions_report_root_path.mkdir(parents=True)
 
-    for test_image_path in test_images_paths_list:
-        # Make predictions
-        predictions_tensor = make_predictions(
-            target_image_path=test_image_path,
-            checkpoint_dir_path=report_dir_path / "2_model_report",
-            patch_size=patch_size,
-            patch_overlap=patch_overlap,
-            n_classes=n_classes,
-            batch_size=batch_size,
-            encoder_kernel_size=encoder_kernel_size,
-            correlate_predictions_bool=correlate_predictions_bool,
-            correlation_filter=correlation_filter,
-        )
+    save_predictions_config(
+        predictions_report_root_path=predictions_report_root_path,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+        batch_size=batch_size,
+        encoder_kernel_size=encoder_kernel_size,
+        overlap_blending=overlap_blending,
+        inference_patch_size=inference_patch_size,
+        jit_compile=jit_compile,
+        quantized_model_path=quantized_model_path,
+        coarse_downscale_factor=coarse_downscale_factor,
+        tile_cache_bool=tile_cache is not None,
+        uniform_variance_threshold=uniform_variance_threshold,
+        memory_budget_mb=memory_budget_mb,
+    )
+
+    # The spans of every stage, in the predictions and in the writer threads, are saved next to the report
+    with start_trace() as tracer:
+        # The plots of an image are written by a single writer thread while the next images are predicted
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending_reports_futures = deque()
+            for test_image_path, predictions_tensor in make_predictions_pipelined(
+                target_images_paths_list=test_images_paths_list,
+                checkpoint_dir_path=report_dir_path / "2_model_report",
+                patch_size=patch_size,
+                patch_overlap=patch_overlap,
+                n_classes=n_classes,
+                batch_size=batch_size,
+                encoder_kernel_size=encoder_kernel_size,
+                correlate_predictions_bool=correlate_predictions_bool,
+                correlation_filter=correlation_filter,
+                overlap_blending=overlap_blending,
+                inference_patch_size=inference_patch_size,
+                jit_compile=jit_compile,
+                quantized_model_path=quantized_model_path,
+                coarse_downscale_factor=coarse_downscale_factor,
+                tile_cache=tile_cache,
+                uniform_variance_threshold=uniform_variance_threshold,
+                memory_budget_mb=memory_budget_mb,
+            ):
+                # the class maps do not pile up in memory when the writer is slower than the predictions,
+                # and the exceptions of the writer thread are raised without waiting for the last image
+                if len(pending_reports_futures) == PENDING_REPORTS_LIMIT:
+                    pending_reports_futures.popleft().result()
+                pending_reports_futures.append(
+                    writer.submit(
+                        save_image_predictions_report,
+                        target_image_path=test_image_path,
+                        predictions_tensor=predictions_tensor,
+                        predictions_report_root_path=predictions_report_root_path,
+                        light_report_bool=light_report_bool,
+                    )
+                )
+            for pending_report_future in pending_reports_futures:
+                pending_report_future.result()
+    tracer.save(output_path=predictions_report_root_path / TRACE_FILE_NAME)
+    tracer.log_stages_durations()
+
+
+@traced("report")
+def save_image_predictions_report(
+    target_image_path: Path,
+    predictions_tensor: tf.Tensor,
+    predictions_report_root_path: Path,
+    light_report_bool: bool,
+) -> None:
+    save_test_images_vs_predictions_plot(
+        target_image_path=target_image_path,
+        predictions_tensor=predictions_tensor,
+        predictions_report_root_path=predictions_report_root_path,
+    )
+
+    if not light_report_bool:
 
-        save_test_images_vs_predictions_plot(
-            target_image_path=test_image_path,
+        predictions_only_path = save_predictions_only_plot(
+            target_image_path=target_image_path,
             predictions_tensor=predictions_tensor,
             predictions_report_root_path=predictions_report_root_path,
         )
 
-        save_predictions_config(
+        save_predictions_overlay_plot(
+            target_image_path=target_image_path,
+            predictions_tensor=predictions_tensor,
             predictions_report_root_path=predictions_report_root_path,
-            patch_size=patch_size,
-            patch_overlap=patch_overlap,
-            batch_size=batch_size,
-            encoder_kernel_size=encoder_kernel_size,
         )
 
-        if not light_report_bool:
-
-            predictions_only_path = save_predictions_only_plot(
-                target_image_path=test_image_path,
-                predictions_tensor=predictions_tensor,
-                predictions_report_root_path=predictions_report_root_path,
-            )
-
-            save_binary_predictions_plot(
-                target_image_path=test_image_path,
-                predictions_tensor=predictions_tensor,
-                predictions_report_root_path=predictions_report_root_path,
-            )
+        save_binary_predictions_plot(
+            target_image_path=target_image_path,
+            predictions_tensor=predictions_tensor,
+            predictions_report_root_path=predictions_report_root_path,
+        )
 
-            # save_median_filtering_comparison(
-            #     source_image_path=predictions_only_path,
-            #     predictions_report_root_path=predictions_report_root_path,
-            # )
+        # save_median_filtering_comparison(
+        #     source_image_path=predictions_only_path,
+        #     predictions_report_root_path=predictions_report_root_path,
+        # )
 
 
 def save_test_images_vs_predictions_plot(
@@ -273,11 +344,11 @@ def save_test_images_vs_predictions_plot(
         predictions_tensor_width,
         channels_number,
     ) = get_image_tensor_shape(image_tensor=predictions_tensor)
-    mapped_predictions_array = map_categorical_mask_to_3_color_channels_tensor(
-        categorical_mask_tensor=predictions_tensor
-    )
+    mapped_predictions_array = colorize_class_map(class_map=predictions_tensor)
 
-    fig, (ax1, ax2) = plt.subplots(1, 2)
+    # a Figure object, unlike pyplot, can be drawn outside of the main thread
+    fig = Figure()
+    ax1, ax2 = fig.subplots(1, 2)
     fig.suptitle(
         f"Image : {get_image_name_without_extension(image_path=target_image_path)}"
     )
@@ -311,7 +382,10 @@ def save_test_images_vs_predictions_plot(
         images_and_predictions_dir_path
         / f"image_vs_predictions__{get_image_name_without_extension(target_image_path)}.png"
     )
-    plt.savefig(output_path, bbox_inches="tight", dpi=300)
+    with trace_span(name="encode", function="savefig"):
+        figure_buffer = io.BytesIO()
+        fig.savefig(figure_buffer, format="png", bbox_inches="tight", dpi=300)
+    write_file_bytes(file_bytes=figure_buffer.getvalue(), output_path=output_path)
 
     logger.info(
         f"\nTest image vs predictions plot successfully saved at : {output_path}"
@@ -323,9 +397,7 @@ def save_predictions_only_plot(
     predictions_tensor: tf.Tensor,
     predictions_report_root_path: Path,
 ) -> Path:
-    mapped_predictions_array = map_categorical_mask_to_3_color_channels_tensor(
-        categorical_mask_tensor=predictions_tensor
-    )
+    mapped_predictions_array = colorize_class_map(class_map=predictions_tensor)
     predictions_only_subdir_path = predictions_report_root_path / "predictions_only"
     if not predictions_only_subdir_path.exists():
         predictions_only_subdir_path.mkdir()
@@ -334,50 +406,67 @@ def save_predictions_only_plot(
         predictions_only_subdir_path
         / f"predictions_only__{get_image_name_without_extension(target_image_path)}.png"
     )
-    tf.keras.preprocessing.image.save_img(output_path, mapped_predictions_array)
+    save_png_image(image_array=mapped_predictions_array, output_path=output_path)
     logger.info(f"\nPredictions only plot successfully saved at : {output_path}")
 
     return output_path
 
 
+def save_predictions_overlay_plot(
+    target_image_path: Path,
+    predictions_tensor: tf.Tensor,
+    predictions_report_root_path: Path,
+) -> Path:
+    """Save the predictions colors blended on the image, the background being left uncolored."""
+    overlay_array = overlay_class_map(
+        image_array=decode_image(file_path=target_image_path),
+        class_map=predictions_tensor,
+    )
+    predictions_overlay_subdir_path = (
+        predictions_report_root_path / "predictions_overlay"
+    )
+    if not predictions_overlay_subdir_path.exists():
+        predictions_overlay_subdir_path.mkdir()
+
+    output_path = (
+        predictions_overlay_subdir_path
+        / f"predictions_overlay__{get_image_name_without_extension(target_image_path)}.png"
+    )
+    save_png_image(image_array=overlay_array, output_path=output_path, scale=False)
+    logger.info(f"\nPredictions overlay plot successfully saved at : {output_path}")
+
+    return output_path
+
+
 def save_binary_predictions_plot(
     target_image_path: Path,
     predictions_tensor: tf.Tensor,
     predictions_report_root_path: Path,
-):
-    # Separate predictions tensor into a list of n_classes binary tensors of size (width, height)
-    binary_predictions_sub_dir = predictions_report_root_path / "binary_predictions"
-    if not binary_predictions_sub_dir.exists():
-        binary_predictions_sub_dir.mkdir()
-
-    # Create and save binary tensors
-    for idx, class_number in enumerate(MAPPING_CLASS_NUMBER.values()):
-        binary_tensor = tf.where(
-            condition=tf.equal(predictions_tensor, class_number),
-            x=MASK_TRUE_VALUE,
-            y=MASK_FALSE_VALUE,
-        )
+) -> {str: Path}:
+    """Save the binary mask of each class, split from the predictions in a single pass and written in parallel."""
+    image_name = get_image_name_without_extension(target_image_path)
+    binary_predictions_class_sub_dir = (
+        predictions_report_root_path / "binary_predictions" / image_name
+    )
+    if not binary_predictions_class_sub_dir.exists():
+        binary_predictions_class_sub_dir.mkdir(parents=True)
 
-        binary_tensor_3d = turn_2d_tensor_to_3d_tensor(tensor_2d=binary_tensor)
-        mapping_number_class = {
-            class_number: class_name
-            for class_name, class_number in MAPPING_CLASS_NUMBER.items()
-        }
+    class_masks_paths_dict = {
+        class_name: binary_predictions_class_sub_dir / f"{image_name}__{class_name}.png"
+        for class_name in MAPPING_CLASS_NUMBER
+    }
+    save_binary_masks(
+        class_map=predictions_tensor,
+        output_paths_dict={
+            MAPPING_CLASS_NUMBER[class_name]: output_path
+            for class_name, output_path in class_masks_paths_dict.items()
+        },
+    )
+    logger.info(
+        f"\nBinary predictions plots successfully saved in folder : {binary_predictions_class_sub_dir}"
+    )
 
-        binary_predictions_class_sub_dir = (
-            predictions_report_root_path
-            / "binary_predictions"
-            / get_image_name_without_extension(target_image_path)
-        )
-        if not binary_predictions_class_sub_dir.exists():
-            binary_predictions_class_sub_dir.mkdir(parents=True)
-        output_path = (
-            binary_predictions_sub_dir
-            / get_image_name_without_extension(target_image_path)
-            / f"{get_image_name_without_extension(target_image_path)}__{mapping_number_class[idx]}.png"
-        )
-        tf.keras.preprocessing.image.save_img(output_path, binary_tensor_3d)
-        logger.info(f"\nBinary predictions plot successfully saved at : {output_path}")
+    return class_masks_paths_dict
 
 
 def save_predictions_config(
@@ -386,12 +475,28 @@ def save_predictions_config(
     patch_overlap: int,
     batch_size: int,
     encoder_kernel_size: int,
+    overlap_blending: str = "crop",
+    inference_patch_size: int = None,
+    jit_compile: bool = False,
+    quantized_model_path: Path = None,
+    coarse_downscale_factor: int = None,
+    tile_cache_bool: bool = False,
+    uniform_variance_threshold: float = None,
+    memory_budget_mb: int = None,
 ) -> None:
     predictions_config = {
         "patch_size": patch_size,
         "patch_overlap": patch_overlap,
         "batch_size": batch_size,
         "encoder_kernel_size": encoder_kernel_size,
+        "overlap_blending": overlap_blending,
+        "inference_patch_size": inference_patch_size or patch_size,
+        "jit_compile": jit_compile,
+        "quantized_model_path": quantized_model_path,
+        "coarse_downscale_factor": coarse_downscale_factor,
+        "tile_cache": tile_cache_bool,
+        "uniform_variance_threshold": uniform_variance_threshold,
+        "memory_budget_mb": memory_budget_mb,
     }
 
     with open(predictions_report_root_path / "predictions_config.txt", "w") as file:
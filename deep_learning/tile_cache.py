@@ -0,0 +1,121 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from loguru import logger
+from pathlib import Path
+from typing import Callable
+
+from deep_learning.model_cache import get_model_cache_key
+from constants import TILE_CACHE_SIZE_MB
+
+
+class TilePredictionCache:
+    """
+    Predictions of the patches already seen, keyed by a hash of the patch pixels and of the model which predicted them.
+    An image predicted again, or another crop of it on the same patches grid, only runs the model on its new patches.
+    The classes are stored in uint8, and the probabilities in float16, in the limit of max_bytes :
+    the least recently used tiles are evicted first.
+    """
+
+    def __init__(self, max_bytes: int = TILE_CACHE_SIZE_MB * 2**20):
+        """
+        :param max_bytes: Memory allowed for the cached predictions, in bytes.
+        """
+        self.max_bytes = max_bytes
+        # predictions of the tiles, from the least to the most recently used
+        self.tiles = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_tile_key(self, tile: np.ndarray, model_fingerprint: str) -> bytes:
+        tile_hash = hashlib.blake2b(
+            f"{model_fingerprint}{tile.shape}".encode(), digest_size=16
+        )
+        tile_hash.update(np.ascontiguousarray(tile).data)
+        return tile_hash.digest()
+
+    def get(self, tile_key: bytes) -> np.ndarray:
+        """Get the predictions of a tile, or None if it is not in the cache."""
+        prediction = self.tiles.get(tile_key)
+        if prediction is None:
+            self.misses += 1
+            return None
+        self.tiles.move_to_end(tile_key)
+        self.hits += 1
+        return prediction
+
+    def put(self, tile_key: bytes, prediction: np.ndarray) -> None:
+        """Keep the predictions of a tile, in uint8 for classes or float16 for probabilities."""
+        if np.issubdtype(prediction.dtype, np.floating):
+            prediction = prediction.astype(np.float16)
+        else:
+            prediction = prediction.astype(np.uint8)
+        if prediction.nbytes > self.max_bytes:
+            return
+        if tile_key in self.tiles:
+            self.n_bytes -= self.tiles.pop(tile_key).nbytes
+        self.tiles[tile_key] = prediction
+        self.n_bytes += prediction.nbytes
+        while self.n_bytes > self.max_bytes:
+            self.n_bytes -= self.tiles.popitem(last=False)[1].nbytes
+
+    def predict(
+        self,
+        patches: np.ndarray,
+        predict_function: Callable[[np.ndarray], np.ndarray],
+        model_fingerprint: str,
+    ) -> np.ndarray:
+        """
+        Predict a batch of patches, running predict_function on the patches which are not in the cache only.
+
+        :param patches: A batch of uint8 patches, of shape (batch_size, patch_size, patch_size, 3).
+        :param predict_function: The function predicting a batch of patches, like the predict_classes() function of an inference model.
+        :param model_fingerprint: Identifies the model and the predictions parameters, as given by get_model_fingerprint().
+        :return: The predictions of the patches, the cached probabilities being rounded to float16.
+        """
+        tiles_keys = [
+            self.get_tile_key(tile=patch, model_fingerprint=model_fingerprint)
+            for patch in patches
+        ]
+        cached_predictions = [self.get(tile_key=tile_key) for tile_key in tiles_keys]
+        missed_indices = [
+            idx
+            for idx, prediction in enumerate(cached_predictions)
+            if prediction is None
+        ]
+        if missed_indices:
+            missed_predictions = np.asarray(predict_function(patches[missed_indices]))
+            for idx, prediction in zip(missed_indices, missed_predictions):
+                self.put(tile_key=tiles_keys[idx], prediction=prediction)
+                cached_predictions[idx] = prediction
+        return np.stack(cached_predictions)
+
+    def log_statistics(self) -> None:
+        logger.info(
+            f"\nTile cache : {self.hits} hits, {self.misses} misses, "
+            f"{len(self.tiles)} tiles in {self.n_bytes / 2 ** 20:.1f} MB."
+        )
+
+
+def get_model_fingerprint(
+    checkpoint_dir_path: Path, quantized_model_path: Path = None, **predictions_params
+) -> str:
+    """
+    Identify the predictions of a model, so that the tiles predicted by another model, or with other parameters, are not mixed up.
+
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param quantized_model_path: Path of the quantized model used instead of the checkpoint, if any.
+    :param predictions_params: The parameters the predictions depend on, like the correlation filter bytes.
+    :return: A hexadecimal fingerprint.
+    """
+    if quantized_model_path is not None:
+        model_key = (
+            str(Path(quantized_model_path).resolve()),
+            Path(quantized_model_path).stat().st_mtime_ns,
+        ) + tuple(sorted(predictions_params.items()))
+    else:
+        model_key = get_model_cache_key(
+            checkpoint_dir_path=checkpoint_dir_path, **predictions_params
+        )
+    return hashlib.blake2b(repr(model_key).encode(), digest_size=16).hexdigest()
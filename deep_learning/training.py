@@ -21,6 +21,7 @@ from utils.files_stats import (
     get_image_patches_paths,
 )
 from deep_learning.unet import build_small_unet
+from deep_learning.batch_size_tuning import get_tuned_batch_size
 from deep_learning.reporting import (
     build_training_run_report,
     init_report_paths,
@@ -51,6 +52,7 @@ def train_model(
     palette_hexa: {int: str},
     add_note: bool = False,
     image_patches_paths: [Path] = None,
+    autotune_batch_size: bool = False,
 ):
     """
     Build the model, compile it, create a dataset iterator, train the model and save the trained model in callbacks.
@@ -77,6 +79,7 @@ def train_model(
     :param palette_hexa: Mapping dictionary between class number and their corresponding plotting color.
     :param add_note: If set to True, add a note to the report in order to describe the run shortly.
     :param image_patches_paths: If not None, list of patches to use to make the training on.
+    :param autotune_batch_size: If set to True, batch_size is replaced by the batch size tuned for this machine, see get_tuned_batch_size().
     :return: The trained model and its metrics history.
     """
 
@@ -91,11 +94,22 @@ def train_model(
     # Init report paths
     report_paths_dict = init_report_paths(report_root_dir_path=report_root_dir_path)
 
-    # Define the model
+    if autotune_batch_size:
+        batch_size = get_tuned_batch_size(
+            n_classes=n_classes,
+            patch_size=patch_size,
+            encoder_kernel_size=encoder_kernel_size,
+            default_batch_size=batch_size,
+            training=True,
+            optimizer=optimizer,
+            loss_function=loss_function,
+        )
+
+    # Define the model, which accepts batches of any size
     model = build_small_unet(
         n_classes=n_classes,
         input_shape=patch_size,
-        batch_size=batch_size,
+        batch_size=None,
         encoder_kernel_size=encoder_kernel_size,
     )
 
@@ -5,6 +5,9 @@ from pathlib import Path
 
 from constants import PADDING_TYPE
 
+# the small U-Net divides its input size by 2 three times
+SMALL_UNET_INPUT_SIZE_MULTIPLE = 8
+
 
 def build_unet(
     n_classes: int, batch_size: int, encoder_kernel_size: int
@@ -111,6 +114,35 @@ def build_small_unet_arbitrary_input(
     return model
 
 
+def build_padded_model(model: keras.Model, input_size_multiple: int) -> keras.Model:
+    """
+    Wrap a fully convolutional model so that it accepts inputs of any height and width.
+    The inputs are padded by reflection up to a multiple of input_size_multiple, and the outputs are cropped back to the inputs size.
+    """
+    inputs = keras.Input(shape=(None, None, 3), batch_size=model.input_shape[0])
+    padded_inputs = layers.Lambda(
+        pad_to_multiple, arguments={"multiple": input_size_multiple}
+    )(inputs)
+    padded_outputs = model(padded_inputs)
+    outputs = layers.Lambda(
+        lambda tensors: tensors[0][
+            :, : tf.shape(tensors[1])[1], : tf.shape(tensors[1])[2]
+        ]
+    )([padded_outputs, inputs])
+    return keras.Model(inputs=inputs, outputs=outputs, name=model.name)
+
+
+def pad_to_multiple(inputs: tf.Tensor, multiple: int) -> tf.Tensor:
+    """Pad a batch of images on the bottom and right sides by reflection, up to a height and a width multiple of multiple."""
+    height_padding = -tf.shape(inputs)[1] % multiple
+    width_padding = -tf.shape(inputs)[2] % multiple
+    return tf.pad(
+        tensor=inputs,
+        paddings=[[0, 0], [0, height_padding], [0, width_padding], [0, 0]],
+        mode="SYMMETRIC",
+    )
+
+
 def conv_block(inputs: tf.Tensor, n_filters: int, kernel_size: int) -> tf.Tensor:
     x = layers.Conv2D(filters=n_filters, kernel_size=kernel_size, padding=PADDING_TYPE)(
         inputs
@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from pathlib import Path
 from math import ceil
@@ -21,7 +22,7 @@ def downscale_image(image_path: Path, downscale_factors: (int, int, int)) -> tf.
     """
     image_tensor = decode_image(file_path=image_path)
     downscaled_array = downscale_local_mean(
-        image=image_tensor, factors=downscale_factors
+        image=np.asarray(image_tensor), factors=downscale_factors
     ).astype(int)
     downscaled_tensor = tf.constant(downscaled_array, dtype=tf.uint8)
 
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def get_integral_image(image_array: np.ndarray) -> np.ndarray:
+    """
+    Get the summed-area table of a 2D array, to sum it over any box in constant time.
+
+    :param image_array: A 2D array of shape (height, width).
+    :return: An array of shape (height + 1, width + 1), whose (row, column) value is the sum of image_array[:row, :column].
+    """
+    integral_image = np.zeros(
+        (image_array.shape[0] + 1, image_array.shape[1] + 1),
+        dtype=np.float64 if np.issubdtype(image_array.dtype, np.floating) else np.int64,
+    )
+    np.cumsum(image_array, axis=0, out=integral_image[1:, 1:])
+    np.cumsum(integral_image[1:, 1:], axis=1, out=integral_image[1:, 1:])
+    return integral_image
+
+
+def get_boxes_sums(integral_image: np.ndarray, boxes_bounds: np.ndarray) -> np.ndarray:
+    """
+    Sum an array over several boxes at once, with its integral image.
+
+    :param integral_image: The integral image of the array, as given by get_integral_image().
+    :param boxes_bounds: An array of shape (n_boxes, 4) with the (row start, row end, column start, column end) bounds of each box.
+    :return: An array of shape (n_boxes,) with the sum of the array over each box.
+    """
+    rows_starts, rows_ends, columns_starts, columns_ends = boxes_bounds.T
+    return (
+        integral_image[rows_ends, columns_ends]
+        - integral_image[rows_starts, columns_ends]
+        - integral_image[rows_ends, columns_starts]
+        + integral_image[rows_starts, columns_starts]
+    )
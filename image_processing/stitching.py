@@ -0,0 +1,229 @@
+import numpy as np
+
+from dataset_builder.patches_generator import get_patches_grid_shape
+
+
+def stitch_patches(
+    patches: np.ndarray,
+    image_height: int,
+    image_width: int,
+    patch_size: int,
+    patch_overlap: int,
+) -> np.ndarray:
+    """
+    Rebuild an image from its overlapping patches, in one vectorized pass.
+    The output is allocated once, and only the valid interior of each patch is written in it,
+    i.e. the patch cropped by patch_overlap / 2 pixels on each side.
+    Warning : This function is strongly coupled with the function get_patches_origins() from the patches_generator.py module
+
+    :param patches: An array of shape (n_patches, patch_size, patch_size, ...), in the get_patches_origins() order.
+    :param image_height: Height of the image the patches were cut from.
+    :param image_width: Width of the image the patches were cut from.
+    :param patch_size: Size of the patches.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: The rebuilt array of shape (image_height - patch_overlap, image_width - patch_overlap, ...).
+    """
+    assert (
+        patch_overlap % 2 == 0
+    ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    assert patches.shape[0] == (n_vertical_patches + 1) * (
+        n_horizontal_patches + 1
+    ), f"Got {patches.shape[0]} patches, expected {(n_vertical_patches + 1) * (n_horizontal_patches + 1)} for an image of size {image_height}x{image_width}."
+
+    extra_shape = patches.shape[3:]
+    patches_grid = patches.reshape(
+        (n_vertical_patches + 1, n_horizontal_patches + 1, patch_size, patch_size)
+        + extra_shape
+    )
+
+    window_stride = patch_size - patch_overlap
+    interior_start = patch_overlap // 2
+    interior_end = patch_size - patch_overlap // 2
+    output_height = image_height - patch_overlap
+    output_width = image_width - patch_overlap
+    main_height = n_vertical_patches * window_stride
+    main_width = n_horizontal_patches * window_stride
+    # the down side and right side patches only fill what the main patches do not cover
+    down_side_height = output_height - main_height
+    right_side_width = output_width - main_width
+
+    output = np.empty((output_height, output_width) + extra_shape, dtype=patches.dtype)
+
+    # main patches
+    output[:main_height, :main_width] = (
+        patches_grid[
+            :n_vertical_patches,
+            :n_horizontal_patches,
+            interior_start:interior_end,
+            interior_start:interior_end,
+        ]
+        .swapaxes(1, 2)
+        .reshape((main_height, main_width) + extra_shape)
+    )
+    # right side patches
+    output[:main_height, main_width:] = patches_grid[
+        :n_vertical_patches,
+        n_horizontal_patches,
+        interior_start:interior_end,
+        interior_end - right_side_width : interior_end,
+    ].reshape((main_height, right_side_width) + extra_shape)
+    # down side patches
+    output[main_height:, :main_width] = (
+        patches_grid[
+            n_vertical_patches,
+            :n_horizontal_patches,
+            interior_end - down_side_height : interior_end,
+            interior_start:interior_end,
+        ]
+        .swapaxes(0, 1)
+        .reshape((down_side_height, main_width) + extra_shape)
+    )
+    # down-right corner patch
+    output[main_height:, main_width:] = patches_grid[
+        n_vertical_patches,
+        n_horizontal_patches,
+        interior_end - down_side_height : interior_end,
+        interior_end - right_side_width : interior_end,
+    ]
+
+    return output
+
+
+def get_patches_interior_bounds(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> np.ndarray:
+    """
+    Get the area of the rebuilt image that each patch is responsible for.
+
+    :param image_height: Height of the image the patches were cut from.
+    :param image_width: Width of the image the patches were cut from.
+    :param patch_size: Size of the patches.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: An array of shape (n_patches, 4), in the get_patches_origins() order, with the
+    (row start, row end, column start, column end) bounds of each patch in the rebuilt image.
+    """
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    window_stride = patch_size - patch_overlap
+    rows_bounds = np.append(
+        np.arange(n_vertical_patches + 1) * window_stride, image_height - patch_overlap
+    )
+    columns_bounds = np.append(
+        np.arange(n_horizontal_patches + 1) * window_stride,
+        image_width - patch_overlap,
+    )
+    rows_starts, columns_starts = np.meshgrid(
+        rows_bounds[:-1], columns_bounds[:-1], indexing="ij"
+    )
+    rows_ends, columns_ends = np.meshgrid(
+        rows_bounds[1:], columns_bounds[1:], indexing="ij"
+    )
+    return np.stack(
+        [rows_starts, rows_ends, columns_starts, columns_ends], axis=-1
+    ).reshape(-1, 4)
+
+
+def paste_patches_interiors(
+    output: np.ndarray,
+    patches: np.ndarray,
+    patches_origins: np.ndarray,
+    patches_interior_bounds: np.ndarray,
+    patch_overlap: int,
+) -> np.ndarray:
+    """
+    Write the valid interior of some patches in an already rebuilt image, in place.
+    Used to update only a part of the patches of an image.
+
+    :param output: The rebuilt array of shape (image_height - patch_overlap, image_width - patch_overlap, ...).
+    :param patches: An array of shape (n, patch_size, patch_size, ...).
+    :param patches_origins: The (n, 2) origins of these patches, as given by get_patches_origins().
+    :param patches_interior_bounds: The (n, 4) bounds of these patches, as given by get_patches_interior_bounds().
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: The updated output array.
+    """
+    # a pixel (row, column) of the rebuilt image is the pixel (row + patch_overlap / 2, column + patch_overlap / 2) of the image
+    patches_starts = (
+        patches_interior_bounds[:, [0, 2]] + patch_overlap // 2 - patches_origins
+    )
+    for (
+        patch,
+        (row_start, row_end, column_start, column_end),
+        (
+            patch_row_start,
+            patch_column_start,
+        ),
+    ) in zip(patches, patches_interior_bounds, patches_starts):
+        output[row_start:row_end, column_start:column_end] = patch[
+            patch_row_start : patch_row_start + row_end - row_start,
+            patch_column_start : patch_column_start + column_end - column_start,
+        ]
+    return output
+
+
+def get_blending_window(patch_size: int, window_type: str) -> np.ndarray:
+    """
+    Get a smooth 2D window giving more weight to the center of a patch than to its borders,
+    where the predictions suffer from side effects.
+
+    :param patch_size: Size of the patches.
+    :param window_type: Either "gaussian" or "cosine".
+    :return: A float32 array of shape (patch_size, patch_size), with a maximum of 1.
+    """
+    # distance of each pixel center to the patch center
+    positions = np.arange(patch_size) + 0.5 - patch_size / 2
+    if window_type == "gaussian":
+        window_1d = np.exp(-(positions**2) / (2 * (patch_size / 4) ** 2))
+    elif window_type == "cosine":
+        window_1d = np.cos(np.pi * positions / patch_size) ** 2
+    else:
+        raise ValueError(
+            f"Blending window {window_type} is unknown : expected gaussian or cosine."
+        )
+    # keep a minimum weight so that the image borders, covered by one patch only, are not lost in float16
+    window_1d = np.maximum(window_1d / window_1d.max(), 0.05)
+    return np.outer(window_1d, window_1d).astype(np.float32)
+
+
+def blend_patches(
+    patches: np.ndarray,
+    patches_origins: np.ndarray,
+    image_height: int,
+    image_width: int,
+    window: np.ndarray,
+) -> np.ndarray:
+    """
+    Rebuild an image from its overlapping patches by a weighted average of the patches values on the overlaps.
+    The weighted values are accumulated in a float16 canvas, and their weights in a separate buffer.
+
+    :param patches: An array of shape (n_patches, patch_size, patch_size, n_channels), usually classes probabilities.
+    :param patches_origins: The (n_patches, 2) origins of the patches, as given by get_patches_origins().
+    :param image_height: Height of the image the patches were cut from.
+    :param image_width: Width of the image the patches were cut from.
+    :param window: The (patch_size, patch_size) weights of each patch pixel, as given by get_blending_window().
+    :return: A float16 array of shape (image_height, image_width, n_channels).
+    """
+    patch_size = patches.shape[1]
+    canvas = np.zeros((image_height, image_width, patches.shape[-1]), dtype=np.float16)
+    weights = np.zeros((image_height, image_width), dtype=np.float32)
+
+    weighted_window = window[:, :, np.newaxis]
+    for patch, (row_idx, column_idx) in zip(patches, patches_origins):
+        canvas[
+            row_idx : row_idx + patch_size, column_idx : column_idx + patch_size
+        ] += (patch * weighted_window).astype(np.float16)
+        weights[
+            row_idx : row_idx + patch_size, column_idx : column_idx + patch_size
+        ] += window
+
+    canvas /= weights[:, :, np.newaxis].astype(np.float16)
+    return canvas
@@ -4,6 +4,9 @@ from pathlib import Path
 
 from deep_learning.training import train_model
 from deep_learning.reporting import build_predict_run_report
+from deep_learning.evaluation import build_evaluation_report
+from deep_learning.batch_size_tuning import get_tuned_batch_size
+from deep_learning.quantization import export_quantized_model, build_quantization_report
 from constants import (
     N_CLASSES,
     PATCH_SIZE,
@@ -13,6 +16,7 @@ from constants import (
     REPORTS_ROOT_DIR_PATH,
     N_PATCHES_LIMIT,
     BATCH_SIZE,
+    AUTOTUNE_BATCH_SIZE,
     VALIDATION_PROPORTION,
     TEST_PROPORTION,
     PATCH_COVERAGE_PERCENT_LIMIT,
@@ -22,7 +26,14 @@ from constants import (
     MAPPING_CLASS_NUMBER,
     PALETTE_HEXA,
     PATCH_OVERLAP,
+    OVERLAP_BLENDING,
+    PREDICTIONS_MEMORY_BUDGET_MB,
+    INFERENCE_PATCH_SIZE,
+    JIT_COMPILE_INFERENCE,
     DOWNSCALED_TEST_IMAGES_PATHS_LIST,
+    TEST_IMAGES_PATHS_LIST,
+    MASKS_DIR_PATH,
+    EVALUATION_N_WORKERS,
     EARLY_STOPPING_LOSS_MIN_DELTA,
     EARLY_STOPPING_ACCURACY_MIN_DELTA,
     CORRELATE_PREDICTIONS_BOOL,
@@ -40,6 +51,8 @@ def main(
     n_epochs: int,
     report_dir: str,
     data_augmentation: bool,
+    evaluate_bool: bool = False,
+    quantize_bool: bool = False,
 ) -> None:
     if train_bool:
         report_dir_path = train_model(
@@ -64,8 +77,15 @@ def main(
             mapping_class_number=MAPPING_CLASS_NUMBER,
             palette_hexa=PALETTE_HEXA,
             add_note=add_note,
+            autotune_batch_size=AUTOTUNE_BATCH_SIZE,
         )
 
+        quantized_model_path = None
+        if quantize_bool:
+            quantized_model_path = quantize_report_model(
+                report_dir_path=report_dir_path
+            )
+
         if predict_bool:
             build_predict_run_report(
                 test_images_paths_list=DOWNSCALED_TEST_IMAGES_PATHS_LIST,
@@ -73,14 +93,22 @@ def main(
                 patch_size=PATCH_SIZE,
                 patch_overlap=PATCH_OVERLAP,
                 n_classes=N_CLASSES,
-                batch_size=BATCH_SIZE,
+                batch_size=get_predictions_batch_size(),
                 encoder_kernel_size=ENCODER_KERNEL_SIZE,
                 light_report_bool=light_report_bool,
                 correlate_predictions_bool=CORRELATE_PREDICTIONS_BOOL,
                 correlation_filter=CORRELATION_FILTER,
+                overlap_blending=OVERLAP_BLENDING,
+                inference_patch_size=INFERENCE_PATCH_SIZE,
+                jit_compile=JIT_COMPILE_INFERENCE,
+                memory_budget_mb=PREDICTIONS_MEMORY_BUDGET_MB,
+                quantized_model_path=quantized_model_path,
             )
+
+        if evaluate_bool:
+            evaluate_report_model(report_dir_path=report_dir_path)
     else:  # case no training
-        if predict_bool:
+        if predict_bool or evaluate_bool or quantize_bool:
             if report_dir is None:
                 report_dir = input(
                     "Please specify a correct report directory path. \nEx: .../reports/report_2021_12_13__13_12_18\n"
@@ -91,25 +119,100 @@ def main(
                     f"This report directory path does no exist : {report_dir_path}"
                 )
 
-            build_predict_run_report(
-                test_images_paths_list=DOWNSCALED_TEST_IMAGES_PATHS_LIST,
-                report_dir_path=report_dir_path,
-                patch_size=PATCH_SIZE,
-                patch_overlap=PATCH_OVERLAP,
-                n_classes=N_CLASSES,
-                batch_size=BATCH_SIZE,
-                encoder_kernel_size=ENCODER_KERNEL_SIZE,
-                light_report_bool=light_report_bool,
-                correlate_predictions_bool=CORRELATE_PREDICTIONS_BOOL,
-                correlation_filter=CORRELATION_FILTER,
-            )
+            quantized_model_path = None
+            if quantize_bool:
+                quantized_model_path = quantize_report_model(
+                    report_dir_path=report_dir_path
+                )
+
+            if predict_bool:
+                build_predict_run_report(
+                    test_images_paths_list=DOWNSCALED_TEST_IMAGES_PATHS_LIST,
+                    report_dir_path=report_dir_path,
+                    patch_size=PATCH_SIZE,
+                    patch_overlap=PATCH_OVERLAP,
+                    n_classes=N_CLASSES,
+                    batch_size=get_predictions_batch_size(),
+                    encoder_kernel_size=ENCODER_KERNEL_SIZE,
+                    light_report_bool=light_report_bool,
+                    correlate_predictions_bool=CORRELATE_PREDICTIONS_BOOL,
+                    correlation_filter=CORRELATION_FILTER,
+                    overlap_blending=OVERLAP_BLENDING,
+                    inference_patch_size=INFERENCE_PATCH_SIZE,
+                    jit_compile=JIT_COMPILE_INFERENCE,
+                    memory_budget_mb=PREDICTIONS_MEMORY_BUDGET_MB,
+                    quantized_model_path=quantized_model_path,
+                )
+
+            if evaluate_bool:
+                evaluate_report_model(report_dir_path=report_dir_path)
 
         else:
             raise ValueError(
-                "Nothing happened since parameter --train and --predict were set to False"
+                "Nothing happened since parameters --train, --predict, --evaluate and --quantize were set to False"
             )
 
 
+def get_predictions_batch_size() -> int:
+    """Get BATCH_SIZE, or the batch size tuned for this machine if AUTOTUNE_BATCH_SIZE is set."""
+    if not AUTOTUNE_BATCH_SIZE:
+        return BATCH_SIZE
+    return get_tuned_batch_size(
+        n_classes=N_CLASSES,
+        patch_size=INFERENCE_PATCH_SIZE,
+        encoder_kernel_size=ENCODER_KERNEL_SIZE,
+        default_batch_size=BATCH_SIZE,
+    )
+
+
+def evaluate_report_model(report_dir_path: Path) -> None:
+    build_evaluation_report(
+        test_images_paths_list=TEST_IMAGES_PATHS_LIST,
+        masks_dir_path=MASKS_DIR_PATH,
+        report_dir_path=report_dir_path,
+        patch_size=PATCH_SIZE,
+        patch_overlap=PATCH_OVERLAP,
+        n_classes=N_CLASSES,
+        batch_size=get_predictions_batch_size(),
+        encoder_kernel_size=ENCODER_KERNEL_SIZE,
+        correlate_predictions_bool=CORRELATE_PREDICTIONS_BOOL,
+        correlation_filter=CORRELATION_FILTER,
+        n_workers=EVALUATION_N_WORKERS,
+        overlap_blending=OVERLAP_BLENDING,
+        inference_patch_size=INFERENCE_PATCH_SIZE,
+    )
+
+
+def quantize_report_model(report_dir_path: Path) -> Path:
+    """
+    Export the model of a report to int8 in its "5_quantization" folder, and compare it with the float model.
+
+    :param report_dir_path: The report of the model to quantize.
+    :return: The path of the quantized model.
+    """
+    quantization_dir_path = report_dir_path / "5_quantization"
+    quantization_dir_path.mkdir(parents=True, exist_ok=True)
+    quantized_model_path = export_quantized_model(
+        checkpoint_dir_path=report_dir_path / "2_model_report",
+        output_path=quantization_dir_path / "model_int8.tflite",
+        patches_dir_path=PATCHES_DIR_PATH,
+        n_classes=N_CLASSES,
+        patch_size=PATCH_SIZE,
+        encoder_kernel_size=ENCODER_KERNEL_SIZE,
+    )
+    build_quantization_report(
+        checkpoint_dir_path=report_dir_path / "2_model_report",
+        quantized_model_path=quantized_model_path,
+        patches_dir_path=PATCHES_DIR_PATH,
+        report_dir_path=quantization_dir_path,
+        n_classes=N_CLASSES,
+        patch_size=PATCH_SIZE,
+        batch_size=BATCH_SIZE,
+        encoder_kernel_size=ENCODER_KERNEL_SIZE,
+    )
+    return quantized_model_path
+
+
 if __name__ == "__main__":
     # Parser setup
     parser = argparse.ArgumentParser(allow_abbrev=True)
@@ -125,6 +228,20 @@ if __name__ == "__main__":
         help="Whether to infer predictions on test images. Will ask the user a model path to use.",
         action="store_true",
     )
+    parser.add_argument(
+        "--evaluate",
+        "-eval",
+        help="Whether to compute the confusion matrix and the per-class IoU, precision and recall of the model on the labelled test images. "
+        "Will ask the user a model path to use if not trained.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--quantize",
+        "-q",
+        help="Whether to export the model to int8 and compare it with the float model. "
+        "The predictions of --predict are then made with the int8 model. Will ask the user a model path to use if not trained.",
+        action="store_true",
+    )
     parser.add_argument(
         "--light",
         "-l",
@@ -164,9 +281,9 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    if not args.predict and not args.train:
+    if not args.predict and not args.train and not args.evaluate and not args.quantize:
         raise ValueError(
-            "At least one of --train or --predict parameters should be given."
+            "At least one of --train, --predict, --evaluate or --quantize parameters should be given."
         )
 
     if not args.train and args.note:
@@ -188,9 +305,14 @@ if __name__ == "__main__":
     if not args.predict and args.light:
         warnings.warn("--light parameter should only be used with --predict parameter.")
 
-    if not args.predict and args.report is not None:
+    if (
+        not args.predict
+        and not args.evaluate
+        and not args.quantize
+        and args.report is not None
+    ):
         warnings.warn(
-            "--report parameter should only be used with --predict parameter."
+            "--report parameter should only be used with --predict, --evaluate or --quantize parameter."
         )
 
     main(
@@ -202,4 +324,6 @@ if __name__ == "__main__":
         n_epochs=args.epochs,
         report_dir=args.report,
         data_augmentation=args.data_augment,
+        evaluate_bool=args.evaluate,
+        quantize_bool=args.quantize,
     )
@@ -0,0 +1,45 @@
+import random
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from deep_learning.unet import build_small_unet
+
+
+@pytest.fixture(scope="session")
+def small_model_params(tmp_path_factory) -> dict:
+    """The checkpoint of an untrained small U-Net on 64x64 patches, and the predictions parameters matching it."""
+    checkpoint_dir_path = tmp_path_factory.mktemp("small_model")
+    # the unseeded keras initializers also draw from the python and numpy generators
+    random.seed(0)
+    np.random.seed(0)
+    tf.random.set_seed(0)
+    model = build_small_unet(
+        n_classes=9, input_shape=64, batch_size=None, encoder_kernel_size=3
+    )
+    model.save_weights(str(checkpoint_dir_path / "model_checkpoint"))
+    return {
+        "checkpoint_dir_path": checkpoint_dir_path,
+        "patch_size": 64,
+        "patch_overlap": 16,
+        "n_classes": 9,
+        "batch_size": 4,
+        "encoder_kernel_size": 3,
+    }
+
+
+@pytest.fixture(scope="session")
+def small_images_paths(tmp_path_factory) -> list:
+    """Smooth random jpeg images of several sizes, whose patches do not fill a whole number of batches."""
+    images_dir_path = tmp_path_factory.mktemp("small_images")
+    random_generator = np.random.default_rng(0)
+    images_paths = list()
+    for image_idx, (height, width) in enumerate([(150, 190), (100, 120), (130, 90)]):
+        coarse_image = random_generator.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        image = tf.cast(
+            tf.image.resize(coarse_image, (height, width), method="bilinear"), tf.uint8
+        )
+        image_path = images_dir_path / f"image_{image_idx}.jpg"
+        tf.io.write_file(str(image_path), tf.io.encode_jpeg(image))
+        images_paths.append(image_path)
+    return images_paths
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from pathlib import Path
+
+import ui_integration.async_predictions as async_predictions
+from ui_integration.predictions_maker import PredictionsCancelledError
+
+# Time the stubs wait for the test, in seconds, so that a failing test does not block the executors
+STUB_TIMEOUT = 5
+
+
+@pytest.fixture
+def stub_predictions(monkeypatch) -> dict:
+    """Replace the model and the masks writer with stubs, which can be held until the test releases them."""
+    events = {
+        name: threading.Event()
+        for name in [
+            "inference_started",
+            "release_inference",
+            "masks_started",
+            "release_masks",
+            "masks_written",
+        ]
+    }
+
+    def make_predictions(cancel_event: threading.Event, **kwargs):
+        events["inference_started"].set()
+        events["release_inference"].wait(timeout=STUB_TIMEOUT)
+        if cancel_event.is_set():
+            raise PredictionsCancelledError("The predictions were cancelled.")
+        return np.ones((4, 4), dtype=np.int32)
+
+    def save_predictions(image_name: str, **kwargs):
+        events["masks_started"].set()
+        events["release_masks"].wait(timeout=STUB_TIMEOUT)
+        events["masks_written"].set()
+        return {"class": Path(f"{image_name}__class.png")}
+
+    monkeypatch.setattr(async_predictions, "make_predictions", make_predictions)
+    monkeypatch.setattr(async_predictions, "save_predictions", save_predictions)
+    yield events
+    for event in events.values():
+        event.set()
+
+
+def start_predictions() -> async_predictions.PredictionJob:
+    return async_predictions.start_predictions(
+        image_path=Path("image.jpg"),
+        model_checkpoint_dir_path=Path("model"),
+        workspace_dir_path=Path("workspace"),
+    )
+
+
+async def wait_for_event(event: threading.Event) -> None:
+    assert await asyncio.get_running_loop().run_in_executor(
+        None, event.wait, STUB_TIMEOUT
+    )
+
+
+def test_cancel_before_start(stub_predictions):
+    async def cancel_before_start():
+        job = start_predictions()
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(job.class_map, timeout=STUB_TIMEOUT)
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        assert job.cancelled()
+
+    asyncio.run(cancel_before_start())
+    assert not stub_predictions["inference_started"].is_set()
+
+
+def test_cancel_during_inference(stub_predictions):
+    async def cancel_during_inference():
+        job = start_predictions()
+        await wait_for_event(stub_predictions["inference_started"])
+        job.cancel()
+        stub_predictions["release_inference"].set()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(job.class_map, timeout=STUB_TIMEOUT)
+        assert job.cancel_event.is_set()
+        assert job.cancelled()
+
+    asyncio.run(cancel_during_inference())
+    assert not stub_predictions["masks_started"].is_set()
+
+
+def test_cancel_during_masks_writing(stub_predictions):
+    async def cancel_during_masks_writing():
+        stub_predictions["release_inference"].set()
+        job = start_predictions()
+        class_map = await asyncio.wait_for(job.class_map, timeout=STUB_TIMEOUT)
+        assert class_map.dtype == np.uint8
+        await wait_for_event(stub_predictions["masks_started"])
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # the class map given before the cancellation is kept
+        assert job.class_map.result() is class_map
+        stub_predictions["release_masks"].set()
+        # the masks already being written are still written
+        await wait_for_event(stub_predictions["masks_written"])
+
+    asyncio.run(cancel_during_masks_writing())
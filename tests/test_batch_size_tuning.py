@@ -0,0 +1,44 @@
+import json
+from tensorflow import keras
+
+from deep_learning import batch_size_tuning
+from deep_learning.batch_size_tuning import get_tuned_batch_size, select_batch_size
+
+
+def test_select_batch_size():
+    probes = [
+        {"batch_size": 1, "throughput": 10.0, "peak_rss_mb": 100},
+        {"batch_size": 2, "throughput": 19.5, "peak_rss_mb": 110},
+        {"batch_size": 4, "throughput": 20.0, "peak_rss_mb": 130},
+    ]
+
+    # the smallest batch size within the throughput tolerance of the best one
+    assert select_batch_size(probes=probes)["batch_size"] == 2
+
+
+def test_get_tuned_batch_size_cache(tmp_path, monkeypatch):
+    cache_file_path = tmp_path / "batch_sizes.json"
+    tuning_params = {
+        "n_classes": 2,
+        "patch_size": 16,
+        "encoder_kernel_size": 3,
+        "default_batch_size": 8,
+        "training": True,
+        "optimizer": keras.optimizers.Adam(),
+        "loss_function": keras.losses.categorical_crossentropy,
+        "candidate_batch_sizes": [1, 2],
+        "cache_file_path": cache_file_path,
+    }
+
+    batch_size = get_tuned_batch_size(**tuning_params)
+
+    assert batch_size in [1, 2]
+    (cached_batch_size,) = json.loads(cache_file_path.read_text()).values()
+    assert cached_batch_size["batch_size"] == batch_size
+
+    # the next calls read the cache without probing
+    def fail(**kwargs):
+        raise AssertionError("The batch sizes were probed again.")
+
+    monkeypatch.setattr(batch_size_tuning, "probe_batch_sizes", fail)
+    assert get_tuned_batch_size(**tuning_params) == batch_size
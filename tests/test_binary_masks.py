@@ -0,0 +1,38 @@
+import numpy as np
+from PIL import Image
+
+from utils.image_utils import split_class_map, save_binary_masks
+from constants import MASK_TRUE_VALUE, MASK_FALSE_VALUE
+
+
+def test_split_class_map_in_one_pass():
+    class_map = np.random.default_rng(0).integers(0, 10, size=(30, 20))
+    binary_masks_array = split_class_map(class_map=class_map, class_numbers=[3, 0, 9])
+
+    assert binary_masks_array.shape == (3, 30, 20)
+    assert binary_masks_array.dtype == np.uint8
+    for binary_mask_array, class_number in zip(binary_masks_array, [3, 0, 9]):
+        np.testing.assert_array_equal(
+            binary_mask_array,
+            np.where(class_map == class_number, MASK_TRUE_VALUE, MASK_FALSE_VALUE),
+        )
+
+
+def test_save_binary_masks_as_single_channel_png(tmp_path):
+    class_map = np.random.default_rng(1).integers(0, 10, size=(30, 20))
+    output_paths_dict = {
+        class_number: tmp_path / f"mask__{class_number}.png"
+        for class_number in range(10)
+    }
+    assert (
+        save_binary_masks(class_map=class_map, output_paths_dict=output_paths_dict)
+        == output_paths_dict
+    )
+
+    for class_number, output_path in output_paths_dict.items():
+        mask_image = Image.open(output_path)
+        assert mask_image.mode == "L"
+        np.testing.assert_array_equal(
+            np.asarray(mask_image),
+            np.where(class_map == class_number, MASK_TRUE_VALUE, MASK_FALSE_VALUE),
+        )
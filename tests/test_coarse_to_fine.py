@@ -0,0 +1,51 @@
+import numpy as np
+import tensorflow as tf
+
+from deep_learning.predictions import make_predictions, make_predictions_coarse_to_fine
+
+
+def test_make_predictions_coarse_to_fine(
+    small_model_params, small_images_paths, tmp_path
+):
+    # a size multiple of the downscale factor, on which the coarse image is not padded
+    aligned_image_path = tmp_path / "aligned_image.jpg"
+    tf.io.write_file(
+        str(aligned_image_path),
+        tf.io.encode_jpeg(
+            tf.io.decode_jpeg(tf.io.read_file(str(small_images_paths[0])))[:100, :64]
+        ),
+    )
+
+    for image_path in [aligned_image_path, small_images_paths[0]]:
+        predictions_array = np.asarray(
+            make_predictions(
+                target_image_path=image_path,
+                correlate_predictions_bool=False,
+                correlation_filter=None,
+                **small_model_params,
+            )
+        )
+        coarse_predictions_array = np.asarray(
+            make_predictions_coarse_to_fine(
+                target_image_path=image_path,
+                correlate_predictions_bool=False,
+                correlation_filter=None,
+                downscale_factor=4,
+                **small_model_params,
+            )
+        )
+        assert coarse_predictions_array.shape == predictions_array.shape
+        assert coarse_predictions_array.min() >= 1
+
+        # every coarse pixel is uncertain : all the patches are predicted at full resolution
+        refined_predictions_array = np.asarray(
+            make_predictions_coarse_to_fine(
+                target_image_path=image_path,
+                correlate_predictions_bool=False,
+                correlation_filter=None,
+                downscale_factor=4,
+                uncertainty_threshold=1.1,
+                **small_model_params,
+            )
+        )
+        assert np.array_equal(refined_predictions_array, predictions_array)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from utils.colorization import (
+    build_palette_array,
+    colorize_class_map,
+    overlay_class_map,
+)
+from constants import PALETTE_RGB
+
+
+def test_colorize_class_map_matches_palette():
+    class_map = np.random.default_rng(0).integers(0, 10, size=(40, 30))
+    colorized_array = colorize_class_map(class_map=class_map)
+
+    assert colorized_array.shape == (40, 30, 3)
+    assert colorized_array.dtype == np.uint8
+    expected_array = np.stack(np.vectorize(lambda x: PALETTE_RGB[x])(class_map), axis=2)
+    np.testing.assert_array_equal(colorized_array, expected_array)
+
+
+def test_overlay_class_map_blends_center_crop():
+    palette_array = build_palette_array(palette_rgb={0: (0, 0, 0), 2: (200, 100, 0)})
+    # class 1 is missing from the palette, so it is black
+    np.testing.assert_array_equal(palette_array[1], [0, 0, 0])
+
+    image_array = np.full((6, 8, 3), 100, dtype=np.uint8)
+    image_array[1:5, 2:6] = 50
+    class_map = np.array([[0, 1, 2, 2]] * 4)
+    overlay_array = overlay_class_map(
+        image_array=image_array,
+        class_map=class_map,
+        alpha=0.5,
+        palette_array=palette_array,
+    )
+
+    assert overlay_array.shape == (4, 4, 3)
+    # the background keeps the colors of the cropped image
+    np.testing.assert_array_equal(overlay_array[:, 0], 50)
+    np.testing.assert_array_equal(overlay_array[:, 1], 25)
+    np.testing.assert_array_equal(overlay_array[:, 2], [[125, 75, 25]] * 4)
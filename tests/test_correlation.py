@@ -0,0 +1,37 @@
+import numpy as np
+import scipy.ndimage
+
+from deep_learning.predictions import correlate_predictions, get_separable_filters
+
+
+def test_correlate_predictions():
+    predictions_array = (
+        np.random.default_rng(0).random((3, 20, 24, 4)).astype(np.float32)
+    )
+    separable_filter = np.outer([1, 2, 1], [1, 3, 3, 1]).astype(np.float64)
+    non_separable_filter = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]], dtype=np.float64)
+    assert get_separable_filters(filter_2d=separable_filter) is not None
+    assert get_separable_filters(filter_2d=non_separable_filter) is None
+
+    for correlation_filter in [separable_filter, non_separable_filter]:
+        correlated_predictions = correlate_predictions(
+            predictions_array=predictions_array,
+            correlation_filter=correlation_filter,
+            n_classes=3,
+        )
+        # same result as a 2D correlation on each patch and class
+        expected_predictions = np.stack(
+            [
+                np.stack(
+                    [
+                        scipy.ndimage.correlate(
+                            input=patch[:, :, class_idx], weights=correlation_filter
+                        )
+                        for class_idx in range(4)
+                    ],
+                    axis=-1,
+                )
+                for patch in predictions_array
+            ]
+        ) / np.sum(correlation_filter)
+        assert np.allclose(correlated_predictions, expected_predictions, atol=1e-5)
@@ -0,0 +1,141 @@
+import threading
+import time
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ui_integration.prediction_server as prediction_server
+from ui_integration.prediction_server import DynamicBatcher, PredictionServer
+from ui_integration.model import evict_cached_models
+
+
+class FakeInferenceModel:
+    """Return the first channel of the patches as their classes, and record the size of the batches."""
+
+    def __init__(self, exception: Exception = None):
+        self.exception = exception
+        self.batches_sizes = list()
+
+    def predict_classes(self, patches: np.ndarray) -> np.ndarray:
+        self.batches_sizes.append(len(patches))
+        if self.exception is not None:
+            raise self.exception
+        return patches[:, :, :, 0]
+
+
+def get_patches(first_patch_value: int, n_patches: int) -> np.ndarray:
+    return np.broadcast_to(
+        np.arange(first_patch_value, first_patch_value + n_patches, dtype=np.uint8)[
+            :, np.newaxis, np.newaxis, np.newaxis
+        ],
+        (n_patches, 2, 2, 3),
+    ).copy()
+
+
+def test_dynamic_batcher_shared_batches():
+    inference_model = FakeInferenceModel()
+    batcher = DynamicBatcher(
+        inference_model=inference_model, batch_size=4, deadline_ms=1000
+    )
+    requests_patches = [get_patches(0, 3), get_patches(3, 5)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        requests_classes = list(executor.map(batcher.predict_classes, requests_patches))
+
+    # the end of the first request and the beginning of the second one share a batch
+    assert inference_model.batches_sizes == [4, 4]
+    for patches, classes in zip(requests_patches, requests_classes):
+        assert np.array_equal(classes, patches[:, :, :, 0])
+    assert batcher.get_mean_occupancy() == 1
+
+
+def test_dynamic_batcher_deadline():
+    inference_model = FakeInferenceModel()
+    batcher = DynamicBatcher(
+        inference_model=inference_model, batch_size=4, deadline_ms=50
+    )
+    start_time = time.perf_counter()
+    classes = batcher.predict_classes(get_patches(0, 1))
+
+    # the batch which is not full is sent to the model once the deadline is over
+    assert time.perf_counter() - start_time >= 0.05
+    assert inference_model.batches_sizes == [1]
+    assert classes.shape == (1, 2, 2)
+    assert batcher.get_mean_occupancy() == 0.25
+
+
+def test_dynamic_batcher_exception():
+    inference_model = FakeInferenceModel(exception=RuntimeError("model failure"))
+    batcher = DynamicBatcher(
+        inference_model=inference_model, batch_size=4, deadline_ms=1000
+    )
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(batcher.predict_classes, get_patches(0, 2)),
+            executor.submit(batcher.predict_classes, get_patches(2, 2)),
+        ]
+    # the exception of the shared batch reaches both requests
+    assert inference_model.batches_sizes == [4]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failure"):
+            future.result()
+
+    # the batcher keeps running after a failed batch
+    inference_model.exception = None
+    assert np.array_equal(
+        batcher.predict_classes(get_patches(0, 4)), get_patches(0, 4)[:, :, :, 0]
+    )
+
+
+def test_get_batcher_loads_out_of_lock(monkeypatch):
+    slow_model_loaded = threading.Event()
+    loaded_models = list()
+
+    def load_predictions_model(checkpoint_dir_path: Path, **kwargs):
+        loaded_models.append(checkpoint_dir_path.name)
+        if checkpoint_dir_path.name == "slow_model":
+            slow_model_loaded.wait(timeout=5)
+        return FakeInferenceModel()
+
+    monkeypatch.setattr(
+        prediction_server, "load_predictions_model", load_predictions_model
+    )
+    with PredictionServer(port=0) as server:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            slow_batchers = [
+                executor.submit(server.get_batcher, Path("slow_model"))
+                for _ in range(2)
+            ]
+            # another model does not wait for the loading of the slow one
+            fast_batcher = server.get_batcher(Path("fast_model"))
+            assert not any(future.done() for future in slow_batchers)
+            assert server.get_metrics()["models"][0]["n_batches"] == 0
+            server.record_request(latency=0.5)
+            server.record_request(latency=None)
+            metrics = server.get_metrics()
+            assert (metrics["n_requests"], metrics["n_failed_requests"]) == (1, 1)
+            assert metrics["mean_latency"] == 0.5
+            slow_model_loaded.set()
+            # the concurrent requests of a model share its single loading
+            assert slow_batchers[0].result() is slow_batchers[1].result()
+        assert fast_batcher is not slow_batchers[0].result()
+    assert sorted(loaded_models) == ["fast_model", "slow_model"]
+
+
+def test_get_batcher_warms_up_model(small_model_params, monkeypatch):
+    monkeypatch.setattr(
+        prediction_server, "PATCH_SIZE", small_model_params["patch_size"]
+    )
+    monkeypatch.setattr(
+        prediction_server, "BATCH_SIZE", small_model_params["batch_size"]
+    )
+    evict_cached_models()
+    with PredictionServer(port=0) as server:
+        batcher = server.get_batcher(small_model_params["checkpoint_dir_path"])
+        # the inference function is traced before the first request
+        predict_classes = batcher.inference_model.predict_classes
+        assert predict_classes.experimental_get_tracing_count() == 1
+        classes = batcher.predict_classes(np.zeros((3, 64, 64, 3), dtype=np.uint8))
+        assert classes.shape == (3, 64, 64)
+        assert predict_classes.experimental_get_tracing_count() == 1
+    evict_cached_models()
@@ -0,0 +1,46 @@
+import numpy as np
+import tensorflow as tf
+
+from deep_learning.evaluation import get_confusion_matrix_array, get_classes_metrics
+
+
+def test_get_confusion_matrix_array():
+    n_classes = 9
+    random_generator = np.random.default_rng(0)
+    labels_array = random_generator.integers(
+        0, n_classes + 1, size=(37, 53), dtype=np.uint8
+    )
+    predictions_array = random_generator.integers(
+        1, n_classes + 1, size=(37, 53), dtype=np.uint8
+    )
+
+    confusion_matrix = get_confusion_matrix_array(
+        labels_array=labels_array,
+        predictions_array=predictions_array,
+        n_classes=n_classes,
+    )
+
+    assert np.array_equal(
+        confusion_matrix,
+        tf.math.confusion_matrix(
+            labels=labels_array.ravel(),
+            predictions=predictions_array.ravel(),
+            num_classes=n_classes + 1,
+        ).numpy(),
+    )
+
+
+def test_get_classes_metrics():
+    # labels in rows, predictions in columns
+    confusion_matrix = np.array([[3, 1, 0], [1, 2, 0], [0, 0, 0]])
+
+    classes_metrics = get_classes_metrics(
+        confusion_matrix=confusion_matrix, classes_names=["a", "b", "c"]
+    ).set_index("class")
+
+    assert classes_metrics.loc["a", "iou"] == 3 / 5
+    assert classes_metrics.loc["a", "precision"] == 3 / 4
+    assert classes_metrics.loc["b", "recall"] == 2 / 3
+    # the class absent from the labels is not in the means
+    assert np.isnan(classes_metrics.loc["c", "iou"])
+    assert classes_metrics.loc["mean", "iou"] == (3 / 5 + 2 / 4) / 2
@@ -0,0 +1,53 @@
+import numpy as np
+from tensorflow import keras
+
+from deep_learning.inference_model import InferenceModel
+from deep_learning.predictions import correlate_predictions
+
+
+def test_inference_model():
+    inputs = keras.Input(shape=(16, 16, 3))
+    outputs = keras.layers.Conv2D(filters=5, kernel_size=3, padding="same")(inputs)
+    model = keras.Model(inputs=inputs, outputs=outputs)
+    patches = np.random.default_rng(0).integers(0, 256, (3, 16, 16, 3), dtype=np.uint8)
+    probabilities = model.predict(patches.astype(np.float32))
+    correlation_filter = np.outer([1, 2, 1], [1, 2, 1]).astype(np.float64)
+
+    classes = InferenceModel(model=model).predict_classes(patches).numpy()
+    assert classes.dtype == np.uint8
+    assert np.array_equal(classes, np.argmax(probabilities[:, :, :, 1:], axis=3) + 1)
+
+    # the in-graph correlation gives the same classes as correlate_predictions()
+    correlated_classes = (
+        InferenceModel(model=model, correlation_filter=correlation_filter)
+        .predict_classes(patches)
+        .numpy()
+    )
+    correlated_probabilities = correlate_predictions(
+        predictions_array=probabilities,
+        correlation_filter=correlation_filter,
+        n_classes=4,
+    )
+    assert (
+        np.mean(
+            correlated_classes
+            == np.argmax(correlated_probabilities[:, :, :, 1:], axis=3) + 1
+        )
+        > 0.99
+    )
+
+
+def test_inference_model_fixed_batch_size():
+    inputs = keras.Input(shape=(16, 16, 3), batch_size=4)
+    outputs = keras.layers.Conv2D(filters=5, kernel_size=3, padding="same")(inputs)
+    model = keras.Model(inputs=inputs, outputs=outputs)
+    patches = np.random.default_rng(0).integers(0, 256, (3, 16, 16, 3), dtype=np.uint8)
+
+    inference_model = InferenceModel(model=model)
+    assert inference_model.warmup() >= 0
+    # a smaller batch is padded to the model batch size, and the padding removed from the classes
+    classes = inference_model.predict_classes(patches).numpy()
+    assert classes.shape == (3, 16, 16)
+    latency_report = inference_model.get_latency_report()
+    assert latency_report["steady_state_calls"] == 1
+    assert latency_report["steady_state_mean_latency"] > 0
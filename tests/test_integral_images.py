@@ -0,0 +1,24 @@
+import numpy as np
+
+from image_processing.integral_images import get_integral_image, get_boxes_sums
+
+
+def test_get_boxes_sums():
+    image_array = np.random.default_rng(0).integers(0, 10, size=(23, 31))
+    boxes_bounds = np.array(
+        [[0, 23, 0, 31], [3, 7, 5, 6], [10, 10, 2, 9], [4, 20, 11, 30]]
+    )
+
+    boxes_sums = get_boxes_sums(
+        integral_image=get_integral_image(image_array=image_array),
+        boxes_bounds=boxes_bounds,
+    )
+
+    # each box sum is the sum of the array over the box, empty boxes summing to 0
+    assert np.array_equal(
+        boxes_sums,
+        [
+            np.sum(image_array[row_start:row_end, column_start:column_end])
+            for row_start, row_end, column_start, column_end in boxes_bounds
+        ],
+    )
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from dataset_builder.masks_encoder import stack_image_masks, stack_image_masks_array
+from constants import MASK_TRUE_VALUE, MASK_FALSE_VALUE
+
+
+def test_stack_image_masks_array(tmp_path):
+    image_path = tmp_path / "images" / "image.jpg"
+    masks_dir_path = tmp_path / "masks"
+    # overlapping masks of different classes, of the same class, and background masks
+    masks_regions = [
+        ("background", (0, 20, 0, 30)),
+        ("peau", (10, 30, 10, 40)),
+        ("ciel", (25, 40, 35, 60)),
+        ("herbe", (0, 10, 50, 64)),
+        ("herbe", (5, 15, 55, 64)),
+        ("background", (30, 48, 0, 64)),
+    ]
+    for mask_idx, (class_name, region) in enumerate(masks_regions):
+        row_start, row_end, column_start, column_end = region
+        mask_array = np.full((48, 64, 3), MASK_FALSE_VALUE, dtype=np.uint8)
+        mask_array[row_start:row_end, column_start:column_end] = MASK_TRUE_VALUE
+        mask_path = masks_dir_path / "image" / class_name / f"mask_{mask_idx}.png"
+        mask_path.parent.mkdir(parents=True, exist_ok=True)
+        tf.io.write_file(str(mask_path), tf.io.encode_png(mask_array))
+
+    stacked_array = stack_image_masks_array(
+        image_path=image_path, masks_dir_path=masks_dir_path
+    )
+
+    assert stacked_array.dtype == np.uint8
+    assert np.array_equal(
+        stacked_array,
+        stack_image_masks(image_path=image_path, masks_dir_path=masks_dir_path).numpy(),
+    )
+    # the background masks do not hide the classes
+    assert stacked_array[15, 15] == 3
+    assert stacked_array[35, 40] == 5
+
+
+def test_stack_image_masks_array_without_masks(tmp_path):
+    (tmp_path / "masks" / "image").mkdir(parents=True)
+    with pytest.raises(AssertionError, match="image.jpg has no mask"):
+        stack_image_masks_array(
+            image_path=tmp_path / "images" / "image.jpg",
+            masks_dir_path=tmp_path / "masks",
+        )
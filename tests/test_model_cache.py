@@ -0,0 +1,52 @@
+import tensorflow as tf
+
+from deep_learning.model_cache import (
+    get_model_cache_key,
+    get_cached_model,
+    evict_cached_models,
+    LOADED_MODELS_CACHE,
+)
+from constants import MODELS_CACHE_SIZE
+
+
+def test_get_cached_model(tmp_path):
+    checkpoint = tf.train.Checkpoint(variable=tf.Variable(1.0))
+    checkpoint_manager = tf.train.CheckpointManager(
+        checkpoint=checkpoint, directory=str(tmp_path), max_to_keep=1
+    )
+    checkpoint_manager.save()
+    evict_cached_models()
+
+    loads_count = {"count": 0}
+
+    def load_model_function():
+        loads_count["count"] += 1
+        return object()
+
+    cache_key = get_model_cache_key(checkpoint_dir_path=tmp_path, n_classes=9)
+    model = get_cached_model(
+        cache_key=cache_key, load_model_function=load_model_function
+    )
+    assert (
+        get_cached_model(cache_key=cache_key, load_model_function=load_model_function)
+        is model
+    )
+    assert loads_count["count"] == 1
+
+    # the least recently used models are evicted
+    for n_classes in range(MODELS_CACHE_SIZE):
+        get_cached_model(
+            cache_key=get_model_cache_key(
+                checkpoint_dir_path=tmp_path, n_classes=n_classes
+            ),
+            load_model_function=load_model_function,
+        )
+    assert cache_key not in LOADED_MODELS_CACHE
+    assert len(LOADED_MODELS_CACHE) == MODELS_CACHE_SIZE
+
+    # a new checkpoint gives a new key
+    checkpoint_manager.save()
+    assert get_model_cache_key(checkpoint_dir_path=tmp_path, n_classes=9) != cache_key
+
+    assert evict_cached_models(checkpoint_dir_path=tmp_path) == MODELS_CACHE_SIZE
+    assert len(LOADED_MODELS_CACHE) == 0
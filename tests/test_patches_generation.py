@@ -1,5 +1,11 @@
 import tensorflow as tf
 
+from dataset_builder.patches_generator import (
+    extract_patches_array,
+    get_patches_grid_shape,
+    split_patches_grid,
+)
+
 n = 10
 test_image = tf.constant([[[[x * n + y + 1] * 3 for y in range(n)] for x in range(n)]])
 
@@ -15,3 +21,48 @@ reshaped_patches = tf.reshape(
     tensor=patches,
     shape=[patches.shape[1] * patches.shape[2], patch_size, patch_size, 3],
 )
+
+
+def test_extract_patches_array():
+    image_height, image_width = 23, 31
+    image_tensor = tf.reshape(
+        tf.range(image_height * image_width * 3, dtype=tf.int32),
+        (image_height, image_width, 3),
+    )
+    patch_size, patch_overlap = 8, 2
+    patches, patches_origins = extract_patches_array(
+        image_tensor=image_tensor, patch_size=patch_size, patch_overlap=patch_overlap
+    )
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+
+    assert patches.shape == (
+        (n_vertical_patches + 1) * (n_horizontal_patches + 1),
+        patch_size,
+        patch_size,
+        3,
+    )
+    for patch, (row_idx, column_idx) in zip(patches, patches_origins):
+        assert (
+            patch
+            == image_tensor[
+                row_idx : row_idx + patch_size, column_idx : column_idx + patch_size
+            ].numpy()
+        ).all()
+
+    main_patches, right_side_patches, down_side_patches = split_patches_grid(
+        patches=patches_origins,
+        n_vertical_patches=n_vertical_patches,
+        n_horizontal_patches=n_horizontal_patches,
+    )
+    assert main_patches.tolist() == [
+        [row_idx, column_idx]
+        for row_idx in range(0, image_height - patch_size + 1, 6)
+        for column_idx in range(0, image_width - patch_size + 1, 6)
+    ]
+    assert right_side_patches.tolist() == [[0, 23], [6, 23], [12, 23], [15, 23]]
+    assert down_side_patches.tolist() == [[15, 0], [15, 6], [15, 12], [15, 18]]
@@ -0,0 +1,61 @@
+import threading
+import numpy as np
+import pytest
+from pathlib import Path
+
+import deep_learning.reporting as reporting
+
+
+def test_build_predict_run_report_bounded_writer(tmp_path, monkeypatch):
+    written_images = list()
+    writer_released = threading.Event()
+    pending_counts = list()
+
+    def make_predictions_pipelined(target_images_paths_list: [Path], **kwargs):
+        for image_idx, image_path in enumerate(target_images_paths_list):
+            pending_counts.append(image_idx - len(written_images))
+            yield image_path, np.ones((4, 4), dtype=np.int32)
+
+    def save_image_predictions_report(target_image_path: Path, **kwargs):
+        writer_released.wait(timeout=5)
+        if target_image_path.name == "failing_image.jpg":
+            raise OSError("disk full")
+        written_images.append(target_image_path)
+
+    monkeypatch.setattr(
+        reporting, "make_predictions_pipelined", make_predictions_pipelined
+    )
+    monkeypatch.setattr(
+        reporting, "save_image_predictions_report", save_image_predictions_report
+    )
+    report_params = {
+        "patch_size": 64,
+        "patch_overlap": 16,
+        "n_classes": 9,
+        "batch_size": 4,
+        "encoder_kernel_size": 3,
+        "light_report_bool": True,
+        "correlate_predictions_bool": False,
+        "correlation_filter": None,
+    }
+
+    # a slow writer holds the predictions back, instead of queuing all the class maps
+    threading.Timer(interval=0.2, function=writer_released.set).start()
+    reporting.build_predict_run_report(
+        test_images_paths_list=[Path(f"image_{idx}.jpg") for idx in range(6)],
+        report_dir_path=tmp_path / "report",
+        **report_params,
+    )
+    assert len(written_images) == 6
+    assert max(pending_counts) <= reporting.PENDING_REPORTS_LIMIT
+
+    # the error of the writer stops the predictions of the next images
+    pending_counts.clear()
+    with pytest.raises(OSError, match="disk full"):
+        reporting.build_predict_run_report(
+            test_images_paths_list=[Path("failing_image.jpg")]
+            + [Path(f"image_{idx}.jpg") for idx in range(6)],
+            report_dir_path=tmp_path / "failed_report",
+            **report_params,
+        )
+    assert len(pending_counts) <= reporting.PENDING_REPORTS_LIMIT + 1
@@ -0,0 +1,71 @@
+import threading
+import numpy as np
+
+from deep_learning.predictions import make_predictions
+from deep_learning.predictions_pipeline import make_predictions_pipelined
+from deep_learning.tile_cache import TilePredictionCache
+
+
+def test_pipelined_predictions_match_make_predictions(
+    small_model_params, small_images_paths
+):
+    images_predictions = list(
+        make_predictions_pipelined(
+            target_images_paths_list=small_images_paths,
+            correlate_predictions_bool=False,
+            correlation_filter=None,
+            **small_model_params,
+        )
+    )
+
+    # the options of make_predictions() are forwarded, the images being then predicted one after the other
+    cached_images_predictions = list(
+        make_predictions_pipelined(
+            target_images_paths_list=small_images_paths,
+            correlate_predictions_bool=False,
+            correlation_filter=None,
+            tile_cache=TilePredictionCache(),
+            **small_model_params,
+        )
+    )
+
+    # the images are yielded in order, each one with the predictions of make_predictions()
+    assert [image_path for image_path, _ in images_predictions] == small_images_paths
+    for (image_path, predictions_tensor), (_, cached_predictions_tensor) in zip(
+        images_predictions, cached_images_predictions
+    ):
+        assert np.array_equal(
+            np.asarray(predictions_tensor), np.asarray(cached_predictions_tensor)
+        )
+        assert np.array_equal(
+            np.asarray(predictions_tensor),
+            np.asarray(
+                make_predictions(
+                    target_image_path=image_path,
+                    correlate_predictions_bool=False,
+                    correlation_filter=None,
+                    **small_model_params,
+                )
+            ),
+        )
+
+
+def test_pipelined_predictions_closed_early(small_model_params, small_images_paths):
+    images_predictions = make_predictions_pipelined(
+        target_images_paths_list=small_images_paths * 3,
+        correlate_predictions_bool=False,
+        correlation_filter=None,
+        queue_size=1,
+        **small_model_params,
+    )
+    next(images_predictions)
+    producer_threads = [
+        thread for thread in threading.enumerate() if thread.name == "images_producer"
+    ]
+    assert producer_threads
+    images_predictions.close()
+
+    # the producer thread is not left blocked on the full queue
+    for producer_thread in producer_threads:
+        producer_thread.join(timeout=5)
+        assert not producer_thread.is_alive()
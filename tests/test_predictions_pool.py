@@ -0,0 +1,72 @@
+import numpy as np
+
+from deep_learning.inference_model import get_inference_model
+from deep_learning.predictions import (
+    make_predictions,
+    warm_up_model,
+    load_saved_model_arbitrary_input,
+)
+from deep_learning.predictions_pool import (
+    make_predictions_multiprocess,
+    benchmark_workers_scaling,
+)
+
+
+def test_warm_up_model_traces_the_inference_model(small_model_params):
+    warm_up_model(
+        checkpoint_dir_path=small_model_params["checkpoint_dir_path"],
+        n_classes=small_model_params["n_classes"],
+        patch_size=small_model_params["patch_size"],
+        batch_size=small_model_params["batch_size"],
+        encoder_kernel_size=small_model_params["encoder_kernel_size"],
+        inference_patch_size=96,
+    )
+    # the shape-agnostic model used for the patches of size 96 is the one traced
+    model = load_saved_model_arbitrary_input(
+        checkpoint_dir_path=small_model_params["checkpoint_dir_path"],
+        n_classes=small_model_params["n_classes"],
+        encoder_kernel_size=small_model_params["encoder_kernel_size"],
+    )
+    assert get_inference_model(model=model).tracing_time is not None
+
+
+def test_make_predictions_multiprocess(small_model_params, small_images_paths):
+    images_predictions = list(
+        make_predictions_multiprocess(
+            target_images_paths_list=small_images_paths,
+            correlate_predictions_bool=False,
+            correlation_filter=None,
+            n_workers=2,
+            n_cpus=2,
+            **small_model_params,
+        )
+    )
+
+    # the predictions come back in the order of the images
+    assert [image_path for image_path, _ in images_predictions] == small_images_paths
+    for image_path, predictions_array in images_predictions:
+        assert np.array_equal(
+            predictions_array,
+            np.asarray(
+                make_predictions(
+                    target_image_path=image_path,
+                    correlate_predictions_bool=False,
+                    correlation_filter=None,
+                    **small_model_params,
+                )
+            ),
+        )
+
+
+def test_benchmark_workers_scaling(small_model_params, small_images_paths):
+    throughputs = benchmark_workers_scaling(
+        target_images_paths_list=small_images_paths,
+        workers_numbers=[1, 2],
+        correlate_predictions_bool=False,
+        correlation_filter=None,
+        n_cpus=2,
+        **small_model_params,
+    )
+
+    assert list(throughputs) == [1, 2]
+    assert all(throughput > 0 for throughput in throughputs.values())
@@ -0,0 +1,60 @@
+import numpy as np
+import tensorflow as tf
+
+from deep_learning.inference_model import QuantizedInferenceModel
+from deep_learning.predictions import load_saved_model
+from deep_learning.quantization import export_quantized_model
+
+
+def test_export_quantized_model(small_model_params, tmp_path):
+    # the calibration patches, laid out like the training patches
+    random_generator = np.random.default_rng(0)
+    for patch_idx in range(6):
+        patch_dir_path = tmp_path / "patches" / "image" / str(patch_idx) / "image"
+        patch_dir_path.mkdir(parents=True)
+        patch = tf.cast(
+            tf.image.resize(
+                random_generator.integers(0, 256, size=(4, 4, 3), dtype=np.uint8),
+                (64, 64),
+            ),
+            tf.uint8,
+        )
+        tf.io.write_file(
+            str(patch_dir_path / f"patch_{patch_idx}.jpg"), tf.io.encode_jpeg(patch)
+        )
+
+    quantized_model_path = export_quantized_model(
+        checkpoint_dir_path=small_model_params["checkpoint_dir_path"],
+        output_path=tmp_path / "model_int8.tflite",
+        patches_dir_path=tmp_path / "patches",
+        n_classes=small_model_params["n_classes"],
+        patch_size=small_model_params["patch_size"],
+        encoder_kernel_size=small_model_params["encoder_kernel_size"],
+        n_calibration_patches=4,
+    )
+    quantized_model = QuantizedInferenceModel(quantized_model_path=quantized_model_path)
+
+    patches = random_generator.integers(0, 256, size=(3, 64, 64, 3), dtype=np.uint8)
+    classes = quantized_model.predict_classes(patches)
+    assert classes.shape == (3, 64, 64)
+    assert classes.dtype == np.uint8
+    assert classes.min() >= 1 and classes.max() <= small_model_params["n_classes"]
+
+    float_probabilities = load_saved_model(
+        checkpoint_dir_path=small_model_params["checkpoint_dir_path"],
+        n_classes=small_model_params["n_classes"],
+        input_shape=small_model_params["patch_size"],
+        encoder_kernel_size=small_model_params["encoder_kernel_size"],
+    ).predict(patches.astype(np.float32))
+    quantized_probabilities = quantized_model.predict_probabilities(patches)
+    assert quantized_probabilities.shape == float_probabilities.shape
+    assert np.mean(np.abs(quantized_probabilities - float_probabilities)) < 0.05
+
+    # the untrained model has many near ties : the classes are compared where the float model is confident
+    sorted_probabilities = np.sort(float_probabilities[:, :, :, 1:], axis=3)
+    confident_pixels = (
+        sorted_probabilities[..., -1] - sorted_probabilities[..., -2] > 0.05
+    )
+    assert np.any(confident_pixels)
+    float_classes = np.argmax(float_probabilities[:, :, :, 1:], axis=3) + 1
+    assert np.mean(classes[confident_pixels] == float_classes[confident_pixels]) > 0.95
@@ -0,0 +1,66 @@
+import numpy as np
+
+from dataset_builder.patches_generator import extract_patches_array
+from image_processing.stitching import (
+    stitch_patches,
+    get_patches_interior_bounds,
+    paste_patches_interiors,
+    get_blending_window,
+    blend_patches,
+)
+
+
+def test_stitch_patches():
+    image_height, image_width, patch_size, patch_overlap = 53, 71, 16, 4
+    image_array = np.arange(image_height * image_width * 3).reshape(
+        (image_height, image_width, 3)
+    )
+    patches, patches_origins = extract_patches_array(
+        image_tensor=image_array, patch_size=patch_size, patch_overlap=patch_overlap
+    )
+    rebuilt_array = stitch_patches(
+        patches=patches,
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+
+    # stitching the image patches gives the image cropped by patch_overlap / 2 on each side
+    assert np.array_equal(rebuilt_array, image_array[2:-2, 2:-2])
+
+    # pasting the patches one by one gives the same result
+    pasted_array = np.zeros_like(rebuilt_array)
+    paste_patches_interiors(
+        output=pasted_array,
+        patches=patches,
+        patches_origins=patches_origins,
+        patches_interior_bounds=get_patches_interior_bounds(
+            image_height=image_height,
+            image_width=image_width,
+            patch_size=patch_size,
+            patch_overlap=patch_overlap,
+        ),
+        patch_overlap=patch_overlap,
+    )
+    assert np.array_equal(pasted_array, rebuilt_array)
+
+
+def test_blend_patches():
+    image_height, image_width, patch_size, patch_overlap = 53, 71, 16, 4
+    image_array = np.random.default_rng(0).random((image_height, image_width, 3))
+    patches, patches_origins = extract_patches_array(
+        image_tensor=image_array, patch_size=patch_size, patch_overlap=patch_overlap
+    )
+
+    # the patches agree on their overlaps, so any weighted average gives the image back
+    for window_type in ["gaussian", "cosine"]:
+        blended_array = blend_patches(
+            patches=patches,
+            patches_origins=patches_origins,
+            image_height=image_height,
+            image_width=image_width,
+            window=get_blending_window(patch_size=patch_size, window_type=window_type),
+        )
+        assert blended_array.dtype == np.float16
+        assert np.allclose(blended_array, image_array, atol=1e-2)
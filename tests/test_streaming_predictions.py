@@ -0,0 +1,40 @@
+import numpy as np
+
+from deep_learning.predictions import make_predictions, make_predictions_streaming
+
+
+def test_streaming_predictions_match_crop_predictions(
+    small_model_params, small_images_paths, tmp_path
+):
+    crop_predictions_array = np.asarray(
+        make_predictions(
+            target_image_path=small_images_paths[0],
+            correlate_predictions_bool=False,
+            correlation_filter=None,
+            **small_model_params,
+        )
+    )
+
+    # with a 1 MB budget, the 3 rows of patches are predicted in 3 bands
+    class_map = make_predictions_streaming(
+        target_image_path=small_images_paths[0],
+        output_path=tmp_path / "predictions.npy",
+        memory_budget_mb=1,
+        **small_model_params,
+    )
+    assert class_map.dtype == np.uint8
+    assert np.array_equal(class_map, crop_predictions_array)
+    assert np.array_equal(np.load(tmp_path / "predictions.npy"), class_map)
+
+    # the streaming mode is also reached through make_predictions()
+    streamed_predictions_tensor = make_predictions(
+        target_image_path=small_images_paths[0],
+        correlate_predictions_bool=False,
+        correlation_filter=None,
+        memory_budget_mb=1,
+        **small_model_params,
+    )
+    assert streamed_predictions_tensor.dtype == crop_predictions_array.dtype
+    assert np.array_equal(
+        np.asarray(streamed_predictions_tensor), crop_predictions_array
+    )
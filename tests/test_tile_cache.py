@@ -0,0 +1,48 @@
+import numpy as np
+
+from deep_learning.tile_cache import TilePredictionCache
+
+
+def test_tile_prediction_cache():
+    patches = np.random.default_rng(0).integers(
+        0, 256, size=(4, 8, 8, 3), dtype=np.uint8
+    )
+    predicted_patches = list()
+
+    def predict_function(patches_batch: np.ndarray) -> np.ndarray:
+        predicted_patches.extend(patches_batch)
+        return patches_batch[:, :, :, 0] % 10
+
+    # each tile takes 64 bytes of uint8 classes : 3 tiles fit in the cache
+    tile_cache = TilePredictionCache(max_bytes=3 * 64)
+    classes = tile_cache.predict(
+        patches=patches[:3],
+        predict_function=predict_function,
+        model_fingerprint="model",
+    )
+    assert np.array_equal(classes, patches[:3, :, :, 0] % 10)
+
+    # only the new patch is predicted, and the least recently used tile is evicted
+    classes = tile_cache.predict(
+        patches=patches[1:],
+        predict_function=predict_function,
+        model_fingerprint="model",
+    )
+    assert np.array_equal(classes, patches[1:, :, :, 0] % 10)
+    assert len(predicted_patches) == 4
+    assert (tile_cache.hits, tile_cache.misses) == (2, 4)
+    assert tile_cache.n_bytes == 3 * 64
+    assert (
+        tile_cache.get(
+            tile_key=tile_cache.get_tile_key(tile=patches[0], model_fingerprint="model")
+        )
+        is None
+    )
+
+    # another model does not get the cached tiles
+    tile_cache.predict(
+        patches=patches[1:2],
+        predict_function=predict_function,
+        model_fingerprint="other_model",
+    )
+    assert len(predicted_patches) == 5
@@ -0,0 +1,33 @@
+import json
+import threading
+
+from utils.time_utils import start_trace, trace_span, traced
+
+
+@traced("stage")
+def traced_function(value: int) -> int:
+    return value + 1
+
+
+def test_trace_spans_of_all_threads(tmp_path):
+    # without a trace, the spans are not recorded
+    assert traced_function(value=1) == 2
+
+    with start_trace() as tracer:
+        with trace_span(name="parent", image="a"):
+            traced_function(value=1)
+        worker_thread = threading.Thread(target=traced_function, args=(2,))
+        worker_thread.start()
+        worker_thread.join()
+    # the spans after the trace are not recorded either
+    traced_function(value=3)
+
+    trace = json.loads(tracer.save(output_path=tmp_path / "trace.json").read_text())
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [span["name"] for span in spans] == ["stage", "parent", "stage"]
+    assert spans[1]["args"] == {"image": "a"}
+    assert spans[0]["tid"] != spans[2]["tid"]
+    # the first span is nested in the second one
+    assert spans[1]["ts"] <= spans[0]["ts"]
+    assert spans[0]["ts"] + spans[0]["dur"] <= spans[1]["ts"] + spans[1]["dur"]
+    assert set(tracer.get_stages_durations()) == {"stage", "parent"}
@@ -0,0 +1,49 @@
+import os
+import shutil
+import numpy as np
+
+from ui_integration.model import (
+    export_inference_model,
+    load_inference_model,
+    evict_cached_models,
+    InferenceModel,
+    EXPORTED_MODEL_DIR_NAME,
+)
+
+
+def test_export_inference_model(small_model_params, tmp_path):
+    # the export is written in the checkpoint folder : the shared checkpoint is copied
+    checkpoint_dir_path = tmp_path / "checkpoint"
+    shutil.copytree(small_model_params["checkpoint_dir_path"], checkpoint_dir_path)
+    model_params = {
+        "checkpoint_dir_path": checkpoint_dir_path,
+        "n_classes": small_model_params["n_classes"],
+        "input_shape": small_model_params["patch_size"],
+        "encoder_kernel_size": small_model_params["encoder_kernel_size"],
+    }
+    patches = np.random.default_rng(0).integers(
+        0, 256, size=(3, 64, 64, 3), dtype=np.uint8
+    )
+
+    checkpoint_model = load_inference_model(**model_params)
+    assert isinstance(checkpoint_model, InferenceModel)
+    checkpoint_classes = np.asarray(checkpoint_model.predict_classes(patches))
+
+    export_dir_path = export_inference_model(**model_params)
+    assert export_dir_path == checkpoint_dir_path / EXPORTED_MODEL_DIR_NAME
+    exported_model = load_inference_model(**model_params)
+    assert not isinstance(exported_model, InferenceModel)
+    exported_classes = np.asarray(exported_model.predict_classes(patches))
+    assert exported_classes.dtype == np.uint8
+    assert np.array_equal(exported_classes, checkpoint_classes)
+
+    # the exported model is evicted with the models of its checkpoint folder
+    assert evict_cached_models(checkpoint_dir_path=checkpoint_dir_path) == 2
+    assert load_inference_model(**model_params) is not exported_model
+
+    # a checkpoint newer than the export is used instead of it
+    checkpoint_index_path = next(checkpoint_dir_path.glob("*.index"))
+    checkpoint_mtime = checkpoint_index_path.stat().st_mtime_ns + 10**9
+    os.utime(checkpoint_index_path, ns=(checkpoint_mtime, checkpoint_mtime))
+    assert isinstance(load_inference_model(**model_params), InferenceModel)
+    evict_cached_models()
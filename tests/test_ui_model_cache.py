@@ -0,0 +1,97 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from ui_integration.model import (
+    warm_up_model,
+    load_saved_model,
+    get_inference_model,
+    get_cached_model,
+    evict_cached_models,
+    TilePredictionCache,
+    LOADED_MODELS_CACHE,
+)
+
+
+def test_get_cached_model_concurrent_loads():
+    evict_cached_models()
+    slow_model_loaded = threading.Event()
+    loaded_models = list()
+
+    def load_slow_model():
+        loaded_models.append("slow_model")
+        slow_model_loaded.wait(timeout=5)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        slow_models = [
+            executor.submit(
+                get_cached_model,
+                cache_key=("slow_model",),
+                load_model_function=load_slow_model,
+            )
+            for _ in range(2)
+        ]
+        # another model does not wait for the loading of the slow one
+        fast_model = get_cached_model(
+            cache_key=("fast_model",), load_model_function=object
+        )
+        assert not any(future.done() for future in slow_models)
+        slow_model_loaded.set()
+        # the concurrent calls for a model share its single loading
+        assert slow_models[0].result() is slow_models[1].result()
+    assert loaded_models == ["slow_model"]
+    assert list(LOADED_MODELS_CACHE.values()) == [fast_model, slow_models[0].result()]
+    evict_cached_models()
+
+
+def test_tile_prediction_cache_threads():
+    patches = np.random.default_rng(0).integers(
+        0, 256, size=(8, 8, 8, 3), dtype=np.uint8
+    )
+
+    class InferenceModel:
+        def predict_classes(self, patches_batch: np.ndarray) -> np.ndarray:
+            return patches_batch[:, :, :, 0] % 10
+
+    # each tile takes 64 bytes of uint8 classes : the tiles are evicted while other threads read them
+    tile_cache = TilePredictionCache(max_bytes=4 * 64)
+    batches_starts = [batch_start % 5 for batch_start in range(200)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        patches_classes = list(
+            executor.map(
+                lambda batch_start: tile_cache.predict_classes(
+                    patches=patches[batch_start : batch_start + 4],
+                    inference_model=InferenceModel(),
+                    model_fingerprint="model",
+                ),
+                batches_starts,
+            )
+        )
+    for batch_start, classes in zip(batches_starts, patches_classes):
+        assert np.array_equal(
+            classes, patches[batch_start : batch_start + 4, :, :, 0] % 10
+        )
+    assert tile_cache.hits + tile_cache.misses == len(batches_starts) * 4
+    assert tile_cache.n_bytes == sum(
+        classes.nbytes for classes in tile_cache.tiles.values()
+    )
+    assert tile_cache.n_bytes <= 4 * 64
+
+
+def test_warm_up_model(small_model_params):
+    evict_cached_models()
+    model_params = {
+        "checkpoint_dir_path": small_model_params["checkpoint_dir_path"],
+        "n_classes": small_model_params["n_classes"],
+        "input_shape": small_model_params["patch_size"],
+        "encoder_kernel_size": small_model_params["encoder_kernel_size"],
+    }
+    assert (
+        warm_up_model(batch_size=small_model_params["batch_size"], **model_params) > 0
+    )
+
+    # the inference function of the predictions is the one traced by the warm-up
+    inference_model = get_inference_model(model=load_saved_model(**model_params))
+    assert inference_model.predict_classes.experimental_get_tracing_count() == 1
+    evict_cached_models()
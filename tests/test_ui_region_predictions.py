@@ -0,0 +1,79 @@
+import numpy as np
+import tensorflow as tf
+
+import ui_integration.main as ui_main
+from ui_integration.predictions_maker import (
+    make_predictions,
+    make_predictions_on_region,
+)
+
+
+def test_make_predictions_on_region(
+    small_model_params, small_images_paths, tmp_path, monkeypatch
+):
+    model_params = {
+        "checkpoint_dir_path": small_model_params["checkpoint_dir_path"],
+        "patch_size": small_model_params["patch_size"],
+        "patch_overlap": small_model_params["patch_overlap"],
+        "n_classes": small_model_params["n_classes"],
+        "batch_size": small_model_params["batch_size"],
+        "encoder_kernel_size": small_model_params["encoder_kernel_size"],
+    }
+    # png images, so that the pixels out of the edit are exactly the same
+    image_array = tf.io.decode_jpeg(tf.io.read_file(str(small_images_paths[0]))).numpy()
+    image_path = tmp_path / "image.png"
+    tf.io.write_file(str(image_path), tf.io.encode_png(image_array))
+    # the edit ends on the first pixel of the second patches column : only the first column is predicted again
+    edited_image_array = image_array.copy()
+    edited_image_array[48:56, :48] = 0
+    edited_image_path = tmp_path / "edited_image.png"
+    tf.io.write_file(str(edited_image_path), tf.io.encode_png(edited_image_array))
+    edited_predictions_array = np.asarray(
+        make_predictions(target_image_path=edited_image_path, **model_params),
+        dtype=np.uint8,
+    )
+
+    predictions_array = np.asarray(
+        make_predictions(target_image_path=image_path, **model_params), dtype=np.uint8
+    )
+    assert not np.array_equal(predictions_array, edited_predictions_array)
+    row_start, row_end, column_start, column_end = make_predictions_on_region(
+        target_image_path=edited_image_path,
+        predictions_array=predictions_array,
+        changed_region=(48, 56, 0, 48),
+        **model_params,
+    )
+    assert (row_start, column_start) == (0, 0)
+    # the predictions of the first patches column end where the ones of the second column start
+    assert column_end == (
+        small_model_params["patch_size"] - small_model_params["patch_overlap"]
+    )
+    assert np.array_equal(predictions_array, edited_predictions_array)
+
+    # an image of another size, e.g. cropped, is fully predicted again
+    monkeypatch.setattr(ui_main, "PATCH_SIZE", small_model_params["patch_size"])
+    monkeypatch.setattr(ui_main, "PATCH_OVERLAP", small_model_params["patch_overlap"])
+    monkeypatch.setattr(ui_main, "BATCH_SIZE", small_model_params["batch_size"])
+    cropped_image_path = tmp_path / "cropped_image.png"
+    tf.io.write_file(
+        str(cropped_image_path), tf.io.encode_png(edited_image_array[:130, :170])
+    )
+    predictions_dir_path = tmp_path / "predictions"
+    predictions_dir_path.mkdir()
+    ui_main.save_tile_store(
+        predictions_array=predictions_array, predictions_dir_path=predictions_dir_path
+    )
+    class_masks_paths_dict = ui_main.update_predictions(
+        image_path=cropped_image_path,
+        model_checkpoint_dir_path=small_model_params["checkpoint_dir_path"],
+        predictions_dir_path=predictions_dir_path,
+        changed_region=(0, 130, 0, 170),
+    )
+    assert set(class_masks_paths_dict) == set(ui_main.MAPPING_CLASS_NUMBER)
+    assert np.array_equal(
+        ui_main.load_tile_store(predictions_dir_path=predictions_dir_path),
+        np.asarray(
+            make_predictions(target_image_path=cropped_image_path, **model_params),
+            dtype=np.uint8,
+        ),
+    )
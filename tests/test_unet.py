@@ -0,0 +1,26 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from deep_learning.unet import pad_to_multiple, build_padded_model
+
+
+def test_pad_to_multiple():
+    inputs = tf.reshape(tf.range(2 * 13 * 6 * 3, dtype=tf.float32), (2, 13, 6, 3))
+    padded_inputs = pad_to_multiple(inputs=inputs, multiple=8)
+
+    assert padded_inputs.shape == (2, 16, 8, 3)
+    # the original images are kept in the top left corner
+    assert np.array_equal(padded_inputs[:, :13, :6], inputs)
+
+
+def test_build_padded_model():
+    inputs = keras.Input(shape=(None, None, 3))
+    outputs = keras.layers.MaxPooling2D(pool_size=8)(inputs)
+    outputs = keras.layers.UpSampling2D(size=8)(outputs)
+    model = build_padded_model(
+        model=keras.Model(inputs=inputs, outputs=outputs), input_size_multiple=8
+    )
+
+    predictions = model.predict(np.ones((1, 21, 30, 3), dtype=np.float32))
+    assert predictions.shape == (1, 21, 30, 3)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from dataset_builder.patches_generator import (
+    get_patches_grid_shape,
+    get_patches_origins,
+)
+from deep_learning.predictions import get_uniform_patches_sources
+
+
+def test_get_uniform_patches_sources():
+    image_height, image_width, patch_size, patch_overlap = 40, 60, 20, 0
+    # a uniform blue left half, a uniform red upper right quarter and a noisy lower right quarter
+    image_array = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+    image_array[:, :40] = [0, 0, 200]
+    image_array[:20, 40:] = [200, 0, 0]
+    image_array[20:, 40:] = np.random.default_rng(0).integers(0, 256, size=(20, 20, 3))
+
+    # the grid has 3 rows and 4 columns, the last row and column being the down side and right side patches
+    n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )[1]
+    patches_sources = get_uniform_patches_sources(
+        image_array=image_array,
+        patches_origins=get_patches_origins(
+            image_height=image_height,
+            image_width=image_width,
+            patch_size=patch_size,
+            patch_overlap=patch_overlap,
+        ),
+        n_patches_per_row=n_horizontal_patches + 1,
+        patch_size=patch_size,
+        variance_threshold=25.0,
+        color_tolerance=10.0,
+    )
+
+    # the first blue and red patches are predicted, the other ones reuse their left or upper neighbor,
+    # and the noisy patches are predicted
+    assert patches_sources.tolist() == [-1, 0, -1, 2, 0, 4, -1, -1, 4, 8, -1, -1]
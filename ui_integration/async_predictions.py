@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ui_integration.main import (
+    PATCH_SIZE,
+    PATCH_OVERLAP,
+    N_CLASSES,
+    BATCH_SIZE,
+    ENCODER_KERNEL_SIZE,
+    save_predictions,
+)
+from ui_integration.model import TILE_PREDICTIONS_CACHE
+from ui_integration.predictions_maker import make_predictions, PredictionsCancelledError
+from ui_integration.utils import get_image_name_without_extension
+
+# The model runs on one image at a time, while the masks of the previous image are written
+INFERENCE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+MASKS_WRITER_EXECUTOR = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="masks_writer"
+)
+
+
+class PredictionJob:
+    """
+    The predictions of an image, made in the background by start_predictions().
+    The class map is available as soon as the model is done, before the binary masks are written.
+    Awaiting the job gives the masks paths, like main() from the main.py module returns them.
+    """
+
+    def __init__(
+        self,
+        image_path: Path,
+        class_map: asyncio.Future,
+        masks_task: asyncio.Task,
+        cancel_event: threading.Event,
+    ):
+        """
+        :param image_path: The image the predictions are made on.
+        :param class_map: Gets the 2D uint8 array of the predicted classes.
+        :param masks_task: Gets the dictionnary with key <class_name> and value <class_mask_path>.
+        :param cancel_event: Stops the predictions before the next batch of patches once set.
+        """
+        self.image_path = image_path
+        self.class_map = class_map
+        self.masks_task = masks_task
+        self.cancel_event = cancel_event
+
+    def cancel(self) -> None:
+        """
+        Abandon the predictions : the model stops before its next batch of patches.
+        The masks already being written when the job is cancelled are still written.
+        """
+        self.cancel_event.set()
+        self.masks_task.cancel()
+        # the task cancelled before its first step never reaches the cancellation of the class map
+        self.class_map.cancel()
+
+    def cancelled(self) -> bool:
+        return self.masks_task.cancelled()
+
+    def __await__(self):
+        return self.masks_task.__await__()
+
+
+def start_predictions(
+    image_path: Path,
+    model_checkpoint_dir_path: Path,
+    workspace_dir_path: Path,
+    quantized_model_path: Path = None,
+    use_tile_cache: bool = False,
+) -> PredictionJob:
+    """
+    Start the predictions of an image in the background, from a running event loop, e.g. when the painter opens it.
+    Unlike main() from the main.py module, it returns at once, and the predictions can be abandoned with the cancel() function of the job.
+
+    :param image_path: The image on which to make predictions on.
+    :param model_checkpoint_dir_path: The path to the model checkpoint.
+    :param workspace_dir_path: Folder where to save the binary predictions, like main() does.
+    :param quantized_model_path: Optional int8 quantized model (.tflite file), used instead of the model checkpoint.
+    :param use_tile_cache: Whether or not to keep the patches predictions in memory, so that the next predictions on the same image are faster.
+    :return: The job, whose class_map future is done before the masks are written.
+
+    Example :
+        job = start_predictions(Path(".../image.jpg"), Path(".../final_models/1_model_2022_01_06__17_43_17"), Path(".../my_workspace/"))
+        class_map = await job.class_map
+        class_masks_paths_dict = await job
+    """
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    class_map = loop.create_future()
+    masks_task = loop.create_task(
+        run_predictions(
+            image_path=image_path,
+            model_checkpoint_dir_path=model_checkpoint_dir_path,
+            workspace_dir_path=workspace_dir_path,
+            quantized_model_path=quantized_model_path,
+            use_tile_cache=use_tile_cache,
+            class_map=class_map,
+            cancel_event=cancel_event,
+        )
+    )
+    # the class map does not stay pending, whichever way the task ends
+    masks_task.add_done_callback(lambda _: class_map.cancel())
+    return PredictionJob(
+        image_path=image_path,
+        class_map=class_map,
+        masks_task=masks_task,
+        cancel_event=cancel_event,
+    )
+
+
+async def run_predictions(
+    image_path: Path,
+    model_checkpoint_dir_path: Path,
+    workspace_dir_path: Path,
+    quantized_model_path: Path,
+    use_tile_cache: bool,
+    class_map: asyncio.Future,
+    cancel_event: threading.Event,
+) -> {str: Path}:
+    """Make the predictions on the inference executor, give the class map, and write the masks on the masks writer executor."""
+    loop = asyncio.get_running_loop()
+    try:
+        predictions_tensor = await loop.run_in_executor(
+            INFERENCE_EXECUTOR,
+            functools.partial(
+                make_predictions,
+                target_image_path=image_path,
+                checkpoint_dir_path=model_checkpoint_dir_path,
+                patch_size=PATCH_SIZE,
+                patch_overlap=PATCH_OVERLAP,
+                n_classes=N_CLASSES,
+                batch_size=BATCH_SIZE,
+                encoder_kernel_size=ENCODER_KERNEL_SIZE,
+                quantized_model_path=quantized_model_path,
+                tile_cache=TILE_PREDICTIONS_CACHE if use_tile_cache else None,
+                cancel_event=cancel_event,
+            ),
+        )
+    except (asyncio.CancelledError, PredictionsCancelledError):
+        # the inference thread stops before its next batch
+        cancel_event.set()
+        class_map.cancel()
+        print(
+            f"\nPredictions on {get_image_name_without_extension(image_path)} cancelled."
+        )
+        raise asyncio.CancelledError()
+    except Exception as exception:
+        class_map.set_exception(exception)
+        raise
+    class_map.set_result(np.asarray(predictions_tensor, dtype=np.uint8))
+
+    return await loop.run_in_executor(
+        MASKS_WRITER_EXECUTOR,
+        functools.partial(
+            save_predictions,
+            predictions_tensor=predictions_tensor,
+            image_name=get_image_name_without_extension(image_path),
+            workspace_dir_path=workspace_dir_path,
+        ),
+    )
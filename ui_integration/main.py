@@ -1,11 +1,25 @@
+import time
+import numpy as np
 import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from ui_integration.predictions_maker import make_predictions
+from ui_integration.model import TILE_PREDICTIONS_CACHE
+from ui_integration.predictions_maker import (
+    make_predictions,
+    make_predictions_on_region,
+)
 from ui_integration.utils import (
+    decode_image,
     get_formatted_time,
     get_image_name_without_extension,
-    turn_2d_tensor_to_3d_tensor,
+    build_palette_array,
+    overlay_class_map,
+    encode_png_image,
+    write_file_bytes,
+    start_trace,
+    traced,
+    TRACE_FILE_NAME,
 )
 
 
@@ -27,15 +41,36 @@ MAPPING_CLASS_NUMBER = {
     "eau": 8,
     "roche": 9,
 }  # Maps each labelling class to a number
+PALETTE_RGB = {
+    0: (220, 220, 220),  # gainsboro
+    1: (139, 105, 20),  # goldenrod4
+    2: (191, 62, 255),  # darkorchid1
+    3: (255, 125, 64),  # flesh
+    4: (227, 207, 87),  # banana
+    5: (100, 149, 237),  # cornerflowblue
+    6: (69, 139, 0),  # chartreuse4
+    7: (127, 255, 0),  # chartreuse1
+    8: (0, 255, 255),  # aqua
+    9: (255, 0, 0),  # red
+}  # Same colors as the reports
+# Lookup table of the classes colors, row i being the color of class i
+PALETTE_ARRAY = build_palette_array(palette_rgb=PALETTE_RGB)
 # Values in a binary LabelBox mask
 MASK_TRUE_VALUE = 255
 MASK_FALSE_VALUE = 0
+# Threads encoding and writing the binary masks, the png compression releasing the GIL
+MASKS_WRITER_THREADS = 4
+# File of a predictions folder keeping the predictions of the image, so that they can be updated after an edit
+TILE_STORE_FILE_NAME = "tile_store.npz"
 
 
 def main(
     image_path: Path,
     model_checkpoint_dir_path: Path,
     workspace_dir_path: Path,
+    quantized_model_path: Path = None,
+    use_tile_cache: bool = False,
+    overlay_alpha: float = None,
 ) -> {str: Path}:
     """
     Generate and save binary predictions masks in the specified workspace folder.
@@ -44,59 +79,285 @@ def main(
     :param model_checkpoint_dir_path: The path to the model checkpoint.
     :param workspace_dir_path: Folder where to save the binary predictions.
       It will create a subfolder named "<image_name>/predictions__<run_date>",
-      with binary masks "<image_name>__<class_name>.png" in it.
+      with binary masks "<image_name>__<class_name>.png" in it,
+      and the time spent in each stage in a "trace.json" file, to open in https://ui.perfetto.dev.
+    :param quantized_model_path: Optional int8 quantized model (.tflite file), used instead of the model checkpoint.
+    :param use_tile_cache: Whether or not to keep the patches predictions in memory, so that the next calls on the same image,
+      or on a crop of it, only predict the patches which changed.
+    :param overlay_alpha: If given, the classes colors are also blended on the image with this weight,
+      in a "<image_name>__overlay.png" preview next to the masks.
 
     :returns A dictionnary with key <class_name> and value <class_mask_path>.
 
     Example : main(Path(".../image.jpg", Path(".../final_models/1_model_2022_01_06__17_43_17"), Path(".../my_workspace/")
     """
-    # Make predictions
-    predictions_tensor = make_predictions(
-        target_image_path=image_path,
-        checkpoint_dir_path=model_checkpoint_dir_path,
-        patch_size=PATCH_SIZE,
-        patch_overlap=PATCH_OVERLAP,
-        n_classes=N_CLASSES,
-        batch_size=BATCH_SIZE,
-        encoder_kernel_size=ENCODER_KERNEL_SIZE,
+    start_time = time.perf_counter()
+    with start_trace() as tracer:
+        # Make predictions
+        predictions_tensor = make_predictions(
+            target_image_path=image_path,
+            checkpoint_dir_path=model_checkpoint_dir_path,
+            patch_size=PATCH_SIZE,
+            patch_overlap=PATCH_OVERLAP,
+            n_classes=N_CLASSES,
+            batch_size=BATCH_SIZE,
+            encoder_kernel_size=ENCODER_KERNEL_SIZE,
+            quantized_model_path=quantized_model_path,
+            tile_cache=TILE_PREDICTIONS_CACHE if use_tile_cache else None,
+        )
+        print(f"\nTime to first prediction : {time.perf_counter() - start_time:.2f}s.")
+
+        class_masks_paths_dict = save_predictions(
+            predictions_tensor=predictions_tensor,
+            image_name=get_image_name_without_extension(image_path),
+            workspace_dir_path=workspace_dir_path,
+        )
+        if overlay_alpha is not None:
+            save_predictions_overlay(
+                image_path=image_path,
+                predictions_tensor=predictions_tensor,
+                alpha=overlay_alpha,
+                output_path=next(iter(class_masks_paths_dict.values())).parent
+                / f"{get_image_name_without_extension(image_path)}__overlay.png",
+            )
+    # the spans of the run are saved in its predictions folder, next to the masks
+    tracer.save(
+        output_path=next(iter(class_masks_paths_dict.values())).parent / TRACE_FILE_NAME
     )
 
+    return class_masks_paths_dict
+
+
+def save_predictions(
+    predictions_tensor: tf.Tensor, image_name: str, workspace_dir_path: Path
+) -> {str: Path}:
+    """
+    Save the predictions of an image as binary masks, in a new "<image_name>/predictions__<run_date>" subfolder of the workspace.
+
+    :param predictions_tensor: The 2D categorical predictions of the image.
+    :param image_name: The name of the image, without extension.
+    :param workspace_dir_path: Folder where to save the binary predictions.
+
+    :returns A dictionnary with key <class_name> and value <class_mask_path>.
+    """
     # Create a subfolder for the predictions
     predictions_root_path = (
-        workspace_dir_path
-        / get_image_name_without_extension(image_path)
-        / ("predictions__" + get_formatted_time())
+        workspace_dir_path / image_name / ("predictions__" + get_formatted_time())
     )
     predictions_root_path.mkdir(parents=True)
 
-    # Create and save binary tensors
-    class_masks_paths_dict = dict()
-    for idx, class_number in enumerate(MAPPING_CLASS_NUMBER.values()):
-        binary_tensor = tf.where(
-            condition=tf.equal(predictions_tensor, class_number),
-            x=MASK_TRUE_VALUE,
-            y=MASK_FALSE_VALUE,
-        )
+    save_tile_store(
+        predictions_array=np.asarray(predictions_tensor, dtype=np.uint8),
+        predictions_dir_path=predictions_root_path,
+    )
 
-        binary_tensor_3d = turn_2d_tensor_to_3d_tensor(tensor_2d=binary_tensor)
-        mapping_number_class = {
-            class_number: class_name
-            for class_name, class_number in MAPPING_CLASS_NUMBER.items()
-        }
+    # Split the predictions into binary masks and save them
+    class_masks_paths_dict = save_binary_masks(
+        predictions_array=predictions_tensor,
+        class_masks_paths_dict={
+            class_name: predictions_root_path / f"{image_name}__{class_name}.png"
+            for class_name in MAPPING_CLASS_NUMBER
+        },
+    )
+    print(
+        f"\nBinary predictions plot successfully saved in folder : {predictions_root_path}"
+    )
 
-        output_path = (
-            predictions_root_path
-            / f"{get_image_name_without_extension(image_path)}__{mapping_number_class[idx]}.png"
+    return class_masks_paths_dict
+
+
+def update_predictions(
+    image_path: Path,
+    model_checkpoint_dir_path: Path,
+    predictions_dir_path: Path,
+    changed_region: (int, int, int, int),
+    quantized_model_path: Path = None,
+    use_tile_cache: bool = False,
+) -> {str: Path}:
+    """
+    Update the predictions saved by main() after a part of the image was edited, e.g. retouched or replaced.
+    Only the patches containing edited pixels are predicted again, so that the time taken scales with the edit size,
+    and only the binary masks of the classes which changed are written again.
+    If the image size changed, e.g. after a crop, the image is fully predicted again.
+
+    :param image_path: The edited image.
+    :param model_checkpoint_dir_path: The path to the model checkpoint.
+    :param predictions_dir_path: The predictions folder created by main() for this image.
+    :param changed_region: The (row start, row end, column start, column end) bounds of the edited pixels, in the image.
+    :param quantized_model_path: Optional int8 quantized model (.tflite file), used instead of the model checkpoint.
+    :param use_tile_cache: Whether or not to keep the patches predictions in memory.
+
+    :returns A dictionnary with key <class_name> and value <class_mask_path>, for the rewritten masks only.
+    """
+    start_time = time.perf_counter()
+    predictions_array = load_tile_store(predictions_dir_path=predictions_dir_path)
+    image_height, image_width = decode_image(file_path=image_path).shape[:2]
+    if predictions_array.shape != (
+        image_height - PATCH_OVERLAP,
+        image_width - PATCH_OVERLAP,
+    ):
+        print("\nThe image size changed, its predictions are all made again.")
+        predictions_array = np.asarray(
+            make_predictions(
+                target_image_path=image_path,
+                checkpoint_dir_path=model_checkpoint_dir_path,
+                patch_size=PATCH_SIZE,
+                patch_overlap=PATCH_OVERLAP,
+                n_classes=N_CLASSES,
+                batch_size=BATCH_SIZE,
+                encoder_kernel_size=ENCODER_KERNEL_SIZE,
+                quantized_model_path=quantized_model_path,
+                tile_cache=TILE_PREDICTIONS_CACHE if use_tile_cache else None,
+            ),
+            dtype=np.uint8,
+        )
+        changed_classes = list(MAPPING_CLASS_NUMBER.values())
+    else:
+        previous_predictions_array = predictions_array.copy()
+        row_start, row_end, column_start, column_end = make_predictions_on_region(
+            target_image_path=image_path,
+            checkpoint_dir_path=model_checkpoint_dir_path,
+            predictions_array=predictions_array,
+            changed_region=changed_region,
+            patch_size=PATCH_SIZE,
+            patch_overlap=PATCH_OVERLAP,
+            n_classes=N_CLASSES,
+            batch_size=BATCH_SIZE,
+            encoder_kernel_size=ENCODER_KERNEL_SIZE,
+            quantized_model_path=quantized_model_path,
+            tile_cache=TILE_PREDICTIONS_CACHE if use_tile_cache else None,
         )
-        tf.keras.preprocessing.image.save_img(output_path, binary_tensor_3d)
-        class_masks_paths_dict[mapping_number_class[idx]] = output_path
+        # the classes a pixel of the updated area went from or to
+        previous_area = previous_predictions_array[
+            row_start:row_end, column_start:column_end
+        ]
+        updated_area = predictions_array[row_start:row_end, column_start:column_end]
+        changed_pixels = previous_area != updated_area
+        changed_classes = np.union1d(
+            previous_area[changed_pixels], updated_area[changed_pixels]
+        ).tolist()
+    print(f"\nTime to updated prediction : {time.perf_counter() - start_time:.2f}s.")
+
+    save_tile_store(
+        predictions_array=predictions_array, predictions_dir_path=predictions_dir_path
+    )
+    class_masks_paths_dict = save_binary_masks(
+        predictions_array=predictions_array,
+        class_masks_paths_dict={
+            class_name: predictions_dir_path
+            / f"{get_image_name_without_extension(image_path)}__{class_name}.png"
+            for class_name, class_number in MAPPING_CLASS_NUMBER.items()
+            if class_number in changed_classes
+        },
+    )
     print(
-        f"\nBinary predictions plot successfully saved in folder : {predictions_root_path}"
+        f"\n{len(class_masks_paths_dict)} binary predictions masks updated in folder : {predictions_dir_path}"
     )
 
     return class_masks_paths_dict
 
 
+@traced("binarize")
+def split_class_map(predictions_array: np.ndarray, class_numbers: [int]) -> np.ndarray:
+    """
+    Split the predictions into the binary masks of several classes, in a single comparison broadcast over the classes.
+
+    :return: A uint8 array of size (len(class_numbers), height, width), valued MASK_TRUE_VALUE where the pixel is of the class, and MASK_FALSE_VALUE elsewhere.
+    """
+    predictions_array = np.asarray(predictions_array)
+    return np.where(
+        predictions_array[np.newaxis]
+        == np.asarray(class_numbers)[:, np.newaxis, np.newaxis],
+        np.uint8(MASK_TRUE_VALUE),
+        np.uint8(MASK_FALSE_VALUE),
+    )
+
+
+def save_binary_masks(
+    predictions_array: np.ndarray, class_masks_paths_dict: {str: Path}
+) -> {str: Path}:
+    """
+    Save the binary masks of several classes as single-channel png images.
+    The predictions are split once, and the masks are encoded and written by a pool of MASKS_WRITER_THREADS threads.
+
+    :param predictions_array: The 2D categorical predictions of the image.
+    :param class_masks_paths_dict: A dictionnary with key <class_name> and value <class_mask_path>, for the masks to save.
+
+    :returns The same dictionnary, once every mask is written.
+    """
+    binary_masks_array = split_class_map(
+        predictions_array=predictions_array,
+        class_numbers=[
+            MAPPING_CLASS_NUMBER[class_name] for class_name in class_masks_paths_dict
+        ],
+    )
+    with ThreadPoolExecutor(
+        max_workers=min(MASKS_WRITER_THREADS, len(class_masks_paths_dict)) or 1
+    ) as masks_writer:
+        masks_futures = [
+            masks_writer.submit(
+                save_binary_mask,
+                binary_mask_array=binary_mask_array,
+                output_path=output_path,
+            )
+            for binary_mask_array, output_path in zip(
+                binary_masks_array, class_masks_paths_dict.values()
+            )
+        ]
+        # raise the exceptions of the writer threads, if any
+        for mask_future in masks_futures:
+            mask_future.result()
+    return class_masks_paths_dict
+
+
+def save_binary_mask(binary_mask_array: np.ndarray, output_path: Path) -> Path:
+    """Save a binary mask as a single-channel png image."""
+    write_file_bytes(
+        file_bytes=encode_png_image(
+            image_array=binary_mask_array[:, :, np.newaxis], scale=False
+        ),
+        output_path=output_path,
+    )
+    return output_path
+
+
+def save_predictions_overlay(
+    image_path: Path, predictions_tensor: tf.Tensor, alpha: float, output_path: Path
+) -> Path:
+    """Save the classes colors blended on the image as a png image, the background being left uncolored."""
+    overlay_array = overlay_class_map(
+        image_array=decode_image(file_path=image_path),
+        class_map=np.asarray(predictions_tensor, dtype=np.uint8),
+        palette_array=PALETTE_ARRAY,
+        alpha=alpha,
+    )
+    write_file_bytes(
+        file_bytes=encode_png_image(image_array=overlay_array, scale=False),
+        output_path=output_path,
+    )
+    return output_path
+
+
+def save_tile_store(predictions_array: np.ndarray, predictions_dir_path: Path) -> None:
+    """Keep the uint8 predictions of the image in its predictions folder."""
+    np.savez(
+        predictions_dir_path / TILE_STORE_FILE_NAME,
+        predictions=predictions_array,
+        patch_size=PATCH_SIZE,
+        patch_overlap=PATCH_OVERLAP,
+    )
+
+
+def load_tile_store(predictions_dir_path: Path) -> np.ndarray:
+    """Load the predictions kept by save_tile_store(), made with the same patches grid."""
+    with np.load(predictions_dir_path / TILE_STORE_FILE_NAME) as tile_store:
+        assert (
+            tile_store["patch_size"] == PATCH_SIZE
+            and tile_store["patch_overlap"] == PATCH_OVERLAP
+        ), f"The predictions of {predictions_dir_path} were made with other patches."
+        return tile_store["predictions"]
+
+
 # -----
 # DEBUG
 
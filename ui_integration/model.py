@@ -1,35 +1,458 @@
+import argparse
+import gc
+import hashlib
+import json
+import threading
+import time
+import weakref
+import numpy as np
 import tensorflow as tf
+from collections import OrderedDict
+from concurrent.futures import Future
 from tensorflow import keras
 from tensorflow.keras import layers
 from pathlib import Path
+from typing import Callable
 
 
 # Constants
 PADDING_TYPE = "same"
+MODELS_CACHE_SIZE = 2
+TILE_CACHE_SIZE_MB = 128
+# Subfolder of a model checkpoint folder where its inference model is exported
+EXPORTED_MODEL_DIR_NAME = "inference_model"
+# File of an exported inference model recording the checkpoint it was exported from
+EXPORTED_CHECKPOINT_FILE_NAME = "exported_checkpoint.json"
+
+# Loaded models, from the least to the most recently used
+LOADED_MODELS_CACHE = OrderedDict()
+# Models being loaded, as futures resolved once they are in LOADED_MODELS_CACHE
+LOADING_MODELS_FUTURES = dict()
+# Inference models already traced for a Keras model
+INFERENCE_MODELS_CACHE = weakref.WeakKeyDictionary()
+# Quantized models already loaded in an interpreter, by model path
+QUANTIZED_MODELS_CACHE = dict()
+# The caches are shared by the inference executor and by the direct calls to main() or update_predictions()
+MODELS_CACHES_LOCK = threading.Lock()
+
+
+class InferenceModel(tf.Module):
+    """
+    Inference-only wrapper of a trained model, whose traced function takes uint8 patches and returns uint8 classes.
+    The background exclusion and the argmax are done in the graph, so that only the classes are sent back to the host.
+    """
+
+    def __init__(self, model: keras.Model):
+        super().__init__(name="inference_model")
+        self.model = model
+        input_height, input_width = model.input_shape[1:3]
+        self.predict_classes = tf.function(
+            self.get_classes,
+            input_signature=[
+                tf.TensorSpec(
+                    shape=[None, input_height, input_width, 3], dtype=tf.uint8
+                )
+            ],
+        )
+
+    def get_classes(self, patches: tf.Tensor) -> tf.Tensor:
+        probabilities = self.model(tf.cast(patches, tf.float32), training=False)
+        # Remove background predictions so it takes the max on the non background classes
+        # Note : the argmax function shift the classes numbers of -1, that is why we add one just after
+        classes = (
+            tf.argmax(probabilities[:, :, :, 1:], axis=3, output_type=tf.int32) + 1
+        )
+        return tf.cast(classes, tf.uint8)
+
+    def warmup(self) -> float:
+        """
+        Trace the function on a blank patch, so that the first predictions only pay the steady state latency.
+
+        :return: The tracing time, in seconds.
+        """
+        input_height, input_width = self.model.input_shape[1:3]
+        start_time = time.perf_counter()
+        self.predict_classes(
+            tf.zeros((1, input_height, input_width, 3), dtype=tf.uint8)
+        )
+        return time.perf_counter() - start_time
+
+
+def get_inference_model(model: keras.Model) -> InferenceModel:
+    """Get the inference model of a Keras model, traced once and reused for as long as the Keras model exists."""
+    with MODELS_CACHES_LOCK:
+        if model not in INFERENCE_MODELS_CACHE:
+            INFERENCE_MODELS_CACHE[model] = InferenceModel(model=model)
+        return INFERENCE_MODELS_CACHE[model]
+
+
+class QuantizedInferenceModel:
+    """
+    Run an int8 quantized model (.tflite file) with the TensorFlow Lite interpreter, with the same predict_classes() interface as InferenceModel.
+    The interpreter is not thread-safe : the predictions of several threads run one after the other.
+    """
+
+    def __init__(self, quantized_model_path: Path, n_threads: int = None):
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(quantized_model_path), num_threads=n_threads
+        )
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.interpreter_lock = threading.Lock()
+
+    def predict_classes(self, patches: np.ndarray) -> np.ndarray:
+        # the interpreter takes one patch at a time : the model is exported with a batch size of 1
+        probabilities = list()
+        with self.interpreter_lock:
+            for patch in np.asarray(patches):
+                self.interpreter.set_tensor(
+                    self.input_index, patch[np.newaxis].astype(np.float32)
+                )
+                self.interpreter.invoke()
+                probabilities.append(self.interpreter.get_tensor(self.output_index)[0])
+        probabilities = np.stack(probabilities)
+        # Remove background predictions so it takes the max on the non background classes
+        return (np.argmax(probabilities[:, :, :, 1:], axis=3) + 1).astype(np.uint8)
+
+
+def load_quantized_model(quantized_model_path: Path) -> QuantizedInferenceModel:
+    """Load a quantized model in an interpreter, once per process."""
+    cache_key = (
+        str(quantized_model_path),
+        Path(quantized_model_path).stat().st_mtime_ns,
+    )
+    with MODELS_CACHES_LOCK:
+        if cache_key not in QUANTIZED_MODELS_CACHE:
+            print(f"\nLoading the quantized model {quantized_model_path}...")
+            QUANTIZED_MODELS_CACHE[cache_key] = QuantizedInferenceModel(
+                quantized_model_path=quantized_model_path
+            )
+        return QUANTIZED_MODELS_CACHE[cache_key]
+
+
+def export_inference_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    input_shape: int,
+    encoder_kernel_size: int,
+) -> Path:
+    """
+    Export once the inference model of a checkpoint as a self-contained SavedModel, in the checkpoint folder.
+    Loading it does not need to rebuild the model in Python nor to trace it again, which shortens the time to the first prediction.
+    The exported checkpoint is recorded next to the model, so that an export older than the latest checkpoint is not used.
+
+    :return: The path of the exported model folder.
+    """
+    model = load_saved_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        input_shape=input_shape,
+        encoder_kernel_size=encoder_kernel_size,
+        use_cache=False,
+    )
+    export_dir_path = checkpoint_dir_path / EXPORTED_MODEL_DIR_NAME
+    tf.saved_model.save(
+        obj=InferenceModel(model=model), export_dir=str(export_dir_path)
+    )
+    with open(export_dir_path / EXPORTED_CHECKPOINT_FILE_NAME, "w") as file:
+        json.dump(get_checkpoint_version(checkpoint_dir_path=checkpoint_dir_path), file)
+    print(f"\nInference model successfully exported at : {export_dir_path}")
+    return export_dir_path
+
+
+def get_checkpoint_version(checkpoint_dir_path: Path) -> dict:
+    """Identify the latest checkpoint of a folder by its name and the modification time of its index file."""
+    filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
+    if filepath is None:
+        raise ValueError(f"No checkpoint found in {checkpoint_dir_path}")
+    return {
+        "checkpoint": Path(filepath).name,
+        "checkpoint_mtime": Path(f"{filepath}.index").stat().st_mtime_ns,
+    }
+
+
+def is_exported_model_up_to_date(checkpoint_dir_path: Path) -> bool:
+    """Whether the inference model exported in a checkpoint folder exists and was exported from its latest checkpoint."""
+    export_dir_path = checkpoint_dir_path / EXPORTED_MODEL_DIR_NAME
+    exported_checkpoint_path = export_dir_path / EXPORTED_CHECKPOINT_FILE_NAME
+    if (
+        not (export_dir_path / "saved_model.pb").exists()
+        or not exported_checkpoint_path.exists()
+    ):
+        return False
+    with open(exported_checkpoint_path) as file:
+        exported_checkpoint_version = json.load(file)
+    return exported_checkpoint_version == get_checkpoint_version(
+        checkpoint_dir_path=checkpoint_dir_path
+    )
+
+
+def load_inference_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    input_shape: int,
+    encoder_kernel_size: int,
+):
+    """
+    Load the inference model exported by export_inference_model() if it is up to date with the latest checkpoint,
+    or else build it from the checkpoint.
+
+    :return: An object with a predict_classes() function, taking uint8 patches and returning their uint8 classes.
+    """
+    export_dir_path = checkpoint_dir_path / EXPORTED_MODEL_DIR_NAME
+    if not is_exported_model_up_to_date(checkpoint_dir_path=checkpoint_dir_path):
+        print(
+            "\nNo exported inference model of the latest checkpoint found, the checkpoint is used."
+        )
+        return get_inference_model(
+            model=load_saved_model(
+                checkpoint_dir_path=checkpoint_dir_path,
+                n_classes=n_classes,
+                input_shape=input_shape,
+                encoder_kernel_size=encoder_kernel_size,
+            )
+        )
+
+    def load_model():
+        print("\nLoading the exported inference model...")
+        start_time = time.perf_counter()
+        inference_model = tf.saved_model.load(export_dir=str(export_dir_path))
+        print(
+            f"\nExported inference model loaded in {time.perf_counter() - start_time:.2f}s."
+        )
+        return inference_model
+
+    # keyed on the checkpoint folder like the checkpoint models, so that evict_cached_models() also evicts it
+    return get_cached_model(
+        cache_key=get_model_cache_key(
+            checkpoint_dir_path=checkpoint_dir_path,
+            exported_model_mtime=(export_dir_path / "saved_model.pb")
+            .stat()
+            .st_mtime_ns,
+        ),
+        load_model_function=load_model,
+    )
 
 
 def load_saved_model(
     checkpoint_dir_path: Path,
     n_classes: int,
     input_shape: int,
-    batch_size: int,
     encoder_kernel_size: int,
+    batch_size: int = None,
+    use_cache: bool = True,
 ):
-    print("\nLoading the model...")
-    # model = build_small_unet(n_classes, patch_size, batch_size, encoder_kernel_size)
-    model = build_small_unet(
+    """
+    Build the model and apply the saved weights to it.
+    The loaded models are kept in a process-wide cache, so that the predictions on several images only load the model once.
+    By default the graph accepts batches of any size.
+    """
+
+    def load_model() -> keras.Model:
+        print("\nLoading the model...")
+        # model = build_small_unet(n_classes, patch_size, batch_size, encoder_kernel_size)
+        model = build_small_unet(
+            n_classes=n_classes,
+            input_shape=input_shape,
+            batch_size=batch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        )
+        filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
+        model.load_weights(filepath=filepath)
+        # the warnings logs due to load_weights are here because we don't train (compile/fit) after : they disappear if we do
+        print("\nModel loaded successfully.")
+        return model
+
+    if not use_cache:
+        return load_model()
+    return get_cached_model(
+        cache_key=get_model_cache_key(
+            checkpoint_dir_path=checkpoint_dir_path,
+            n_classes=n_classes,
+            input_shape=input_shape,
+            batch_size=batch_size,
+            encoder_kernel_size=encoder_kernel_size,
+        ),
+        load_model_function=load_model,
+    )
+
+
+def warm_up_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    input_shape: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+) -> float:
+    """
+    Load the inference model the predictions use in the cache, and run its predict_classes() function once on a blank batch,
+    so that the first predictions pay neither the model loading nor the inference function tracing.
+
+    :return: The time taken by the warm-up, in seconds.
+    """
+    start_time = time.perf_counter()
+    inference_model = load_inference_model(
+        checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
         input_shape=input_shape,
-        batch_size=batch_size,
         encoder_kernel_size=encoder_kernel_size,
     )
+    inference_model.predict_classes(
+        np.zeros((batch_size, input_shape, input_shape, 3), dtype=np.uint8)
+    )
+    return time.perf_counter() - start_time
+
+
+def get_model_cache_key(checkpoint_dir_path: Path, **architecture_params) -> tuple:
+    """
+    Identify a loaded model by its checkpoint and its architecture.
+    The latest checkpoint modification time is part of the key, so that a model trained again in the same directory is reloaded.
+    """
     filepath = tf.train.latest_checkpoint(checkpoint_dir=checkpoint_dir_path)
-    model.load_weights(filepath=filepath)
-    # the warnings logs due to load_weights are here because we don't train (compile/fit) after : they disappear if we do
-    print("\nModel loaded successfully.")
+    if filepath is None:
+        raise ValueError(f"No checkpoint found in {checkpoint_dir_path}")
+    checkpoint_mtime = Path(f"{filepath}.index").stat().st_mtime_ns
+    return (
+        str(Path(checkpoint_dir_path).resolve()),
+        filepath,
+        checkpoint_mtime,
+    ) + tuple(sorted(architecture_params.items()))
+
+
+def get_cached_model(
+    cache_key: tuple, load_model_function: Callable[[], keras.Model]
+) -> keras.Model:
+    """
+    Get a model from the cache, or load it and keep it in the cache. The least recently used models are evicted beyond MODELS_CACHE_SIZE models.
+    A model is loaded out of the lock, so that the other models stay available meanwhile, and only once when several threads ask for it.
+    """
+    with MODELS_CACHES_LOCK:
+        if cache_key in LOADED_MODELS_CACHE:
+            LOADED_MODELS_CACHE.move_to_end(cache_key)
+            print("\nModel found in the loaded models cache.")
+            return LOADED_MODELS_CACHE[cache_key]
+        model_future = LOADING_MODELS_FUTURES.get(cache_key)
+        load_model_bool = model_future is None
+        if load_model_bool:
+            model_future = Future()
+            LOADING_MODELS_FUTURES[cache_key] = model_future
+    if not load_model_bool:
+        return model_future.result()
+
+    try:
+        model = load_model_function()
+    except Exception as exception:
+        with MODELS_CACHES_LOCK:
+            del LOADING_MODELS_FUTURES[cache_key]
+        model_future.set_exception(exception)
+        raise
+    with MODELS_CACHES_LOCK:
+        del LOADING_MODELS_FUTURES[cache_key]
+        LOADED_MODELS_CACHE[cache_key] = model
+        while len(LOADED_MODELS_CACHE) > MODELS_CACHE_SIZE:
+            LOADED_MODELS_CACHE.popitem(last=False)
+    model_future.set_result(model)
     return model
 
 
+def evict_cached_models(checkpoint_dir_path: Path = None) -> int:
+    """Remove the models loaded from checkpoint_dir_path from the cache, or all of them if None. Return the number of evicted models."""
+    with MODELS_CACHES_LOCK:
+        if checkpoint_dir_path is None:
+            evicted_keys = list(LOADED_MODELS_CACHE)
+        else:
+            resolved_path = str(Path(checkpoint_dir_path).resolve())
+            evicted_keys = [
+                key for key in LOADED_MODELS_CACHE if key[0] == resolved_path
+            ]
+        for key in evicted_keys:
+            del LOADED_MODELS_CACHE[key]
+    gc.collect()
+    print(f"\n{len(evicted_keys)} models evicted from the loaded models cache.")
+    return len(evicted_keys)
+
+
+class TilePredictionCache:
+    """
+    Classes of the patches already predicted, keyed by a hash of the patch pixels and of the model which predicted them.
+    Another crop of an image, on the same patches grid, only runs the model on its new patches.
+    The least recently used tiles are evicted beyond max_bytes.
+    The tiles are shared by the threads making predictions, the model running out of the lock.
+    """
+
+    def __init__(self, max_bytes: int = TILE_CACHE_SIZE_MB * 2**20):
+        self.max_bytes = max_bytes
+        # uint8 classes of the tiles, from the least to the most recently used
+        self.tiles = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_tile_key(self, tile: np.ndarray, model_fingerprint: str) -> bytes:
+        tile_hash = hashlib.blake2b(
+            f"{model_fingerprint}{tile.shape}".encode(), digest_size=16
+        )
+        tile_hash.update(np.ascontiguousarray(tile).data)
+        return tile_hash.digest()
+
+    def put(self, tile_key: bytes, classes: np.ndarray) -> None:
+        with self.lock:
+            if tile_key in self.tiles:
+                self.n_bytes -= self.tiles.pop(tile_key).nbytes
+            self.tiles[tile_key] = classes.astype(np.uint8)
+            self.n_bytes += classes.size
+            while self.n_bytes > self.max_bytes:
+                self.n_bytes -= self.tiles.popitem(last=False)[1].nbytes
+
+    def predict_classes(
+        self, patches: np.ndarray, inference_model, model_fingerprint: str
+    ) -> np.ndarray:
+        """Predict a batch of patches, running the inference model on the patches which are not in the cache only."""
+        tiles_keys = [
+            self.get_tile_key(tile=patch, model_fingerprint=model_fingerprint)
+            for patch in patches
+        ]
+        with self.lock:
+            patches_classes = [self.tiles.get(tile_key) for tile_key in tiles_keys]
+            missed_indices = [
+                idx for idx, classes in enumerate(patches_classes) if classes is None
+            ]
+            self.hits += len(tiles_keys) - len(missed_indices)
+            self.misses += len(missed_indices)
+            for tile_key, classes in zip(tiles_keys, patches_classes):
+                if classes is not None:
+                    self.tiles.move_to_end(tile_key)
+        if missed_indices:
+            missed_classes = np.asarray(
+                inference_model.predict_classes(patches[missed_indices])
+            )
+            for idx, classes in zip(missed_indices, missed_classes):
+                self.put(tile_key=tiles_keys[idx], classes=classes)
+                patches_classes[idx] = classes
+        return np.stack(patches_classes).astype(np.uint8)
+
+
+# Classes of the patches predicted in this process, used by main() if asked to
+TILE_PREDICTIONS_CACHE = TilePredictionCache()
+
+
+def get_model_fingerprint(model_path: Path, **predictions_params) -> str:
+    """Identify the predictions of a checkpoint or a quantized model, by its path and its last modification."""
+    model_path = Path(model_path)
+    if model_path.is_dir():
+        model_key = get_model_cache_key(
+            checkpoint_dir_path=model_path, **predictions_params
+        )
+    else:
+        model_key = (
+            str(model_path.resolve()),
+            model_path.stat().st_mtime_ns,
+        ) + tuple(sorted(predictions_params.items()))
+    return hashlib.blake2b(repr(model_key).encode(), digest_size=16).hexdigest()
+
+
 def build_small_unet(
     n_classes: int, input_shape: int, batch_size: int, encoder_kernel_size: int
 ) -> keras.Model:
@@ -117,3 +540,23 @@ def get_crop_shape(reference_tensor: tf.Tensor, target_tensor: tf.Tensor) -> tup
     else:
         width_crop_shape = width_difference // 2, width_difference // 2
     return height_crop_shape, width_crop_shape
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-checkpoint-dir-path",
+        type=Path,
+        required=True,
+        help="Checkpoint folder of the model to export, in which the inference model is written.",
+    )
+    parser.add_argument("--n-classes", type=int, default=9)
+    parser.add_argument("--input-shape", type=int, default=256)
+    parser.add_argument("--encoder-kernel-size", type=int, default=3)
+    args = parser.parse_args()
+    export_inference_model(
+        checkpoint_dir_path=args.model_checkpoint_dir_path,
+        n_classes=args.n_classes,
+        input_shape=args.input_shape,
+        encoder_kernel_size=args.encoder_kernel_size,
+    )
@@ -0,0 +1,132 @@
+import json
+import socket
+from pathlib import Path
+
+# Same as in the prediction_server.py module, which is not imported so that the client does not load TensorFlow
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# Time to wait for the answer of a request, in seconds
+CLIENT_TIMEOUT = 300
+
+
+class PredictionClient:
+    """
+    Send the UI requests to the prediction server started with "python -m ui_integration.prediction_server".
+    A request is a json line with a "command" key, followed by the image bytes for the images sent by value,
+    and the server answers with a json line.
+    """
+
+    def __init__(
+        self,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        timeout: float = CLIENT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send_request(self, request: dict, payload: bytes = b"") -> dict:
+        with socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        ) as connection:
+            connection.sendall(json.dumps(request).encode() + b"\n" + payload)
+            with connection.makefile("rb") as connection_file:
+                response = json.loads(connection_file.readline())
+        if "error" in response:
+            raise RuntimeError(f"The prediction server failed : {response['error']}")
+        return response
+
+    def is_server_running(self) -> bool:
+        try:
+            self.get_metrics()
+        except OSError:
+            return False
+        return True
+
+    def predict(
+        self,
+        model_checkpoint_dir_path: Path,
+        workspace_dir_path: Path,
+        image_path: Path = None,
+        image_bytes: bytes = None,
+        image_name: str = None,
+        quantized_model_path: Path = None,
+    ) -> {str: Path}:
+        """
+        Make the predictions of an image on the server, and save them like main() from the main.py module does.
+
+        :param model_checkpoint_dir_path: The path to the model checkpoint.
+        :param workspace_dir_path: Folder where to save the binary predictions.
+        :param image_path: The image on which to make predictions on, read by the server.
+        :param image_bytes: Or the png or jpeg bytes of the image, e.g. for an image which is not saved yet.
+        :param image_name: The name of the image sent by its bytes, used to name the predictions folder and masks.
+        :param quantized_model_path: Optional int8 quantized model (.tflite file), used instead of the model checkpoint.
+
+        :returns A dictionnary with key <class_name> and value <class_mask_path>.
+        """
+        assert (image_path is None) != (
+            image_bytes is None
+        ), "Give either the image path or the image bytes."
+        request = {
+            "command": "predict",
+            "model_checkpoint_dir_path": str(Path(model_checkpoint_dir_path).resolve()),
+            "workspace_dir_path": str(Path(workspace_dir_path).resolve()),
+            "quantized_model_path": None
+            if quantized_model_path is None
+            else str(Path(quantized_model_path).resolve()),
+        }
+        if image_path is not None:
+            request["image_path"] = str(Path(image_path).resolve())
+            payload = b""
+        else:
+            assert image_name is not None, "Name the image sent by its bytes."
+            request["image_name"] = image_name
+            request["image_bytes_length"] = len(image_bytes)
+            payload = image_bytes
+        response = self.send_request(request=request, payload=payload)
+        return {
+            class_name: Path(mask_path)
+            for class_name, mask_path in response["masks_paths"].items()
+        }
+
+    def get_metrics(self) -> dict:
+        """Get the requests latencies and the batches occupancy of the server, see PredictionServer.get_metrics()."""
+        return self.send_request(request={"command": "metrics"})["metrics"]
+
+    def shutdown(self) -> None:
+        self.send_request(request={"command": "shutdown"})
+
+
+def main(
+    image_path: Path,
+    model_checkpoint_dir_path: Path,
+    workspace_dir_path: Path,
+    quantized_model_path: Path = None,
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+) -> {str: Path}:
+    """
+    Same as main() from the main.py module, made by the prediction server if it is running,
+    or else in this process.
+
+    :returns A dictionnary with key <class_name> and value <class_mask_path>.
+    """
+    client = PredictionClient(host=host, port=port)
+    if client.is_server_running():
+        return client.predict(
+            model_checkpoint_dir_path=model_checkpoint_dir_path,
+            workspace_dir_path=workspace_dir_path,
+            image_path=image_path,
+            quantized_model_path=quantized_model_path,
+        )
+
+    print("\nNo prediction server running, the predictions are made in this process.")
+    from ui_integration.main import main as make_predictions_masks
+
+    return make_predictions_masks(
+        image_path=image_path,
+        model_checkpoint_dir_path=model_checkpoint_dir_path,
+        workspace_dir_path=workspace_dir_path,
+        quantized_model_path=quantized_model_path,
+    )
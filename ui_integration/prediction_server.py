@@ -0,0 +1,387 @@
+import argparse
+import json
+import socketserver
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+
+from ui_integration.main import (
+    PATCH_SIZE,
+    PATCH_OVERLAP,
+    N_CLASSES,
+    BATCH_SIZE,
+    ENCODER_KERNEL_SIZE,
+    save_predictions,
+)
+from ui_integration.model import InferenceModel
+from ui_integration.predictions_maker import (
+    load_predictions_model,
+    extract_patches_array,
+    rebuild_predictions_with_overlap,
+)
+from ui_integration.utils import decode_image, get_image_name_without_extension
+
+
+# Constants
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# Time a batch which is not full waits for the patches of other requests, in milliseconds
+BATCHING_DEADLINE_MS = 10
+# Number of the last requests and batches the metrics are computed on
+METRICS_WINDOW_SIZE = 1000
+
+
+class DynamicBatcher:
+    """
+    Run the inference model of one model on the patches of all the requests, in shared batches.
+    The patches are queued in the order of the requests, and a single thread cuts batches of batch_size patches from the queue :
+    the end of a request and the beginning of the next one share a batch, so that the model runs on full batches.
+    A batch which is not full is sent to the model after deadline_ms at the latest.
+    """
+
+    def __init__(self, inference_model, batch_size: int, deadline_ms: float):
+        """
+        :param inference_model: An object with a predict_classes() function, taking uint8 patches and returning their uint8 classes.
+        :param batch_size: Maximum number of patches per model call.
+        :param deadline_ms: Time a batch which is not full waits for more patches, in milliseconds.
+        """
+        self.inference_model = inference_model
+        self.batch_size = batch_size
+        self.deadline = deadline_ms / 1000
+        # requests whose patches are not all sent to the model yet
+        # each one is [patches, index of the next patch to send, predicted classes chunks, future]
+        self.pending_requests = deque()
+        self.n_pending_patches = 0
+        self.condition = threading.Condition()
+        self.batches_occupancies = deque(maxlen=METRICS_WINDOW_SIZE)
+        self.batcher_thread = threading.Thread(target=self.run, daemon=True)
+        self.batcher_thread.start()
+
+    def predict_classes(self, patches: np.ndarray) -> np.ndarray:
+        """
+        Predict the patches of a request, in the batches shared with the other requests.
+
+        :param patches: The uint8 patches of shape (n_patches, patch_size, patch_size, 3).
+        :return: Their uint8 classes, of shape (n_patches, patch_size, patch_size).
+        """
+        if len(patches) == 0:
+            return np.zeros((0,) + tuple(patches.shape[1:3]), dtype=np.uint8)
+        future = Future()
+        with self.condition:
+            self.pending_requests.append([patches, 0, [], future])
+            self.n_pending_patches += len(patches)
+            self.condition.notify()
+        return future.result()
+
+    def run(self) -> None:
+        while True:
+            batch_chunks, batch_owners = self.get_next_batch()
+            try:
+                batch_classes = np.asarray(
+                    self.inference_model.predict_classes(np.concatenate(batch_chunks))
+                )
+            except Exception as exception:
+                for pending_request in batch_owners:
+                    if not pending_request[3].done():
+                        pending_request[3].set_exception(exception)
+                continue
+            self.batches_occupancies.append(len(batch_classes) / self.batch_size)
+
+            chunk_start = 0
+            for chunk, pending_request in zip(batch_chunks, batch_owners):
+                pending_request[2].append(
+                    batch_classes[chunk_start : chunk_start + len(chunk)]
+                )
+                chunk_start += len(chunk)
+                patches, _, classes_chunks, future = pending_request
+                # a request whose previous batch failed has already got its exception
+                if not future.done() and sum(
+                    len(classes_chunk) for classes_chunk in classes_chunks
+                ) == len(patches):
+                    future.set_result(np.concatenate(classes_chunks))
+
+    def get_next_batch(self) -> ([np.ndarray], [list]):
+        """Wait for a full batch of patches, or for the deadline after the first one, and cut it from the pending requests."""
+        with self.condition:
+            while self.n_pending_patches == 0:
+                self.condition.wait()
+            deadline_time = time.perf_counter() + self.deadline
+            while self.n_pending_patches < self.batch_size:
+                remaining_time = deadline_time - time.perf_counter()
+                if remaining_time <= 0:
+                    break
+                self.condition.wait(timeout=remaining_time)
+
+            batch_chunks, batch_owners = list(), list()
+            n_batch_patches = 0
+            while n_batch_patches < self.batch_size and self.pending_requests:
+                pending_request = self.pending_requests[0]
+                patches, next_patch_idx = pending_request[:2]
+                chunk_end = min(
+                    next_patch_idx + self.batch_size - n_batch_patches, len(patches)
+                )
+                batch_chunks.append(patches[next_patch_idx:chunk_end])
+                batch_owners.append(pending_request)
+                n_batch_patches += chunk_end - next_patch_idx
+                pending_request[1] = chunk_end
+                if chunk_end == len(patches):
+                    self.pending_requests.popleft()
+            self.n_pending_patches -= n_batch_patches
+        return batch_chunks, batch_owners
+
+    def get_mean_occupancy(self) -> float:
+        """Get the mean ratio of the batches capacity filled with patches, over the last batches."""
+        occupancies = list(self.batches_occupancies)
+        return float(np.mean(occupancies)) if occupancies else None
+
+
+class PredictionServer(socketserver.ThreadingTCPServer):
+    """
+    Resident prediction service, keeping the models loaded and warm between the requests of the UI.
+    Each connection sends one request : a json line, followed by the image bytes if the image is not given by its path.
+    The server answers with one json line. See the prediction_client.py module for the requests format.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        deadline_ms: float = BATCHING_DEADLINE_MS,
+    ):
+        """
+        :param host: The interface to listen on, the local one by default.
+        :param port: The port to listen on.
+        :param deadline_ms: Time a batch which is not full waits for the patches of other requests, in milliseconds.
+        """
+        super().__init__((host, port), PredictionRequestHandler)
+        self.deadline_ms = deadline_ms
+        # a batcher per model, as a future resolved once the model is loaded
+        self.batchers = dict()
+        self.batchers_lock = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.requests_latencies = deque(maxlen=METRICS_WINDOW_SIZE)
+        self.n_requests = 0
+        self.n_failed_requests = 0
+
+    def get_batcher(
+        self, model_checkpoint_dir_path: Path, quantized_model_path: Path = None
+    ) -> DynamicBatcher:
+        """Get the batcher of a model, loading the model on its first request."""
+        batcher_key = (
+            str(Path(model_checkpoint_dir_path).resolve()),
+            None if quantized_model_path is None else str(quantized_model_path),
+        )
+        # the model is loaded out of the lock, so that the requests of the other models are not blocked by the loading
+        with self.batchers_lock:
+            batcher_future = self.batchers.get(batcher_key)
+            load_model_bool = batcher_future is None
+            if load_model_bool:
+                batcher_future = Future()
+                self.batchers[batcher_key] = batcher_future
+        if load_model_bool:
+            try:
+                inference_model = load_predictions_model(
+                    checkpoint_dir_path=Path(model_checkpoint_dir_path),
+                    n_classes=N_CLASSES,
+                    patch_size=PATCH_SIZE,
+                    encoder_kernel_size=ENCODER_KERNEL_SIZE,
+                    quantized_model_path=quantized_model_path,
+                )
+                # the exported and quantized models are not traced again : the inference model of a checkpoint is traced
+                # before the requests of the model are let through, so that its first request does not pay the tracing
+                if isinstance(inference_model, InferenceModel):
+                    tracing_time = inference_model.warmup()
+                    print(f"\nInference function traced in {tracing_time:.2f}s.")
+                batcher_future.set_result(
+                    DynamicBatcher(
+                        inference_model=inference_model,
+                        batch_size=BATCH_SIZE,
+                        deadline_ms=self.deadline_ms,
+                    )
+                )
+            except Exception as exception:
+                # the next request of this model loads it again
+                with self.batchers_lock:
+                    del self.batchers[batcher_key]
+                batcher_future.set_exception(exception)
+        return batcher_future.result()
+
+    def predict(
+        self,
+        image_tensor: tf.Tensor,
+        image_name: str,
+        model_checkpoint_dir_path: Path,
+        workspace_dir_path: Path,
+        quantized_model_path: Path = None,
+    ) -> {str: Path}:
+        """Make the predictions of an image with the batcher of its model, and save them like main() does."""
+        batcher = self.get_batcher(
+            model_checkpoint_dir_path=model_checkpoint_dir_path,
+            quantized_model_path=quantized_model_path,
+        )
+        patches, patches_origins = extract_patches_array(
+            image_tensor=image_tensor,
+            patch_size=PATCH_SIZE,
+            patch_overlap=PATCH_OVERLAP,
+        )
+        predictions_tensor = rebuild_predictions_with_overlap(
+            patches_classes=batcher.predict_classes(patches=patches),
+            image_tensor=image_tensor,
+            patch_size=PATCH_SIZE,
+            patch_overlap=PATCH_OVERLAP,
+        )
+        return save_predictions(
+            predictions_tensor=predictions_tensor,
+            image_name=image_name,
+            workspace_dir_path=workspace_dir_path,
+        )
+
+    def record_request(self, latency: float = None) -> None:
+        """Count a request, with its latency in seconds, or None if it failed."""
+        with self.metrics_lock:
+            if latency is None:
+                self.n_failed_requests += 1
+            else:
+                self.n_requests += 1
+                self.requests_latencies.append(latency)
+
+    def get_metrics(self) -> dict:
+        """Get the requests latencies, in seconds, and the batches occupancy of each loaded model, over the last requests."""
+        # the counts and the latencies window are read together
+        with self.metrics_lock:
+            latencies = list(self.requests_latencies)
+            n_requests = self.n_requests
+            n_failed_requests = self.n_failed_requests
+        with self.batchers_lock:
+            # the models still loading have no batches yet
+            batchers = {
+                batcher_key: batcher_future.result()
+                for batcher_key, batcher_future in self.batchers.items()
+                if batcher_future.done()
+            }
+        return {
+            "n_requests": n_requests,
+            "n_failed_requests": n_failed_requests,
+            "mean_latency": float(np.mean(latencies)) if latencies else None,
+            "p50_latency": float(np.percentile(latencies, 50)) if latencies else None,
+            "p95_latency": float(np.percentile(latencies, 95)) if latencies else None,
+            "models": [
+                {
+                    "model_checkpoint_dir_path": checkpoint_dir_path,
+                    "quantized_model_path": quantized_model_path,
+                    "n_batches": len(batcher.batches_occupancies),
+                    "mean_batch_occupancy": batcher.get_mean_occupancy(),
+                }
+                for (
+                    checkpoint_dir_path,
+                    quantized_model_path,
+                ), batcher in batchers.items()
+            ],
+        }
+
+
+class PredictionRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        start_time = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            if request["command"] == "predict":
+                response = {"masks_paths": self.handle_predict(request=request)}
+                self.server.record_request(latency=time.perf_counter() - start_time)
+            elif request["command"] == "metrics":
+                response = {"metrics": self.server.get_metrics()}
+            elif request["command"] == "shutdown":
+                response = {"shutdown": True}
+                # shutdown() waits for the serving loop, which runs in another thread
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                raise ValueError(f"Command {request['command']} is unknown.")
+        except Exception as exception:
+            self.server.record_request(latency=None)
+            print(f"\nRequest failed : {exception!r}")
+            response = {"error": repr(exception)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+    def handle_predict(self, request: dict) -> {str: str}:
+        if "image_path" in request:
+            image_path = Path(request["image_path"])
+            image_tensor = decode_image(file_path=image_path)
+            image_name = get_image_name_without_extension(image_path)
+        else:
+            image_bytes = self.rfile.read(request["image_bytes_length"])
+            image_tensor = tf.io.decode_image(
+                image_bytes, channels=3, expand_animations=False
+            )
+            image_name = request["image_name"]
+        masks_paths = self.server.predict(
+            image_tensor=image_tensor,
+            image_name=image_name,
+            model_checkpoint_dir_path=Path(request["model_checkpoint_dir_path"]),
+            workspace_dir_path=Path(request["workspace_dir_path"]),
+            quantized_model_path=None
+            if request.get("quantized_model_path") is None
+            else Path(request["quantized_model_path"]),
+        )
+        return {class_name: str(path) for class_name, path in masks_paths.items()}
+
+
+def serve(
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    deadline_ms: float = BATCHING_DEADLINE_MS,
+    model_checkpoint_dir_path: Path = None,
+    quantized_model_path: Path = None,
+) -> None:
+    """
+    Run the prediction server until it is shut down.
+
+    :param host: The interface to listen on.
+    :param port: The port to listen on.
+    :param deadline_ms: Time a batch which is not full waits for the patches of other requests, in milliseconds.
+    :param model_checkpoint_dir_path: A model to load before the first request, if any.
+    :param quantized_model_path: Optional int8 quantized model (.tflite file), used instead of the model checkpoint.
+    """
+    with PredictionServer(host=host, port=port, deadline_ms=deadline_ms) as server:
+        if model_checkpoint_dir_path is not None:
+            # the model is loaded and warmed up before the first request
+            server.get_batcher(
+                model_checkpoint_dir_path=model_checkpoint_dir_path,
+                quantized_model_path=quantized_model_path,
+            )
+        print(f"\nPrediction server listening on {host}:{port}.")
+        server.serve_forever()
+    print("\nPrediction server shut down.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--deadline-ms",
+        type=float,
+        default=BATCHING_DEADLINE_MS,
+        help="Time a batch which is not full waits for more patches.",
+    )
+    parser.add_argument(
+        "--model-checkpoint-dir-path",
+        type=Path,
+        default=None,
+        help="Model to load and warm up before the first request.",
+    )
+    parser.add_argument("--quantized-model-path", type=Path, default=None)
+    args = parser.parse_args()
+    serve(
+        host=args.host,
+        port=args.port,
+        deadline_ms=args.deadline_ms,
+        model_checkpoint_dir_path=args.model_checkpoint_dir_path,
+        quantized_model_path=args.quantized_model_path,
+    )
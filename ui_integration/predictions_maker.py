@@ -1,15 +1,29 @@
+import threading
 import numpy as np
 import tensorflow as tf
 from pathlib import Path
-
-from ui_integration.model import load_saved_model
+from typing import Iterator
+
+from ui_integration.model import (
+    load_inference_model,
+    get_inference_model,
+    load_quantized_model,
+    get_model_fingerprint,
+    TilePredictionCache,
+)
 from ui_integration.utils import (
     decode_image,
     get_image_tensor_shape,
     get_image_name_without_extension,
+    traced,
 )
 
 
+class PredictionsCancelledError(Exception):
+    """Raised between two batches of patches when the predictions of an image are cancelled."""
+
+
+@traced("make_predictions")
 def make_predictions(
     target_image_path: Path,
     checkpoint_dir_path: Path,
@@ -19,6 +33,10 @@ def make_predictions(
     batch_size: int,
     encoder_kernel_size: int,
     misclassification_size: int = 5,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    quantized_model_path: Path = None,
+    tile_cache: TilePredictionCache = None,
+    cancel_event: threading.Event = None,
 ) -> tf.Tensor:
     """
     Make predictions on the target image specified with its path.
@@ -29,10 +47,14 @@ def make_predictions(
     :param patch_size: Size of the patches on which the model was trained. This is also the size of the predictions patches.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param n_classes: Number of classes to map, background excluded.
-    :param batch_size: Batch size that was used for the model which is loaded.
+    :param batch_size: Batch size that was used for the model which is loaded. Also the number of patches predicted per model step.
     :param correlate_predictions_bool: Whether or not to apply correlation on the predictions, i.e. make a local weighted mean on each class probability.
     :param correlation_filter: The filter to use for correlation.
     :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+    :param quantized_model_path: Path of an int8 quantized model (.tflite file), to use instead of the checkpoint.
+    :param tile_cache: A cache of the patches classes, so that the patches already predicted by the same model are not predicted again.
+    :param cancel_event: An event which, once set, stops the predictions before the next batch of patches with a PredictionsCancelledError.
 
     :return: A 2D categorical tensor of size (width, height), width and height being the cropped size of the target image tensor
     """
@@ -45,47 +67,43 @@ def make_predictions(
 
     # Cut the image into patches of size patch_size
     # & format the image patches to feed the model.predict function
-    (
-        main_patches_dataset,
-        right_side_patches_dataset,
-        down_side_patches_dataset,
-    ) = build_predictions_dataset(
+    predictions_dataset, patches_origins = build_predictions_dataset(
         target_image_tensor=image_tensor,
         patch_size=patch_size,
         patch_overlap=patch_overlap,
+        batch_size=batch_size,
+        prefetch_buffer_size=prefetch_buffer_size,
     )
 
     # Build the model
     # & apply saved weights to the built model
-    model = load_saved_model(
+    model = load_predictions_model(
         checkpoint_dir_path=checkpoint_dir_path,
         n_classes=n_classes,
-        input_shape=patch_size,
-        batch_size=batch_size,
+        patch_size=patch_size,
         encoder_kernel_size=encoder_kernel_size,
+        quantized_model_path=quantized_model_path,
     )
 
-    # Make predictions on the patches
-    # output : array of shape (n_patches, patch_size, patch_size, n_classes)
-    main_patch_classes_list = patches_predict(
-        predictions_dataset=main_patches_dataset,
-        model=model,
-    )
-    right_side_patch_classes_list = patches_predict(
-        predictions_dataset=right_side_patches_dataset,
-        model=model,
-    )
-    down_side_patch_classes_list = patches_predict(
-        predictions_dataset=down_side_patches_dataset,
+    # Make predictions on all the patches at once
+    # output : array of shape (n_patches, patch_size, patch_size)
+    patches_classes = patches_predict(
+        predictions_dataset=predictions_dataset,
         model=model,
+        tile_cache=tile_cache,
+        cancel_event=cancel_event,
+        model_fingerprint=None
+        if tile_cache is None
+        else get_model_fingerprint(
+            model_path=quantized_model_path or checkpoint_dir_path,
+            input_shape=patch_size,
+        ),
     )
 
     # Rebuild the image with the predictions patches
     # output tensor of size (intput_width_size - 2 * patch_overlap, input_height_size - 2 * patch_overlap)
     final_predictions_tensor = rebuild_predictions_with_overlap(
-        main_patch_classes_list=main_patch_classes_list,
-        right_side_patch_classes_list=right_side_patch_classes_list,
-        down_side_patch_classes_list=down_side_patch_classes_list,
+        patches_classes=patches_classes,
         image_tensor=image_tensor,
         patch_size=patch_size,
         patch_overlap=patch_overlap,
@@ -99,192 +117,359 @@ def make_predictions(
     return final_predictions_tensor
 
 
+def make_predictions_on_region(
+    target_image_path: Path,
+    checkpoint_dir_path: Path,
+    predictions_array: np.ndarray,
+    changed_region: (int, int, int, int),
+    patch_size: int,
+    patch_overlap: int,
+    n_classes: int,
+    batch_size: int,
+    encoder_kernel_size: int,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    quantized_model_path: Path = None,
+    tile_cache: TilePredictionCache = None,
+) -> (int, int, int, int):
+    """
+    Update the predictions of an image after a part of it was edited : only the patches containing changed pixels are predicted again,
+    and their interiors are pasted in the existing predictions, in place.
+    The other patches see the same pixels as before, so their predictions do not change.
+
+    :param target_image_path: The edited image, of the same size as before.
+    :param checkpoint_dir_path: Path of the already trained model.
+    :param predictions_array: The predictions of the image before the edit, as given by make_predictions(). Updated in place.
+    :param changed_region: The (row start, row end, column start, column end) bounds of the edited pixels, in the image.
+    :param patch_size: Size of the patches on which the model was trained.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :param n_classes: Number of classes to map, background excluded.
+    :param batch_size: Batch size that was used for the model which is loaded.
+    :param encoder_kernel_size: Size of the kernel encoder.
+    :param prefetch_buffer_size: Number of patches batches prepared in advance while the model is predicting.
+    :param quantized_model_path: Path of an int8 quantized model (.tflite file), to use instead of the checkpoint.
+    :param tile_cache: A cache of the patches classes.
+
+    :return: The (row start, row end, column start, column end) bounds of the updated predictions, empty if no patch was touched.
+    """
+    image_array = np.asarray(decode_image(file_path=target_image_path))
+    image_height, image_width = image_array.shape[:2]
+    assert predictions_array.shape == (
+        image_height - patch_overlap,
+        image_width - patch_overlap,
+    ), f"Predictions of shape {predictions_array.shape} do not match the image of size {image_height}x{image_width}."
+
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    patches_interior_bounds = get_patches_interior_bounds(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    # the patches containing at least one changed pixel
+    row_start, row_end, column_start, column_end = changed_region
+    touched_patches = (
+        (patches_origins[:, 0] < row_end)
+        & (patches_origins[:, 0] + patch_size > row_start)
+        & (patches_origins[:, 1] < column_end)
+        & (patches_origins[:, 1] + patch_size > column_start)
+    )
+    print(
+        f"\n{np.sum(touched_patches)} of {len(touched_patches)} patches touched by the edit."
+    )
+    if not np.any(touched_patches):
+        return 0, 0, 0, 0
+
+    touched_origins = patches_origins[touched_patches]
+    touched_bounds = patches_interior_bounds[touched_patches]
+    touched_dataset = (
+        tf.data.Dataset.from_tensor_slices(
+            get_patches_view(image_array=image_array, patch_size=patch_size)[
+                touched_origins[:, 0], touched_origins[:, 1]
+            ]
+        )
+        .batch(batch_size=batch_size, drop_remainder=False)
+        .prefetch(buffer_size=prefetch_buffer_size)
+    )
+    model = load_predictions_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        patch_size=patch_size,
+        encoder_kernel_size=encoder_kernel_size,
+        quantized_model_path=quantized_model_path,
+    )
+    paste_patches_interiors(
+        output=predictions_array,
+        patches=patches_predict(
+            predictions_dataset=touched_dataset,
+            model=model,
+            tile_cache=tile_cache,
+            model_fingerprint=None
+            if tile_cache is None
+            else get_model_fingerprint(
+                model_path=quantized_model_path or checkpoint_dir_path,
+                input_shape=patch_size,
+            ),
+        ),
+        patches_origins=touched_origins,
+        patches_interior_bounds=touched_bounds,
+        patch_overlap=patch_overlap,
+    )
+
+    return (
+        int(touched_bounds[:, 0].min()),
+        int(touched_bounds[:, 1].max()),
+        int(touched_bounds[:, 2].min()),
+        int(touched_bounds[:, 3].max()),
+    )
+
+
+def load_predictions_model(
+    checkpoint_dir_path: Path,
+    n_classes: int,
+    patch_size: int,
+    encoder_kernel_size: int,
+    quantized_model_path: Path = None,
+):
+    """Load the quantized model if any, or else the exported inference model of the checkpoint."""
+    if quantized_model_path is not None:
+        return load_quantized_model(quantized_model_path=quantized_model_path)
+    return load_inference_model(
+        checkpoint_dir_path=checkpoint_dir_path,
+        n_classes=n_classes,
+        input_shape=patch_size,
+        encoder_kernel_size=encoder_kernel_size,
+    )
+
+
+@traced("build_dataset")
 def build_predictions_dataset(
-    target_image_tensor: tf.Tensor, patch_size: int, patch_overlap: int
-) -> (tf.data.Dataset, tf.data.Dataset, tf.data.Dataset):
+    target_image_tensor: tf.Tensor,
+    patch_size: int,
+    patch_overlap: int,
+    batch_size: int,
+    prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+) -> (tf.data.Dataset, np.ndarray):
     """
-    Build a dataset of patches to make predictions on each one of them.
+    Build a single dataset of patches to make predictions on each one of them.
+    The main, right side and down side patches are merged in one stream of batches,
+    so that the model is only called once per image.
 
     :param target_image_tensor: Image to make predictions on.
     :param patch_size: Size of the patch.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
-    :return: A Dataset object with tensors of size (1, patch_size, patch_size, 3). Its length corresponds of the number of patches generated.
+    :param batch_size: Number of patches per batch fed to the model.
+    :param prefetch_buffer_size: Number of batches prepared in advance while the model is predicting.
+    :return: A Dataset object with tensors of size (batch_size, patch_size, patch_size, 3),
+    and the (n_patches, 2) array of the patches origins, in the order of the dataset.
     """
     print("\nSlice the image into patches...")
-    (
-        main_patches_tensors_list,
-        right_side_patches_tensors_list,
-        down_side_patches_tensors_list,
-    ) = extract_patches(
+    patches, patches_origins = extract_patches_array(
         image_tensor=target_image_tensor,
         patch_size=patch_size,
         patch_overlap=patch_overlap,
     )
-    prediction_dataset = tf.data.Dataset.from_tensor_slices(main_patches_tensors_list)
-    prediction_dataset = prediction_dataset.batch(batch_size=1, drop_remainder=True)
 
-    right_side_prediction_dataset = tf.data.Dataset.from_tensor_slices(
-        right_side_patches_tensors_list
-    )
-    right_side_prediction_dataset = right_side_prediction_dataset.batch(
-        batch_size=1, drop_remainder=True
-    )
+    prediction_dataset = tf.data.Dataset.from_tensor_slices(patches)
+    # the remainder is kept : every patch is needed to rebuild the image
+    prediction_dataset = prediction_dataset.batch(
+        batch_size=batch_size, drop_remainder=False
+    ).prefetch(buffer_size=prefetch_buffer_size)
 
-    down_side_prediction_dataset = tf.data.Dataset.from_tensor_slices(
-        down_side_patches_tensors_list
-    )
-    down_side_prediction_dataset = down_side_prediction_dataset.batch(
-        batch_size=1, drop_remainder=True
-    )
+    print(f"\n{len(patches)} patches created successfully.")
 
-    print(f"\n{len(prediction_dataset)} patches created successfully.")
-    print(
-        f"\n{len(right_side_prediction_dataset)} right side patches created successfully."
+    return prediction_dataset, patches_origins
+
+
+def get_patches_grid_shape(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> (int, int):
+    """
+    Get the number of main patches rows and columns by which an image is cut.
+
+    :param image_height: Height of the image.
+    :param image_width: Width of the image.
+    :param patch_size: Size of the patch.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: The number of vertical and horizontal main patches.
+    """
+    window_stride = (
+        patch_size - patch_overlap
+    )  # number of pixels by which we shift the window at each step of predictions
+    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
+    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
+    return n_vertical_patches, n_horizontal_patches
+
+
+def get_patches_origins(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> np.ndarray:
+    """
+    Get the top-left corner of every patch cut from an image.
+
+    The patches form a grid of (n_vertical_patches + 1) rows and (n_horizontal_patches + 1) columns,
+    listed in row-major order : the last column holds the right side patches, the last row holds
+    the down side patches, and the last patch is the down-right corner.
+
+    :param image_height: Height of the image.
+    :param image_width: Width of the image.
+    :param patch_size: Size of the patch.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: An array of shape (n_patches, 2) with the (row, column) origin of each patch.
+    """
+    assert (
+        patch_size <= image_height and patch_size <= image_width
+    ), f"Patch size {patch_size} is bigger than the image size {image_height}x{image_width}."
+    window_stride = patch_size - patch_overlap
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
     )
-    print(
-        f"\n{len(down_side_prediction_dataset)} down side patches created successfully."
+    rows_origins = np.append(
+        np.arange(n_vertical_patches) * window_stride, image_height - patch_size
     )
-
-    return (
-        prediction_dataset,
-        right_side_prediction_dataset,
-        down_side_prediction_dataset,
+    columns_origins = np.append(
+        np.arange(n_horizontal_patches) * window_stride, image_width - patch_size
     )
+    patches_origins = np.stack(
+        np.meshgrid(rows_origins, columns_origins, indexing="ij"), axis=-1
+    ).reshape(-1, 2)
+    return patches_origins
+
+
+def get_patches_view(image_array: np.ndarray, patch_size: int) -> np.ndarray:
+    """
+    Get a zero-copy view of all the patches of size patch_size contained in the image.
+
+    :param image_array: An image array of shape (height, width, channels).
+    :param patch_size: Size of the patch.
+    :return: A read-only view of shape (height - patch_size + 1, width - patch_size + 1, patch_size, patch_size, channels),
+    where view[row, column] is the patch whose top-left corner is (row, column).
+    """
+    return np.lib.stride_tricks.sliding_window_view(
+        x=image_array, window_shape=(patch_size, patch_size), axis=(0, 1)
+    ).transpose(0, 1, 3, 4, 2)
 
 
-def extract_patches(
+@traced("extract_patches")
+def extract_patches_array(
     image_tensor: tf.Tensor,
     patch_size: int,
     patch_overlap: int,
     with_four_channels: bool = False,
-) -> [tf.Tensor]:
+) -> (np.ndarray, np.ndarray):
     """
-    Split an image into smaller patches.
+    Split an image into overlapping patches, in one vectorized pass.
     Padding is by default implemented as "VALID", meaning that only patches which are fully
     contained in the input image are included.
 
-    :param image_tensor: Path of the image we want to cut into patches.
+    The patches are gathered from a strided view of the decoded image,
+    so that the only allocation is the output array itself.
+
+    :param image_tensor: The image tensor we want to cut into patches.
     :param patch_size: Size of the patch.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param with_four_channels: Set it to True if the image is a PNG. Default to False for JPEG.
-    :return: A list of patches of the original image.
+    :return: An array of shape (n_patches, patch_size, patch_size, 3) and the (n_patches, 2) array of their origins,
+    in the order given by get_patches_origins().
     """
-    image_tensor = tf.expand_dims(image_tensor, 0)
+    image_array = np.asarray(image_tensor)
     # if the image is a png, drop the brightness channel
     if with_four_channels:
-        image_tensor = image_tensor[:, :, :, :3]
+        image_array = image_array[:, :, :3]
 
-    image_height, image_width, channels_number = get_image_tensor_shape(
-        image_tensor=image_tensor
+    image_height, image_width = image_array.shape[:2]
+    patches_origins = get_patches_origins(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
     )
-    window_stride = (
-        patch_size - patch_overlap
-    )  # number of pixels by which we shift the window at each step of predictions
+    patches_view = get_patches_view(image_array=image_array, patch_size=patch_size)
+    patches = patches_view[patches_origins[:, 0], patches_origins[:, 1]]
 
-    main_patches = list()
-    right_side_patches = list()
-    row_idx = 0
-    while row_idx + patch_size <= image_height:
-        column_idx = 0
-        while column_idx + patch_size <= image_width:
-            patch = image_tensor[
-                :,
-                row_idx : row_idx
-                + patch_size,  # max bound  index is row_idx + patch_size - 1
-                column_idx : column_idx
-                + patch_size,  # max bound index is column_idx + patch_size - 1
-                :,
-            ]
-            main_patches.append(patch[0])
-            column_idx += window_stride
-
-        # extract right side patches
-        down_right_side_patch = image_tensor[
-            :, row_idx : row_idx + patch_size, image_width - patch_size : image_width, :
-        ]
-        right_side_patches.append(down_right_side_patch[0])
-
-        row_idx += window_stride
-
-    # extract down side patches
-    down_side_patches = list()
-    column_idx = 0
-    while column_idx + patch_size <= image_width:
-        down_side_patch = image_tensor[
-            :,
-            image_height - patch_size : image_height,
-            column_idx : column_idx + patch_size,
-            :,
-        ]
-        down_side_patches.append(down_side_patch[0])
-        column_idx += window_stride
-
-    # down-right corner
-    down_right_side_patch = image_tensor[
-        :,
-        image_height - patch_size : image_height,
-        image_width - patch_size : image_width,
-        :,
-    ]
-    right_side_patches.append(down_right_side_patch[0])
-
-    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
-    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
-    assert n_vertical_patches * n_horizontal_patches == len(
-        main_patches
-    ), f"The number of main patches is not the same : original image of size {image_height}x{image_width} should have {n_horizontal_patches * n_vertical_patches} but we have {len(main_patches)} "
-    assert (n_vertical_patches + 1) == len(
-        right_side_patches
-    ), f"The number of right side patches is not the same : is {len(right_side_patches)}, should be {n_vertical_patches + 1}"
-    assert n_horizontal_patches == len(
-        down_side_patches
-    ), f"The number of right side patches is not the same : is {len(down_side_patches)}, should be {n_horizontal_patches}"
-
-    return main_patches, right_side_patches, down_side_patches
+    return patches, patches_origins
 
 
+@traced("predict")
 def patches_predict(
     predictions_dataset: tf.data.Dataset,
     model: tf.keras.Model,
-) -> [tf.Tensor]:
-    predictions: np.ndarray = model.predict(x=predictions_dataset, verbose=1)
-
-    # Remove background predictions so it takes the max on the non background classes
-    # Note : the argmax function shift the classes numbers of -1, that is why we add one just after
-    patch_classes_list = list(np.argmax(predictions[:, :, :, 1:], axis=3))
-    patch_classes_list = [
-        tf.constant(
-            np.add(patch_classes, np.ones(patch_classes.shape, dtype=np.int32)),
-            dtype=tf.int32,
+    tile_cache: TilePredictionCache = None,
+    model_fingerprint: str = None,
+    cancel_event: threading.Event = None,
+) -> np.ndarray:
+    if isinstance(model, tf.keras.Model):
+        inference_model = get_inference_model(model=model)
+    else:
+        # the model is already an inference model : exported, quantized or wrapped
+        inference_model = model
+    # Only the uint8 classes are sent back from the model, one batch at a time
+    if tile_cache is None:
+        patches_classes = np.concatenate(
+            [
+                np.asarray(inference_model.predict_classes(patches_batch))
+                for patches_batch in iterate_batches(
+                    predictions_dataset=predictions_dataset, cancel_event=cancel_event
+                )
+            ]
         )
-        for patch_classes in patch_classes_list
-    ]
-    # Tensors classes list is of size n_patches of tensor with size (patch_size, patch_size)
+    else:
+        patches_classes = np.concatenate(
+            [
+                tile_cache.predict_classes(
+                    patches=np.asarray(patches_batch),
+                    inference_model=inference_model,
+                    model_fingerprint=model_fingerprint,
+                )
+                for patches_batch in iterate_batches(
+                    predictions_dataset=predictions_dataset, cancel_event=cancel_event
+                )
+            ]
+        )
+        print(
+            f"\nTile cache : {tile_cache.hits} hits, {tile_cache.misses} misses, "
+            f"{len(tile_cache.tiles)} tiles in {tile_cache.n_bytes / 2 ** 20:.1f} MB."
+        )
+    # Classes array is of size (n_patches, patch_size, patch_size)
+
+    return patches_classes
 
-    return patch_classes_list
 
+def iterate_batches(
+    predictions_dataset: tf.data.Dataset, cancel_event: threading.Event = None
+) -> Iterator[tf.Tensor]:
+    """Iterate over the batches of the dataset, and raise a PredictionsCancelledError before the next one once cancel_event is set."""
+    for patches_batch in predictions_dataset:
+        if cancel_event is not None and cancel_event.is_set():
+            raise PredictionsCancelledError("The predictions were cancelled.")
+        yield patches_batch
 
+
+@traced("stitch")
 def rebuild_predictions_with_overlap(
-    main_patch_classes_list: [tf.Tensor],
-    right_side_patch_classes_list: [tf.Tensor],
-    down_side_patch_classes_list: [tf.Tensor],
+    patches_classes: np.ndarray,
     image_tensor: tf.Tensor,
     patch_size: int,
     patch_overlap: int,
     misclassification_size: int = 5,
 ) -> tf.Tensor:
     """
-    Restructure the patches that were generated with the extract_patches_with_overlap() function.
-    Warning : This function is strongly coupled with the function extract_patches() from the patches_generator.py module
+    Restructure the patches that were generated with the extract_patches_array() function.
+    Warning : This function is strongly coupled with the function extract_patches_array()
 
-    :param down_side_patch_classes_list:
-    :param main_patch_classes_list: List with size n_patches of tensor with size (patch_size, patch_size)
-    :param right_side_patch_classes_list:
-    :param image_tensor:
+    :param patches_classes: Array of shape (n_patches, patch_size, patch_size), in the order of the patches origins.
+    :param image_tensor: The image the patches were cut from.
     :param patch_size: Size of the patches.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
     :param misclassification_size: Estimated number of pixels on which the classification is wrong due to side effects between neighbors patches.
-    :return: The rebuilt image tensor with dimension : [width, height, 1].
+    :return: The rebuilt image tensor with dimension : [width, height].
     """
     assert (
         patch_overlap % 2 == 0
@@ -293,199 +478,188 @@ def rebuild_predictions_with_overlap(
         misclassification_size <= patch_overlap / 2
     ), f"Please increase the patch overlap (currently {patch_overlap}) to at least 2 times the misclassification size (currently {misclassification_size})."
 
-    # Turns the patches in the list to a size of (patch_size, patch_size, 1)
-    main_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in main_patch_classes_list
-    ]
-
-    right_side_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in right_side_patch_classes_list
-    ]
-
-    down_side_patch_classes_list = [
-        tf.expand_dims(input=patch_classes, axis=2)
-        for patch_classes in down_side_patch_classes_list
-    ]
-
-    # Counting the number of main patches by which the image has been cut
     image_height, image_width, channels_number = get_image_tensor_shape(
         image_tensor=image_tensor
     )
 
-    window_stride = (
-        patch_size - patch_overlap
-    )  # number of pixels by which we shift the window at each step of predictions
-    n_vertical_patches = (image_height - 2 * int(patch_overlap / 2)) // window_stride
-    n_horizontal_patches = (image_width - 2 * int(patch_overlap / 2)) // window_stride
-
     print("\nRebuilding predictions patches...")
-    for row_number in range(n_vertical_patches):
-        for column_number in range(n_horizontal_patches):
-            # Rebuild the line
-            patch_number = row_number * n_horizontal_patches + column_number
-            patch_tensor = main_patch_classes_list[patch_number]
-
-            # cropping the patch by taking into account the overlap with which it was built
-            cropped_patch_tensor = crop_patch_tensor(
-                patch_tensor=patch_tensor, patch_overlap=patch_overlap
-            )
-            if column_number == 0:
-                line_rebuilt_tensor = cropped_patch_tensor
-            else:
-                line_rebuilt_tensor = tf.concat(
-                    [line_rebuilt_tensor, cropped_patch_tensor], axis=1
-                )
-
-        # first add the right side patches to extend the right side
-        right_side_patch_tensor = right_side_patch_classes_list[row_number]
-        cropped_right_side_patch_tensor = crop_patch_tensor(
-            patch_tensor=right_side_patch_tensor, patch_overlap=patch_overlap
-        )
-        left_bound_limit_idx = (
-            n_horizontal_patches * window_stride + int(patch_overlap / 2)
-        ) - (image_width - patch_size + int(patch_overlap / 2))
-        resized_cropped_right_side_patch_tensor = cropped_right_side_patch_tensor[
-            :, left_bound_limit_idx:
-        ]
-        line_rebuilt_tensor = tf.concat(
-            [line_rebuilt_tensor, resized_cropped_right_side_patch_tensor], axis=1
-        )
-
-        if row_number == 0:
-            rebuilt_tensor = line_rebuilt_tensor
-        else:
-            rebuilt_tensor = tf.concat([rebuilt_tensor, line_rebuilt_tensor], axis=0)
-
-    # finally add the down side patches to extend the image bottom
-    for column_number in range(n_horizontal_patches):
-        down_side_patch_tensor = down_side_patch_classes_list[column_number]
-
-        # cropping the patch by taking into account the overlap with which it was built
-        cropped_down_side_patch_tensor = crop_patch_tensor(
-            patch_tensor=down_side_patch_tensor, patch_overlap=patch_overlap
-        )
-        up_bound_limit_idx = (
-            n_vertical_patches * window_stride + int(patch_overlap / 2)
-        ) - (image_height - patch_size + int(patch_overlap / 2))
-        resized_cropped_down_side_patch_tensor = cropped_down_side_patch_tensor[
-            up_bound_limit_idx:, :
-        ]
+    rebuilt_array = stitch_patches(
+        patches=patches_classes,
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
 
-        if column_number == 0:
-            line_rebuilt_tensor = resized_cropped_down_side_patch_tensor
-        else:
-            line_rebuilt_tensor = tf.concat(
-                [line_rebuilt_tensor, resized_cropped_down_side_patch_tensor], axis=1
-            )
-    # add the right-down corner patch
-    down_right_side_patch_tensor = right_side_patch_classes_list[n_vertical_patches]
-    cropped_down_right_side_patch_tensor = crop_patch_tensor(
-        patch_tensor=down_right_side_patch_tensor, patch_overlap=patch_overlap
-    )
-    left_bound_limit_idx = (
-        n_horizontal_patches * window_stride + int(patch_overlap / 2)
-    ) - (image_width - patch_size + int(patch_overlap / 2))
-    up_bound_limit_idx = (
-        n_vertical_patches * window_stride + int(patch_overlap / 2)
-    ) - (image_height - patch_size + int(patch_overlap / 2))
-    resized_cropped_down_right_side_patch_tensor = cropped_down_right_side_patch_tensor[
-        up_bound_limit_idx:, left_bound_limit_idx:
-    ]
-    line_rebuilt_tensor = tf.concat(
-        [line_rebuilt_tensor, resized_cropped_down_right_side_patch_tensor], axis=1
-    )
-
-    rebuilt_tensor = tf.concat([rebuilt_tensor, line_rebuilt_tensor], axis=0)
-
-    # Check that the final size is consistent
-    (
-        rebuilt_tensor_height,
-        rebuilt_tensor_width,
-        rebuilt_channels_number,
-    ) = get_image_tensor_shape(image_tensor=rebuilt_tensor)
-    assert rebuilt_tensor_height == (
-        int(image_height - 2 * (patch_overlap / 2))
-    ), f"Number of rows is not consistent : got {rebuilt_tensor_height}, expected {int(image_height - 2 * (patch_overlap / 2))}"
-    assert rebuilt_tensor_width == (
-        int(image_width - 2 * (patch_overlap / 2))
-    ), f"Number of columns is not consistent : got {rebuilt_tensor_width}, expected {int(image_width - 2 * (patch_overlap / 2))}"
-
-    rebuilt_tensor = tf.squeeze(input=rebuilt_tensor)
+    rebuilt_tensor = tf.constant(rebuilt_array.astype(np.int32))
     print(
         f"\nImage predictions have been successfully built with size {rebuilt_tensor.shape} (original image size : {image_tensor.shape})."
     )
     return rebuilt_tensor
 
 
-def crop_patch_tensor(
-    patch_tensor: tf.Tensor,
+def stitch_patches(
+    patches: np.ndarray,
+    image_height: int,
+    image_width: int,
+    patch_size: int,
     patch_overlap: int,
-) -> tf.Tensor:
+) -> np.ndarray:
     """
-
-    :param patch_tensor: A tensor of size (x, y).
+    Rebuild an image from its overlapping patches, in one vectorized pass.
+    The output is allocated once, and only the valid interior of each patch is written in it,
+    i.e. the patch cropped by patch_overlap / 2 pixels on each side.
+    Warning : This function is strongly coupled with the function get_patches_origins()
+
+    :param patches: An array of shape (n_patches, patch_size, patch_size, ...), in the get_patches_origins() order.
+    :param image_height: Height of the image the patches were cut from.
+    :param image_width: Width of the image the patches were cut from.
+    :param patch_size: Size of the patches.
     :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
-    :return: A cropped tensor of size (x - patch_overlap, y - patch_overlap).
+    :return: The rebuilt array of shape (image_height - patch_overlap, image_width - patch_overlap, ...).
     """
     assert (
         patch_overlap % 2 == 0
     ), f"Patch overlap argument must be a pair number. The one specified was {patch_overlap}."
-
-    image_height, image_width, channels_number = get_image_tensor_shape(
-        image_tensor=patch_tensor
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
+    )
+    assert patches.shape[0] == (n_vertical_patches + 1) * (
+        n_horizontal_patches + 1
+    ), f"Got {patches.shape[0]} patches, expected {(n_vertical_patches + 1) * (n_horizontal_patches + 1)} for an image of size {image_height}x{image_width}."
+
+    extra_shape = patches.shape[3:]
+    patches_grid = patches.reshape(
+        (n_vertical_patches + 1, n_horizontal_patches + 1, patch_size, patch_size)
+        + extra_shape
     )
-    target_width = int(image_width - 2 * (patch_overlap / 2))
-    target_height = int(image_height - 2 * (patch_overlap / 2))
 
-    patch_tensor = crop_tensor(
-        tensor=patch_tensor, target_height=target_height, target_width=target_width
+    window_stride = patch_size - patch_overlap
+    interior_start = patch_overlap // 2
+    interior_end = patch_size - patch_overlap // 2
+    output_height = image_height - patch_overlap
+    output_width = image_width - patch_overlap
+    main_height = n_vertical_patches * window_stride
+    main_width = n_horizontal_patches * window_stride
+    # the down side and right side patches only fill what the main patches do not cover
+    down_side_height = output_height - main_height
+    right_side_width = output_width - main_width
+
+    output = np.empty((output_height, output_width) + extra_shape, dtype=patches.dtype)
+
+    # main patches
+    output[:main_height, :main_width] = (
+        patches_grid[
+            :n_vertical_patches,
+            :n_horizontal_patches,
+            interior_start:interior_end,
+            interior_start:interior_end,
+        ]
+        .swapaxes(1, 2)
+        .reshape((main_height, main_width) + extra_shape)
     )
-    return patch_tensor
+    # right side patches
+    output[:main_height, main_width:] = patches_grid[
+        :n_vertical_patches,
+        n_horizontal_patches,
+        interior_start:interior_end,
+        interior_end - right_side_width : interior_end,
+    ].reshape((main_height, right_side_width) + extra_shape)
+    # down side patches
+    output[main_height:, :main_width] = (
+        patches_grid[
+            n_vertical_patches,
+            :n_horizontal_patches,
+            interior_end - down_side_height : interior_end,
+            interior_start:interior_end,
+        ]
+        .swapaxes(0, 1)
+        .reshape((down_side_height, main_width) + extra_shape)
+    )
+    # down-right corner patch
+    output[main_height:, main_width:] = patches_grid[
+        n_vertical_patches,
+        n_horizontal_patches,
+        interior_end - down_side_height : interior_end,
+        interior_end - right_side_width : interior_end,
+    ]
 
+    return output
 
-def crop_tensor(tensor: tf.Tensor, target_height: int, target_width: int) -> tf.Tensor:
+
+def get_patches_interior_bounds(
+    image_height: int, image_width: int, patch_size: int, patch_overlap: int
+) -> np.ndarray:
     """
-    Returns a cropped tensor of size (target_height, target_width).
-    First try to center the crop. If not possible, gives the most top-left part (see tests as example).
+    Get the area of the rebuilt image that each patch is responsible for.
 
-    :param tensor: The tensor to crop.
-    :param target_height: Height of the output tensor.
-    :param target_width: Width of the output tensor.
-    :return: The cropped tensor of size (target_height, target_width).
+    :param image_height: Height of the image the patches were cut from.
+    :param image_width: Width of the image the patches were cut from.
+    :param patch_size: Size of the patches.
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: An array of shape (n_patches, 4), in the get_patches_origins() order, with the
+    (row start, row end, column start, column end) bounds of each patch in the rebuilt image.
     """
-    tensor_height, tensor_width, channels_number = get_image_tensor_shape(
-        image_tensor=tensor
+    n_vertical_patches, n_horizontal_patches = get_patches_grid_shape(
+        image_height=image_height,
+        image_width=image_width,
+        patch_size=patch_size,
+        patch_overlap=patch_overlap,
     )
+    window_stride = patch_size - patch_overlap
+    rows_bounds = np.append(
+        np.arange(n_vertical_patches + 1) * window_stride, image_height - patch_overlap
+    )
+    columns_bounds = np.append(
+        np.arange(n_horizontal_patches + 1) * window_stride,
+        image_width - patch_overlap,
+    )
+    rows_starts, columns_starts = np.meshgrid(
+        rows_bounds[:-1], columns_bounds[:-1], indexing="ij"
+    )
+    rows_ends, columns_ends = np.meshgrid(
+        rows_bounds[1:], columns_bounds[1:], indexing="ij"
+    )
+    return np.stack(
+        [rows_starts, rows_ends, columns_starts, columns_ends], axis=-1
+    ).reshape(-1, 4)
 
-    # center the crop
-    height_difference = tensor_height - target_height
-    width_difference = tensor_width - target_width
-
-    assert height_difference >= 0
-    height_offset = int(height_difference // 2)
 
-    assert width_difference >= 0
-    width_offset = int(width_difference // 2)
+def paste_patches_interiors(
+    output: np.ndarray,
+    patches: np.ndarray,
+    patches_origins: np.ndarray,
+    patches_interior_bounds: np.ndarray,
+    patch_overlap: int,
+) -> np.ndarray:
+    """
+    Write the valid interior of some patches in an already rebuilt image, in place.
+    Used to update only a part of the patches of an image.
 
-    # cropping and saving
-    cropped_tensor = tf.image.crop_to_bounding_box(
-        image=tensor,
-        offset_height=height_offset,
-        offset_width=width_offset,
-        target_height=target_height,
-        target_width=target_width,
+    :param output: The rebuilt array of shape (image_height - patch_overlap, image_width - patch_overlap, ...).
+    :param patches: An array of shape (n, patch_size, patch_size, ...).
+    :param patches_origins: The (n, 2) origins of these patches, as given by get_patches_origins().
+    :param patches_interior_bounds: The (n, 4) bounds of these patches, as given by get_patches_interior_bounds().
+    :param patch_overlap: Number of pixels on which neighbors patches intersect each other.
+    :return: The updated output array.
+    """
+    # a pixel (row, column) of the rebuilt image is the pixel (row + patch_overlap / 2, column + patch_overlap / 2) of the image
+    patches_starts = (
+        patches_interior_bounds[:, [0, 2]] + patch_overlap // 2 - patches_origins
     )
-
-    # Check that the output size is correct
-    (
-        cropped_tensor_height,
-        cropped_tensor_width,
-        channels_number,
-    ) = get_image_tensor_shape(image_tensor=cropped_tensor)
-    assert (cropped_tensor_height == target_height) and (
-        cropped_tensor_height == target_width
-    ), f"\nCropped tensor shape is ({cropped_tensor_height}, {cropped_tensor_width}) : should be {target_height}, {target_width}"
-
-    return cropped_tensor
+    for (
+        patch,
+        (row_start, row_end, column_start, column_end),
+        (
+            patch_row_start,
+            patch_column_start,
+        ),
+    ) in zip(patches, patches_interior_bounds, patches_starts):
+        output[row_start:row_end, column_start:column_end] = patch[
+            patch_row_start : patch_row_start + row_end - row_start,
+            patch_column_start : patch_column_start + column_end - column_start,
+        ]
+    return output
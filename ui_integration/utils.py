@@ -1,13 +1,114 @@
+import functools
+import io
+import json
+import os
+import threading
 import time
 import numpy as np
 import tensorflow as tf
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Iterator
+
+# File of a predictions folder where the spans of its run are saved
+TRACE_FILE_NAME = "trace.json"
+# Tracers started by start_trace() and not stopped yet : every span is recorded by all of them
+ACTIVE_TRACERS = list()
 
 
 def get_formatted_time():
     return time.strftime("%Y_%m_%d__%H_%M_%S", time.localtime())
 
 
+class Tracer:
+    """Record timed spans, from any thread, as Chrome trace events, to be opened in chrome://tracing or https://ui.perfetto.dev."""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.events = list()
+        self.named_threads = set()
+        self.lock = threading.Lock()
+
+    def add_span(
+        self, name: str, start_time: float, end_time: float, args: dict
+    ) -> None:
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.named_threads:
+                self.named_threads.add(thread.ident)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start_time - self.start_time) * 1e6,
+                    "dur": (end_time - start_time) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread.ident,
+                    "args": args,
+                }
+            )
+
+    def save(self, output_path: Path) -> Path:
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(output_path, "w") as trace_file:
+            json.dump(trace, trace_file, default=str)
+        print(f"\nTrace successfully saved at : {output_path}")
+        return output_path
+
+
+@contextmanager
+def start_trace() -> Iterator[Tracer]:
+    """Record the spans of all the threads while in the context."""
+    tracer = Tracer()
+    ACTIVE_TRACERS.append(tracer)
+    try:
+        yield tracer
+    finally:
+        ACTIVE_TRACERS.remove(tracer)
+
+
+@contextmanager
+def trace_span(name: str, **args) -> Iterator[None]:
+    """Time the code in the context as a span of the active traces, if any."""
+    if not ACTIVE_TRACERS:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        for tracer in list(ACTIVE_TRACERS):
+            tracer.add_span(
+                name=name, start_time=start_time, end_time=end_time, args=args
+            )
+
+
+def traced(name: str) -> Callable:
+    """Decorator recording each call of a function as a span of the active traces, named after its stage."""
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def traced_method(*args, **kwargs):
+            with trace_span(name=name, function=method.__name__):
+                return method(*args, **kwargs)
+
+        return traced_method
+
+    return decorator
+
+
+@traced("decode")
 def decode_image(file_path: Path) -> tf.Tensor:
     """
     Turns a png or jpeg images into its tensor 3D version (dropping the 4th channel if PNG).
@@ -77,16 +178,77 @@ def get_file_name_with_extension(file_path: Path) -> str:
     return file_path.parts[-1]
 
 
-def turn_2d_tensor_to_3d_tensor(
-    tensor_2d: tf.Tensor,
+def build_palette_array(palette_rgb: {int: (int, int, int)}) -> np.ndarray:
+    """
+    Turn a palette dictionary into a lookup table, whose row i is the RGB color of class i.
+
+    :param palette_rgb: A dictionary with key <class_number> and value <(red, green, blue)>.
+    :return: A uint8 array of shape (max class number + 1, 3). The classes missing from the palette are black.
+    """
+    palette_array = np.zeros((max(palette_rgb) + 1, 3), dtype=np.uint8)
+    for class_number, rgb_color in palette_rgb.items():
+        palette_array[class_number] = rgb_color
+    return palette_array
+
+
+@traced("overlay")
+def overlay_class_map(
+    image_array: np.ndarray,
+    class_map: np.ndarray,
+    palette_array: np.ndarray,
+    alpha: float,
+    transparent_classes: (int,) = (0,),
 ) -> np.ndarray:
     """
-    Turn a 2D tensor into a 3D array by tripling the same mask layer.
+    Blend the classes colors of a categorical mask on its image, with lookups in the palette array.
+    The predictions of an image being smaller than it by the patch overlap, the image is center-cropped to the mask.
+
+    :param image_array: The RGB image, of size (image_height, image_width, 3).
+    :param class_map: The 2D categorical mask of the image, of size (height, width), at most the image size.
+    :param palette_array: The lookup table of the classes colors, see build_palette_array().
+    :param alpha: Weight of the classes colors, from 0 (the image only) to 1 (the colors only).
+    :param transparent_classes: Classes whose pixels keep the image colors, e.g. the background.
+    :return: A uint8 array of size (height, width, 3).
+    """
+    assert 0 <= alpha <= 1, f"Alpha {alpha} is not between 0 and 1."
+    image_array = np.asarray(image_array)
+    class_map = np.asarray(class_map)
+    height_offset = (image_array.shape[0] - class_map.shape[0]) // 2
+    width_offset = (image_array.shape[1] - class_map.shape[1]) // 2
+    assert (
+        height_offset >= 0 and width_offset >= 0
+    ), f"The mask of size {class_map.shape} is bigger than the image of size {image_array.shape}."
+    image_array = image_array[
+        height_offset : height_offset + class_map.shape[0],
+        width_offset : width_offset + class_map.shape[1],
+        :3,
+    ]
+
+    # the alpha of each class is looked up like its color
+    alphas_array = np.full(palette_array.shape[0], alpha, dtype=np.float32)
+    alphas_array[list(transparent_classes)] = 0
+    pixels_alphas = alphas_array[class_map][..., np.newaxis]
+    overlay_array = (
+        image_array * (1 - pixels_alphas) + palette_array[class_map] * pixels_alphas
+    )
+    return np.rint(overlay_array).astype(np.uint8)
+
+
+@traced("encode")
+def encode_png_image(image_array: np.ndarray, scale: bool = True) -> bytes:
+    """
+    Encode an image of shape (height, width, channels) as png.
 
-    :param tensor_2d: A 2D categorical tensor of size (width_size, height_size)
-    :return: A 3D array of size (width_size, height_size, 3)
+    :param image_array: The image to encode.
+    :param scale: Whether to scale its values to [0, 255] like tf.keras.preprocessing.image.save_img() does, or to keep them, e.g. for a uint8 image.
     """
-    array_2d = tensor_2d.numpy()
-    vectorize_function = np.vectorize(lambda x: (x, x, x))
-    array_3d = np.stack(vectorize_function(array_2d), axis=2)
-    return array_3d
+    buffer = io.BytesIO()
+    tf.keras.preprocessing.image.array_to_img(image_array, scale=scale).save(
+        buffer, format="PNG"
+    )
+    return buffer.getvalue()
+
+
+@traced("write")
+def write_file_bytes(file_bytes: bytes, output_path: Path) -> None:
+    Path(output_path).write_bytes(file_bytes)
@@ -0,0 +1,84 @@
+import numpy as np
+import tensorflow as tf
+from typing import Union
+
+from utils.time_utils import traced
+from constants import PALETTE_RGB
+
+# Classes whose pixels keep the colors of the image in an overlay
+OVERLAY_TRANSPARENT_CLASSES = (0,)
+# Weight of the classes colors in an overlay
+OVERLAY_ALPHA = 0.5
+
+
+def build_palette_array(palette_rgb: {int: (int, int, int)}) -> np.ndarray:
+    """
+    Turn a palette dictionary into a lookup table, whose row i is the RGB color of class i.
+
+    :param palette_rgb: A dictionary with key <class_number> and value <(red, green, blue)>.
+    :return: A uint8 array of shape (max class number + 1, 3). The classes missing from the palette are black.
+    """
+    palette_array = np.zeros((max(palette_rgb) + 1, 3), dtype=np.uint8)
+    for class_number, rgb_color in palette_rgb.items():
+        palette_array[class_number] = rgb_color
+    return palette_array
+
+
+PALETTE_ARRAY = build_palette_array(palette_rgb=PALETTE_RGB)
+
+
+@traced("colorize")
+def colorize_class_map(
+    class_map: Union[tf.Tensor, np.ndarray], palette_array: np.ndarray = PALETTE_ARRAY
+) -> np.ndarray:
+    """
+    Map each class of a categorical mask to its color, in a single lookup in the palette array.
+
+    :param class_map: A 2D categorical mask of size (height, width).
+    :param palette_array: The lookup table of the classes colors, see build_palette_array().
+    :return: A uint8 array of size (height, width, 3).
+    """
+    return palette_array[np.asarray(class_map)]
+
+
+@traced("overlay")
+def overlay_class_map(
+    image_array: Union[tf.Tensor, np.ndarray],
+    class_map: Union[tf.Tensor, np.ndarray],
+    alpha: float = OVERLAY_ALPHA,
+    transparent_classes: (int,) = OVERLAY_TRANSPARENT_CLASSES,
+    palette_array: np.ndarray = PALETTE_ARRAY,
+) -> np.ndarray:
+    """
+    Blend the classes colors of a categorical mask on its image.
+    The predictions of an image being smaller than it by the patch overlap, the image is center-cropped to the mask.
+
+    :param image_array: The RGB image, of size (image_height, image_width, 3).
+    :param class_map: The 2D categorical mask of the image, of size (height, width), at most the image size.
+    :param alpha: Weight of the classes colors, from 0 (the image only) to 1 (the colors only).
+    :param transparent_classes: Classes whose pixels keep the image colors, e.g. the background.
+    :param palette_array: The lookup table of the classes colors, see build_palette_array().
+    :return: A uint8 array of size (height, width, 3).
+    """
+    assert 0 <= alpha <= 1, f"Alpha {alpha} is not between 0 and 1."
+    image_array = np.asarray(image_array)
+    class_map = np.asarray(class_map)
+    height_offset = (image_array.shape[0] - class_map.shape[0]) // 2
+    width_offset = (image_array.shape[1] - class_map.shape[1]) // 2
+    assert (
+        height_offset >= 0 and width_offset >= 0
+    ), f"The mask of size {class_map.shape} is bigger than the image of size {image_array.shape}."
+    image_array = image_array[
+        height_offset : height_offset + class_map.shape[0],
+        width_offset : width_offset + class_map.shape[1],
+        :3,
+    ]
+
+    # the alpha of each class is looked up like its color
+    alphas_array = np.full(palette_array.shape[0], alpha, dtype=np.float32)
+    alphas_array[list(transparent_classes)] = 0
+    pixels_alphas = alphas_array[class_map][..., np.newaxis]
+    overlay_array = (
+        image_array * (1 - pixels_alphas) + palette_array[class_map] * pixels_alphas
+    )
+    return np.rint(overlay_array).astype(np.uint8)
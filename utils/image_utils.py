@@ -1,11 +1,21 @@
+import io
 import random
 import shutil
+import numpy as np
 import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 from loguru import logger
 from pathlib import Path
 
+from utils.time_utils import traced
+from constants import MASK_TRUE_VALUE, MASK_FALSE_VALUE
 
+# Threads encoding and writing the binary masks of a class map, the png compression releasing the GIL
+MASKS_WRITER_THREADS = 4
+
+
+@traced("decode")
 def decode_image(file_path: Path) -> tf.Tensor:
     """
     Turns a png or jpeg images into its tensor 3D (for jpeg) or 4D (for png) version.
@@ -158,6 +168,84 @@ def save_tensor_to_jpg(tensor: tf.Tensor, output_filepath: Path) -> None:
     )
 
 
+def save_png_image(image_array, output_path: Path, scale: bool = True) -> Path:
+    """Save an image as png, like tf.keras.preprocessing.image.save_img() does, the encoding and the writing being traced apart."""
+    write_file_bytes(
+        file_bytes=encode_png_image(image_array=image_array, scale=scale),
+        output_path=output_path,
+    )
+    return output_path
+
+
+@traced("encode")
+def encode_png_image(image_array, scale: bool = True) -> bytes:
+    """
+    Encode an image of shape (height, width, channels) as png.
+
+    :param image_array: The image to encode.
+    :param scale: Whether to scale its values to [0, 255] like save_img() does, or to keep them, e.g. for a uint8 image.
+    """
+    buffer = io.BytesIO()
+    tf.keras.preprocessing.image.array_to_img(image_array, scale=scale).save(
+        buffer, format="PNG"
+    )
+    return buffer.getvalue()
+
+
+@traced("write")
+def write_file_bytes(file_bytes: bytes, output_path: Path) -> None:
+    Path(output_path).write_bytes(file_bytes)
+
+
+@traced("binarize")
+def split_class_map(class_map, class_numbers: [int]) -> np.ndarray:
+    """
+    Split a categorical mask into the binary masks of several classes, in a single comparison broadcast over the classes.
+
+    :param class_map: A 2D categorical mask of size (height, width).
+    :param class_numbers: The classes to get the binary masks of.
+    :return: A uint8 array of size (len(class_numbers), height, width), valued MASK_TRUE_VALUE where the pixel is of the class, and MASK_FALSE_VALUE elsewhere.
+    """
+    class_map = np.asarray(class_map)
+    return np.where(
+        class_map[np.newaxis] == np.asarray(class_numbers)[:, np.newaxis, np.newaxis],
+        np.uint8(MASK_TRUE_VALUE),
+        np.uint8(MASK_FALSE_VALUE),
+    )
+
+
+def save_binary_masks(class_map, output_paths_dict: {int: Path}) -> {int: Path}:
+    """
+    Save the binary masks of several classes of a categorical mask as single-channel png images.
+    The class map is split once, and the masks are encoded and written by a pool of MASKS_WRITER_THREADS threads.
+
+    :param class_map: A 2D categorical mask of size (height, width).
+    :param output_paths_dict: A dictionary with key <class_number> and value <mask_output_path>.
+    :return: The same dictionary, once every mask is written.
+    """
+    binary_masks_array = split_class_map(
+        class_map=class_map, class_numbers=list(output_paths_dict)
+    )
+    with ThreadPoolExecutor(
+        max_workers=min(MASKS_WRITER_THREADS, len(output_paths_dict)) or 1
+    ) as masks_writer:
+        masks_futures = [
+            masks_writer.submit(
+                save_png_image,
+                image_array=binary_mask_array[:, :, np.newaxis],
+                output_path=output_path,
+                scale=False,
+            )
+            for binary_mask_array, output_path in zip(
+                binary_masks_array, output_paths_dict.values()
+            )
+        ]
+        # raise the exceptions of the writer threads, if any
+        for mask_future in masks_futures:
+            mask_future.result()
+    return output_paths_dict
+
+
 def get_image_patches_paths_with_limit(
     patches_dir: Path,
     n_patches_limit: int = None,
@@ -12,10 +12,10 @@ from utils.image_utils import (
     decode_image,
     get_image_name_without_extension,
 )
+from utils.colorization import colorize_class_map
 from constants import (
     MAPPING_CLASS_NUMBER,
     PALETTE_RGB_NORMALIZED,
-    PALETTE_RGB,
     PALETTE_HEXA,
 )
 
@@ -107,27 +107,9 @@ def map_categorical_mask_to_3_color_channels_tensor(
     Turn a 2D tensor into a 3D array by converting its categorical values in its RGB correspondent values.
 
     :param categorical_mask_tensor: A 2D categorical tensor of size (width_size, height_size)
-    :return: A 3D array of size (width_size, height_size, 3)
+    :return: A 3D uint8 array of size (width_size, height_size, 3)
     """
-    categorical_mask_array = categorical_mask_tensor.numpy()
-    vectorize_function = np.vectorize(lambda x: PALETTE_RGB[x])
-    three_channels_array = np.stack(vectorize_function(categorical_mask_array), axis=2)
-    return three_channels_array
-
-
-def turn_2d_tensor_to_3d_tensor(
-    tensor_2d: tf.Tensor,
-) -> np.ndarray:
-    """
-    Turn a 2D tensor into a 3D array by tripling the same mask layer.
-
-    :param tensor_2d: A 2D categorical tensor of size (width_size, height_size)
-    :return: A 3D array of size (width_size, height_size, 3)
-    """
-    array_2d = tensor_2d.numpy()
-    vectorize_function = np.vectorize(lambda x: (x, x, x))
-    array_3d = np.stack(vectorize_function(array_2d), axis=2)
-    return array_3d
+    return colorize_class_map(class_map=categorical_mask_tensor)
 
 
 def full_plot_image(
@@ -1,5 +1,17 @@
+import functools
+import json
+import os
+import threading
 import time
+from contextlib import contextmanager
 from loguru import logger
+from pathlib import Path
+from typing import Callable, Iterator
+
+# File of a report folder where the spans of its run are saved
+TRACE_FILE_NAME = "trace.json"
+# Tracers started by start_trace() and not stopped yet : every span is recorded by all of them
+ACTIVE_TRACERS = list()
 
 
 def timeit(method):
@@ -28,3 +40,128 @@ def timeit(method):
 
 def get_formatted_time():
     return time.strftime("%Y_%m_%d__%H_%M_%S", time.localtime())
+
+
+class Tracer:
+    """
+    Record timed spans, from any thread, as Chrome trace events.
+    The saved file can be opened in chrome://tracing or https://ui.perfetto.dev, with a row per thread.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.events = list()
+        self.named_threads = set()
+        self.lock = threading.Lock()
+
+    def add_span(
+        self, name: str, start_time: float, end_time: float, args: dict
+    ) -> None:
+        """
+        :param name: The name of the stage.
+        :param start_time: The time.perf_counter() value when the span started.
+        :param end_time: The time.perf_counter() value when the span ended.
+        :param args: Details shown with the span, e.g. the image name.
+        """
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.named_threads:
+                self.named_threads.add(thread.ident)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start_time - self.start_time) * 1e6,
+                    "dur": (end_time - start_time) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread.ident,
+                    "args": args,
+                }
+            )
+
+    def get_stages_durations(self) -> {str: float}:
+        """Get the total duration of each stage, in seconds."""
+        stages_durations = dict()
+        with self.lock:
+            for event in self.events:
+                if event["ph"] == "X":
+                    stages_durations[event["name"]] = (
+                        stages_durations.get(event["name"], 0) + event["dur"] / 1e6
+                    )
+        return stages_durations
+
+    def log_stages_durations(self) -> None:
+        """Log the stages from the longest one. The nested spans are counted in their parent span too."""
+        logger.info(
+            "\nTime spent per stage, summed over the threads :\n"
+            + "\n".join(
+                f"  {stage} : {duration:.2f}s"
+                for stage, duration in sorted(
+                    self.get_stages_durations().items(), key=lambda item: -item[1]
+                )
+            )
+        )
+
+    def save(self, output_path: Path) -> Path:
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(output_path, "w") as trace_file:
+            json.dump(trace, trace_file, default=str)
+        logger.info(f"\nTrace successfully saved at : {output_path}")
+        return output_path
+
+
+@contextmanager
+def start_trace() -> Iterator[Tracer]:
+    """
+    Record the spans of all the threads while in the context, e.g. :
+        with start_trace() as tracer:
+            make_predictions(...)
+        tracer.save(output_path=report_dir_path / TRACE_FILE_NAME)
+    """
+    tracer = Tracer()
+    ACTIVE_TRACERS.append(tracer)
+    try:
+        yield tracer
+    finally:
+        ACTIVE_TRACERS.remove(tracer)
+
+
+@contextmanager
+def trace_span(name: str, **args) -> Iterator[None]:
+    """Time the code in the context as a span of the active traces, if any : without a trace, it costs nothing."""
+    if not ACTIVE_TRACERS:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        for tracer in list(ACTIVE_TRACERS):
+            tracer.add_span(
+                name=name, start_time=start_time, end_time=end_time, args=args
+            )
+
+
+def traced(name: str) -> Callable:
+    """Decorator recording each call of a function as a span of the active traces, named after its stage."""
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def traced_method(*args, **kwargs):
+            with trace_span(name=name, function=method.__name__):
+                return method(*args, **kwargs)
+
+        return traced_method
+
+    return decorator